@@ -1,52 +1,309 @@
 #!/usr/bin/env python3
 
+# only what printing the pre-computed JSON for an empty query needs is imported up front,
+# the rest is imported by the functions that use it
+from __future__ import annotations
+
+import os
+import re
 import sys
-from workflow import Workflow3
-from workflow.workflow3 import Item3
 from config import (
-    pre_computed_rows_json,
-    pre_computed_rows_msgpack,
-    message_preview_len,
+    row_store_bin,
+    pre_computed_rows_meta_msgpack,
+    pre_computed_rows_text_msgpack,
+    pre_computed_rows_meta_json,
+    pre_computed_rows_text_json,
+    search_index_msgpack,
+    search_index_json,
+    trigram_index_bin,
+    search_db_path,
+    tfidf_index_npz,
     alfred_subtitle_max_length,
-    alfred_workflow_cache_key,
     pre_computed_alfred_json,
-)
-from utils import (
-    search_and_extract_preview,
+    pre_computed_alfred_pages_dir,
+    alfred_json_page_size,
+    page_query_prefix,
+    regex_query_prefix,
+    fuzzy_query_prefix,
+    related_query_prefix,
+    search_backend,
+    max_results,
+    preview_mode,
 )
 
+# `typing.TYPE_CHECKING`, without importing `typing`
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import Any, Callable, Iterable, Mapping, TypeVar
+    from search_index import SearchIndex, TrigramIndex
 
-def filter_query(rows: list[dict], query: str) -> list[dict]:
-    new_rows = []
-    for row in rows:
-        long_str = row['_search_key']
-        for subquery in query.lower().split('|'):
-            if '=' in subquery:
-                k, _, v = subquery.partition('=')
-                if k not in row:
-                    break
-                if v.strip().lower() not in row[k].lower():
-                    break
-            else:
-                if subquery not in long_str:
-                    break
+    T = TypeVar('T')
+
+
+def filter_row_ids(
+    rows: list[Mapping[str, Any]],
+    query: str,
+    index: SearchIndex | None = None,
+    trigram_index: TrigramIndex | None = None,
+    candidates: Iterable[int] | None = None,
+) -> list[int]:
+    """
+    Ids of the `rows` matching `query`.
+
+    If `candidates` is given (e.g. the matches of a query that `query` narrows down),
+    only those rows are checked, otherwise only the ones the indexes can't rule out.
+    """
+    if query.startswith(regex_query_prefix):
+        pattern = query[len(regex_query_prefix) :]
+        compiled = re.compile(pattern, re.IGNORECASE)
+        if candidates is None and trigram_index is not None:
+            candidates = trigram_index.regex_candidates(pattern)
+        return [
+            i
+            for i in _row_ids(rows, candidates)
+            if compiled.search(rows[i]['_search_key'])
+        ]
+
+    from field_filters import parse_field_filter, row_matches
+    from search_index import tokenize, title_words, similar_words
+
+    subqueries = query.lower().split('|')
+    fuzzy_words = [
+        word
+        for x in subqueries
+        if x.startswith(fuzzy_query_prefix)
+        for word in tokenize(x[len(fuzzy_query_prefix) :])
+    ]
+    plain_subqueries = [x for x in subqueries if not x.startswith(fuzzy_query_prefix)]
+    terms = [x for x in plain_subqueries if '=' not in x]
+    filters = [parse_field_filter(x) for x in plain_subqueries if '=' in x]
+    if candidates is None:
+        for x in (index, trigram_index):
+            if x is not None and (x_candidates := x.candidates(subqueries)) is not None:
+                candidates = (
+                    x_candidates if candidates is None else x_candidates & candidates
+                )
+    ids_to_check = _row_ids(rows, candidates)
+    # for each fuzzy word, the words of the titles it can be a misspelling of
+    similar: list[set[str]] = []
+    if fuzzy_words:
+        if index is not None and index.titles is not None:
+            similar = [index.titles.similar_words(x) for x in fuzzy_words]
         else:
-            new_rows.append(row)
-    return new_rows
+            words = {x for i in ids_to_check for x in title_words(rows[i])}
+            similar = [similar_words(x, words) for x in fuzzy_words]
+    row_ids = []
+    for i in ids_to_check:
+        row = rows[i]
+        # the filters are cheaper to check, and don't read the row's `_search_key`
+        if (
+            all(row_matches(row, k, v) for k, v in filters)
+            and (not similar or all(not x.isdisjoint(title_words(row)) for x in similar))
+            and all(x in row['_search_key'] for x in terms)
+        ):
+            row_ids.append(i)
+    return row_ids
+
+
+def _row_ids(
+    rows: list[Mapping[str, Any]], candidates: Iterable[int] | None
+) -> Iterable[int]:
+    if candidates is None:
+        return range(len(rows))
+    # only the rows that can match need to be checked
+    return sorted(i for i in candidates if i < len(rows))
+
+
+def filter_query(
+    rows: list[Mapping[str, Any]],
+    query: str,
+    index: SearchIndex | None = None,
+    trigram_index: TrigramIndex | None = None,
+) -> list[Mapping[str, Any]]:
+    return [rows[i] for i in filter_row_ids(rows, query, index, trigram_index)]
+
+
+# how much more a hit in the title counts than hits in the messages, which count less the more there are
+title_hit_weight = 10.0
+# the recency score of a conversation halves after this many days
+recency_half_life_days = 30
+
+
+def rank_rows(
+    rows: list[Mapping[str, Any]], query: str, k: int
+) -> list[Mapping[str, Any]]:
+    """
+    The `k` (all if 0) most relevant of the `rows` matching `query`, most relevant first:
+    by hits in the title, then (diminishingly) by hits in the messages, then by recency.
+    """
+    import heapq
+    from math import log1p
+    from datetime import datetime
+
+    if query.startswith(regex_query_prefix):
+        pattern = re.compile(query[len(regex_query_prefix) :], re.IGNORECASE)
+
+        def count_hits(text: str) -> int:
+            # counting every match of a regex can take as long as the whole search
+            return 1 if pattern.search(text) else 0
+
+    else:
+        terms = [
+            x
+            for x in query.lower().split('|')
+            if '=' not in x and not x.startswith(fuzzy_query_prefix) and x.strip()
+        ]
+
+        def count_hits(text: str) -> int:
+            return sum(text.count(x) for x in terms)
+
+    now = datetime.now()
+
+    def score(row: Mapping[str, Any]) -> float:
+        title_hits = count_hits((row.get('title') or '').lower())
+        # the search key includes the title
+        message_hits = max(0, count_hits(row['_search_key']) - title_hits)
+        try:
+            age_days = (now - datetime.fromisoformat(row['update_time'])).days
+        except (KeyError, TypeError, ValueError):
+            age_days = None
+        recency = (
+            0.0 if age_days is None else 0.5 ** (max(0, age_days) / recency_half_life_days)
+        )
+        return title_hit_weight * log1p(title_hits) + log1p(message_hits) + recency
+
+    # a bounded heap, so that only `k` rows are kept however many match
+    return heapq.nlargest(k or len(rows), rows, key=score)
 
 
-def get_rows() -> list[dict]:
+def get_snippet_pattern(query: str) -> tuple[re.Pattern | None, list[str]]:
+    """
+    The pattern to find the snippets of the messages matching `query` with (None if it has
+    no terms), and its terms (none for a regular expression).
+    """
+    if query.startswith(regex_query_prefix):
+        return re.compile(query[len(regex_query_prefix) :], re.IGNORECASE), []
+    from utils import get_terms_pattern
+
+    terms = list(
+        {
+            x
+            for x in query.lower().split('|')
+            if '=' not in x and not x.startswith(fuzzy_query_prefix) and x.strip()
+        }
+    )
+    return (get_terms_pattern(terms) if terms else None), terms
+
+
+# what `resident` has loaded, by key, with the fingerprint of the files it was loaded from;
+# None unless the process keeps them around between queries (see `alfred_daemon.py`)
+_resident: dict[Any, tuple[list, Any]] | None = None
+
+
+def keep_resident():
+    """Keep the rows and indexes loaded for the next calls of `main`, until their files change"""
+    global _resident
+    if _resident is None:
+        _resident = {}
+
+
+def resident(key: Any, paths: Iterable[Path], load: Callable[[], T]) -> T:
+    """`load()`, or what it returned last time if `keep_resident` and none of `paths` changed"""
+    if _resident is None:
+        return load()
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = path.stat()
+            fingerprint.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            fingerprint.append(None)
+    if key in _resident and _resident[key][0] == fingerprint:
+        return _resident[key][1]
+    value = load()
+    _resident[key] = (fingerprint, value)
+    return value
+
+
+def get_rows(
+    text: bool = True, first: int | None = None
+) -> tuple[list[Mapping[str, Any]], int]:
+    """The first `first` (all if None) rows, most recently updated first, and the number of rows"""
+    from row_store import RowStore, load_split_rows
+
+    # only decodes the message bodies of the rows that are searched or shown,
+    # and the other fields of the first rows
+    row_store = RowStore.load(first)
+    if row_store is not None:
+        return row_store.rows(), row_store.num_rows
+    # the message text is only read if `text`
+    return load_split_rows(text, first) or ([], 0)
+
+
+def load_rows(
+    text: bool = True, first: int | None = None
+) -> tuple[list[Mapping[str, Any]], int]:
+    return resident(
+        ('rows', text, first),
+        [
+            row_store_bin,
+            pre_computed_rows_meta_msgpack,
+            pre_computed_rows_text_msgpack,
+            pre_computed_rows_meta_json,
+            pre_computed_rows_text_json,
+        ],
+        lambda: get_rows(text, first),
+    )
+
+
+def read_alfred_json_page(page: int) -> str:
+    """
+    The pre-computed Alfred JSON of the `page`th page of the most recently updated conversations,
+    or of every conversation if they aren't paged
+    """
+    path = pre_computed_alfred_pages_dir / f'{page}.json'
+    if not alfred_json_page_size or (page == 1 and not path.exists()):
+        # not imported since `alfred_json_page_size` was set
+        return resident(
+            'alfred_json', [pre_computed_alfred_json], pre_computed_alfred_json.read_text
+        )
     try:
-        import msgpack
+        alfred_json = resident(('alfred_json', page), [path], path.read_text)
+    except FileNotFoundError:
+        import io
 
-        return msgpack.unpackb(pre_computed_rows_msgpack.read_bytes())
-    except ImportError:
+        output = io.StringIO()
+        send_items([message_item(f'No page {page}')], output)
+        return output.getvalue()
+    if preview_mode == 'pack':
         import json
 
-        return json.loads(pre_computed_rows_json.read_text())
+        # for Quick Look
+        paths = [x['quicklookurl'] for x in json.loads(alfred_json)['items'] if x['valid']]
+        if missing := [
+            os.path.basename(x).removesuffix('.md') for x in paths if not os.path.exists(x)
+        ]:
+            from preview_pack import extract_previews
+
+            extract_previews(missing)
+    return alfred_json
 
 
-def main(wf: Workflow3):
+def get_args(argv: list[str]):
+    """Get command-line arguments"""
+    if len(argv) <= 1 and not any(x.startswith('-') for x in argv):
+        # just the query, as Alfred runs it, parsed without importing argparse
+        from types import SimpleNamespace
+
+        return SimpleNamespace(
+            generate_alfred_json=False,
+            first=None,
+            backend=search_backend,
+            max_results=max_results,
+            query=argv[0] if argv else None,
+        )
+
     import argparse
 
     parser = argparse.ArgumentParser(
@@ -57,111 +314,274 @@ def main(wf: Workflow3):
         '-g', '--generate-alfred-json', action='store_true', help='Generate Alfred JSON'
     )
     parser.add_argument(
-        '-n', '--first', type=int, help='Only consider the last N chats. Default is all, can be slow if your has a lot of chats.', metavar='N'
+        '-n', '--first', type=int, help='Only consider the N most recently updated chats, without reading the others. Default is all', metavar='N'
+    )
+    parser.add_argument(
+        '-b',
+        '--backend',
+        choices=['scan', 'fts'],
+        default=search_backend,
+        help='Search by scanning the rows, or with SQLite FTS5 (whole words, ranked by bm25)',
+    )
+    parser.add_argument(
+        '-k',
+        '--max-results',
+        type=int,
+        default=max_results,
+        help='Only show the K most relevant matches, 0 for all of them',
+        metavar='K',
     )
     parser.add_argument('query', nargs='?', default=None)
-    args = parser.parse_args(wf.args)
-    query = args.query
-    if not query and not args.generate_alfred_json:
-        print(pre_computed_alfred_json.read_text())
+    return parser.parse_args(argv)
+
+
+def message_item(title: str, subtitle: str = '') -> dict:
+    """The item `Workflow3.add_item(title, subtitle)` adds"""
+    return {'title': title, 'subtitle': subtitle, 'valid': False}
+
+
+def send_items(items: list[dict], file=None):
+    """Write `items` as Alfred Script Filter JSON, like `Workflow3.send_feedback` does"""
+    import json
+
+    file = file or sys.stdout
+    if os.environ.get('alfred_debug') == '1':
+        # Alfred's debugger is open
+        json.dump({'items': items}, file, indent=2, separators=(',', ': '))
+    else:
+        json.dump({'items': items}, file)
+    file.flush()
+
+
+def send_item_fragments(fragments: list[str], file=None):
+    """`send_items` for items that are already encoded as JSON"""
+    if os.environ.get('alfred_debug') == '1':
+        import json
+
+        send_items([json.loads(x) for x in fragments], file)
         return
-    rows: list[dict]
-    # rows = wf.cached_data(alfred_workflow_cache_key, get_rows, max_age=3600)  # type: ignore
-    rows = get_rows()
-    if args.first:
-        rows = rows[: args.first]
-        
-
-    def prepare_wf_items(query: str | None = None):
-        for row in rows:
-            if query:
-
-                def get_message_preview(preview_len: int = message_preview_len) -> str:
-                    if query:
-                        message_preview = search_and_extract_preview(
-                            query,
-                            row['concatenated_messages'].strip(),
-                            message_preview_len,
-                            False,
-                        )
-                    else:
-                        message_preview = row['concatenated_messages'].strip()[
-                            :message_preview_len
-                        ]
-                    return message_preview
-
-                message_preview = get_message_preview(alfred_subtitle_max_length)
+    file = file or sys.stdout
+    file.write('{"items": [' + ', '.join(fragments) + ']}')
+    file.flush()
+
+
+def main(argv: list[str]):
+    args = get_args(argv)
+    query = args.query
+    if not args.generate_alfred_json:
+        if not query:
+            print(read_alfred_json_page(1))
+            return
+        if alfred_json_page_size and query.startswith(page_query_prefix):
+            page = query[len(page_query_prefix) :].strip()
+            if page.isdigit() and int(page) > 0:
+                print(read_alfred_json_page(int(page)))
             else:
-                message_preview = row['_message_preview']
-            item = Item3(
-                title=row['_title'],
-                subtitle=f"{message_preview}",
-                quicklookurl=row['_quicklookurl'],
-                arg=row['_chatgpt_url'],
-                valid=True,
-                **row['_item3_kwargs'],
-            )
-            item.add_modifier(
-                'cmd',
-                subtitle='Open on TypingMind',
-                arg=row['_typingmind_url'],
-                valid=True,
-                **row['_item3_kwargs'],
-            )
-            # item.add_modifier(
-            #     'alt',
-            #     subtitle='Search Google',
-            #     arg=row['non_key_google_search_url'],
-            #     valid=True,
-            # )
-            # item.add_modifier(
-            #     'shift', subtitle='Search 133', arg=row['non_key_133_url'], valid=True
-            # )
-            # item.add_modifier(
-            #     'ctrl',
-            #     subtitle='View row',
-            #     arg=pformat(
-            #         {
-            #             k: v
-            #             for k, v in row.items()
-            #             if v
-            #             and v not in ('USD', 'CAD')
-            #             and not re.match(r'(/|http|0.00)', v)
-            #         }
-            #     ),
-            #     valid=True,
-            # )
-            # from icecream import ic
-
-            # ic(row)
-            # wf.add_item(item)
-            wf._items.append(item)
+                send_items([message_item('Invalid page', 'Expected page=2, page=3, ...')])
+            return
+
+    from utils import (
+        row_to_alfred_item_fragment,
+        fill_alfred_item_fragment,
+        extract_snippet,
+    )
+    from search_index import SearchIndex, TrigramIndex
+    from query_cache import QueryCache
+    from field_filters import InvalidFilterError, parse_field_filter
+
+    # the conversation to show the related ones of
+    related_id = (
+        query[len(related_query_prefix) :].strip()
+        if query and query.startswith(related_query_prefix)
+        else None
+    )
+    if query and not query.startswith(regex_query_prefix) and related_id is None:
+        try:
+            for subquery in query.lower().split('|'):
+                if '=' in subquery and not subquery.startswith(fuzzy_query_prefix):
+                    parse_field_filter(subquery)
+        except InvalidFilterError as e:
+            send_items([message_item('Invalid filter', str(e))])
+            return
+
+    rows: list[Mapping[str, Any]]
+    # ids of the matching rows, best match first, if FTS5 can answer the query
+    row_ids = None
+    if query and args.backend == 'fts' and related_id is None:
+        from search_db import SearchDB
+
+        if (search_db := resident('search_db', [search_db_path], SearchDB.load)) is not None:
+            row_ids = search_db.search(query, args.first, args.max_results)
+    # the rows `--first` doesn't consider aren't decoded at all
+    first = args.first or None
+    rows, num_rows = load_rows(
+        text=bool(query) and row_ids is None and related_id is None, first=first
+    )
+    if row_ids is not None and search_db.num_rows != num_rows:
+        # out of date, scan instead
+        row_ids = None
+        rows, num_rows = load_rows(first=first)
+    query_cache = (
+        QueryCache(args.first) if query and row_ids is None and related_id is None else None
+    )
+    # the matches of a previous query this one narrows down, the only rows to check
+    cached_row_ids = query_cache.get(query) if query_cache is not None else None
+    # the indexes are only needed to search all rows
+    scan = query_cache is not None and cached_row_ids is None
+    index = (
+        resident('index', [search_index_msgpack, search_index_json], SearchIndex.load)
+        if scan
+        else None
+    )
+    if index is not None and index.num_rows != num_rows:
+        # out of date
+        index = None
+    trigram_index = (
+        resident('trigram_index', [trigram_index_bin], TrigramIndex.load)
+        if scan
+        else None
+    )
+    if trigram_index is not None and trigram_index.num_rows != num_rows:
+        trigram_index = None
+    if related_id is not None:
+        from related_index import TfidfIndex
+
+        tfidf_index = resident('tfidf_index', [tfidf_index_npz], TfidfIndex.load)
+        if tfidf_index is not None and tfidf_index.num_rows != num_rows:
+            tfidf_index = None
+
+    def prepare_items(query: str | None = None) -> list[str]:
+        # the subtitles show the part of the messages with the most terms of the query
+        pattern, terms = get_snippet_pattern(query) if query else (None, [])
+        fragments = []
+        for row in rows:
+            message_preview = row['_message_preview']
+            if pattern is not None and (messages := row['concatenated_messages']):
+                offset = row.get('_search_key_messages_offset', -1)
+                lower = row['_search_key'] if offset >= 0 else None
+                # the scan stops once it has found every term that's in the messages, which
+                # `str.find` tells much faster than the scan when there's more than one
+                num_terms = (
+                    sum(lower.find(x, offset, offset + len(messages)) >= 0 for x in terms)
+                    if lower is not None and len(terms) > 1
+                    else len(terms) or 1
+                )
+                snippet, _ = extract_snippet(
+                    pattern,
+                    messages,
+                    alfred_subtitle_max_length,
+                    lower,
+                    max(0, offset),
+                    num_terms,
+                )
+                message_preview = snippet or message_preview
+            # split rows loaded without their text, and older rows, don't have one
+            fragment = row.get('_alfred_item') or row_to_alfred_item_fragment(row)
+            fragments.append(fill_alfred_item_fragment(fragment, f'{message_preview}'))
+        return fragments
 
     if args.generate_alfred_json:
-        prepare_wf_items()
-        from contextlib import redirect_stdout
+        from utils import write_alfred_json
 
-        with open(pre_computed_alfred_json, 'w') as f:
-            with redirect_stdout(f):
-                wf.send_feedback()
-        print(f'Generated {pre_computed_alfred_json}')
+        if num_pages := write_alfred_json(rows):
+            print(f'Generated {num_pages} pages in {pre_computed_alfred_pages_dir}')
+        else:
+            print(f'Generated {pre_computed_alfred_json}')
         return
     if not rows:
-        wf.add_item('No results found')
-        wf.send_feedback()
+        send_items([message_item('No results found')])
         return
-    if query:
-        rows = filter_query(rows, query)
+    if row_ids is not None:
+        rows = [rows[i] for i in row_ids]
+    elif related_id is not None:
+        if tfidf_index is None:
+            send_items(
+                [
+                    message_item(
+                        'No index of related conversations',
+                        'Install NumPy and run preprocess_conversations.py',
+                    )
+                ]
+            )
+            return
+        row_id = next((i for i, row in enumerate(rows) if row['id'] == related_id), None)
+        if row_id is None:
+            send_items([message_item('No conversation with this id', related_id)])
+            return
+        rows = [
+            rows[i]
+            for i in tfidf_index.related(
+                row_id, args.max_results or len(rows), len(rows)
+            )
+        ]
+    elif query:
+        try:
+            matches = filter_row_ids(rows, query, index, trigram_index, cached_row_ids)
+            if query_cache is not None:
+                query_cache.add(query, matches)
+            rows = rank_rows([rows[i] for i in matches], query, args.max_results)
+        except re.error as e:
+            send_items([message_item('Invalid regular expression', str(e))])
+            return
 
     if not rows:
-        wf.add_item('No matching results found')
-        wf.send_feedback()
+        send_items([message_item('No matching results found')])
         return
-    prepare_wf_items()
-    # Send the results to Alfred as XML
-    wf.send_feedback()
+    if preview_mode == 'pack' and (
+        missing := [row['id'] for row in rows if not os.path.exists(row['_quicklookurl'])]
+    ):
+        from preview_pack import extract_previews
+
+        # for Quick Look
+        extract_previews(missing)
+    # Send the results to Alfred as JSON
+    send_item_fragments(prepare_items(query))
+
+
+def _raise(e: Exception):
+    raise e
+
+
+def run(argv: list[str]) -> int:
+    """
+    Run `main` without constructing a `Workflow3`, which imports and reads a lot more than
+    printing the results needs, unless it fails, so that `Workflow3.run` shows the error in Alfred.
+    """
+    from io import StringIO
+    from contextlib import redirect_stdout
+
+    # nothing is printed unless `main` succeeds, so that the error is all Alfred gets otherwise
+    output = StringIO()
+    try:
+        with redirect_stdout(output):
+            main(argv)
+    except Exception as e:
+        from workflow import Workflow3
+
+        # show the error `main` raised, without running the query again
+        return Workflow3().run(lambda wf: _raise(e))
+    except SystemExit:
+        # e.g. `--help`
+        sys.stdout.write(output.getvalue())
+        raise
+    sys.stdout.write(output.getvalue())
+    return 0
 
 
 if __name__ == '__main__':
-    wf = Workflow3()
-    sys.exit(wf.run(main))
+    from unicodedata import normalize
+
+    # the NFC normalization `Workflow3.args` applies
+    argv = [normalize('NFC', x) for x in sys.argv[1:]]
+    if any(x.startswith('workflow:') for x in argv):
+        # Alfred-Workflow's magic arguments, e.g. `workflow:delcache`
+        from workflow import Workflow3
+
+        sys.exit(Workflow3().run(lambda wf: main(wf.args)))
+    # hand the query to the resident daemon if it's running
+    from alfred_daemon import query_daemon
+
+    if (output := query_daemon(argv)) is not None:
+        sys.stdout.write(output)
+        sys.exit(0)
+    sys.exit(run(argv))
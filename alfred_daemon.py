@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Author : Xinyuan Chen <45612704+tddschn@users.noreply.github.com>
+Date   : 2024-08-24
+Purpose: Answer alfred.py queries from a resident process over a Unix domain socket
+"""
+
+import os
+import sys
+import json
+import stat
+from config import daemon_socket_dir, daemon_socket_path
+
+# give up on the daemon and answer in-process if it takes longer than this
+client_timeout_seconds = 5
+
+
+def is_private(path: os.PathLike, file_type: int) -> bool:
+    """
+    Whether `path` is a file of `file_type` (e.g. `stat.S_IFSOCK`, not a symlink to one)
+    owned by this user, that (if it's a directory) no one else can access
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_IFMT(st.st_mode) == file_type
+        and st.st_uid == os.getuid()
+        and not (file_type == stat.S_IFDIR and st.st_mode & 0o077)
+    )
+
+
+def query_daemon(argv: list[str]) -> str | None:
+    """
+    The Alfred JSON the daemon answers `argv` (the arguments of `alfred.py`) with,
+    None if it isn't running or fails to answer.
+    """
+    if any(x.startswith('workflow:') for x in argv):
+        # Alfred-Workflow's magic arguments are handled in-process
+        return None
+    # the items and args it answers with are opened or run, so only trust a daemon of this user
+    if not (
+        is_private(daemon_socket_dir, stat.S_IFDIR)
+        and is_private(daemon_socket_path, stat.S_IFSOCK)
+    ):
+        return None
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(client_timeout_seconds)
+            sock.connect(str(daemon_socket_path))
+            # Alfred's environment variables, e.g. whether its debugger is open
+            env = {k: v for k, v in os.environ.items() if k.startswith('alfred_')}
+            sock.sendall(json.dumps({'argv': argv, 'env': env}).encode() + b'\n')
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while chunk := sock.recv(1 << 16):
+                chunks.append(chunk)
+    except OSError:
+        return None
+    # the daemon answers with nothing if it failed
+    return b''.join(chunks).decode() or None
+
+
+def is_running() -> bool:
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(daemon_socket_path))
+        return True
+    except OSError:
+        return False
+
+
+def serve():
+    import io
+    import signal
+    import socketserver
+    import traceback
+    from contextlib import redirect_stderr, redirect_stdout
+    import alfred
+
+    alfred.keep_resident()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = self.rfile.readline()
+            if not request:
+                # `is_running` checking
+                return
+            request = json.loads(request)
+            for k in [k for k in os.environ if k.startswith('alfred_')]:
+                del os.environ[k]
+            os.environ.update(request.get('env', {}))
+            output = io.StringIO()
+            try:
+                with redirect_stdout(output), redirect_stderr(io.StringIO()):
+                    alfred.main(request['argv'])
+            except SystemExit:
+                # argparse exits on `--help` and bad arguments, which `alfred.py` handles itself
+                return
+            except Exception:
+                traceback.print_exc()
+                return
+            self.wfile.write(output.getvalue().encode())
+
+    try:
+        daemon_socket_dir.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+    if not is_private(daemon_socket_dir, stat.S_IFDIR):
+        sys.exit(
+            f'{daemon_socket_dir} has to be a directory that only you can access, remove it first'
+        )
+    if daemon_socket_path.exists():
+        if is_running():
+            sys.exit(f'Already running on {daemon_socket_path}')
+        # left behind by a daemon that didn't exit cleanly
+        daemon_socket_path.unlink()
+    old_umask = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(str(daemon_socket_path), Handler)
+    finally:
+        os.umask(old_umask)
+    print(f'Listening on {daemon_socket_path}')
+    # remove the socket on `kill` too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon_socket_path.unlink(missing_ok=True)
+
+
+def get_args():
+    """Get command-line arguments"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Answer alfred.py queries from a resident process over a Unix domain socket, '
+        'keeping the rows and indexes in memory until the pre-computed files change',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        '-s',
+        '--status',
+        help='Only print whether the daemon is running',
+        action='store_true',
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Make a jazz noise here"""
+
+    args = get_args()
+    if args.status:
+        print(
+            f'Running on {daemon_socket_path}' if is_running() else 'Not running'
+        )
+        return
+    serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 
+import os
 from pathlib import Path
 
 
@@ -22,16 +23,68 @@ chatgpt_data_export_zip_regex_pattern = (
 generated_dir = parent_dir / 'generated'
 generated_dir.mkdir(exist_ok=True)
 assets_dir = parent_dir / 'assets'
+css_dir = parent_dir / 'css'
 gpt_4_icon_path = assets_dir / 'GPT-4.png'
 gpt_4_plugins_icon_path = assets_dir / 'gpt-4-plugins-purple.png'
 gpt_4_code_interpreter_icon_path = assets_dir / 'gpt-4-code-interpreter.png'
 gpt_4_gizmo_icon_path = assets_dir / 'rg-icon.png'
 
 alfred_workflow_cache_key = 'chatgpt-alfred-workflow'
+alfred_query_cache_key = 'chatgpt-alfred-workflow-queries'
+# how many recent queries to cache the matches of
+query_cache_size = 16
+# where `alfred_daemon.py` listens, not in generated_dir since Unix socket paths can't be long,
+# in a directory only the user can access, so that no one else can listen in their place
+daemon_socket_dir = Path('/tmp') / f'chatgpt-alfred-workflow-{os.getuid()}'
+daemon_socket_path = daemon_socket_dir / 'daemon.sock'
+# how the previews that Alfred Quick Looks are made:
+# - 'files': a Markdown file per conversation in generated_dir
+# - 'pack': the Markdown of every conversation in one SQLite file, `preview_pack_db`,
+#   from which `alfred.py` extracts the files of the conversations it shows to generated_dir
+# - 'server': rendered from the row store on demand by `preview_server.py`
+preview_mode = 'files'
+preview_server_port = 8631
+preview_server_url = f'http://127.0.0.1:{preview_server_port}'
+# how many bytes of rendered previews the server keeps around
+preview_cache_max_bytes = 32 * 1024 * 1024
 
 pre_computed_rows_json = generated_dir / 'pre_computed_rows.json'
 pre_computed_alfred_json = generated_dir / 'pre_computed_alfred.json'
-pre_computed_rows_msgpack = generated_dir / 'pre_computed_rows.msgpack'
+# the pages of `pre_computed_alfred_json` when `alfred_json_page_size` isn't 0, `<page>.json`
+pre_computed_alfred_pages_dir = generated_dir / 'pre_computed_alfred_pages'
+# the rows without their message text, and the text, so that listing them doesn't read the text
+# (JSON Lines without msgpack)
+pre_computed_rows_meta_msgpack = generated_dir / 'pre_computed_rows_meta.msgpack'
+pre_computed_rows_text_msgpack = generated_dir / 'pre_computed_rows_text.msgpack'
+pre_computed_rows_meta_json = generated_dir / 'pre_computed_rows_meta.jsonl'
+pre_computed_rows_text_json = generated_dir / 'pre_computed_rows_text.jsonl'
+row_store_bin = generated_dir / 'row_store.bin'
+preview_files_manifest_json = generated_dir / 'preview_files.manifest.json'
+preview_pack_db = generated_dir / 'previews.db'
+search_index_json = generated_dir / 'search_index.json'
+search_index_msgpack = generated_dir / 'search_index.msgpack'
+trigram_index_bin = generated_dir / 'trigram_index.bin'
+search_db_path = generated_dir / 'search.db'
+tfidf_index_npz = generated_dir / 'tfidf_index.npz'
+
+# a query starting with this is a regular expression matched against the whole search key
+regex_query_prefix = 're:'
+# a subquery starting with this matches the titles with words that are at most a typo or two off
+fuzzy_query_prefix = '~'
+# a query starting with this, followed by the id of a conversation, shows the conversations
+# most similar to it
+related_query_prefix = 'related='
+# how `alfred.py` answers queries by default: `scan` the rows (using the indexes above),
+# or with the `fts` (SQLite FTS5) search database, best match first
+search_backend = 'scan'
+# how many of the best matches `alfred.py` shows, 0 for all of them
+max_results = 50
+# how many of the most recently updated conversations an empty query shows, read from a page
+# of `pre_computed_alfred_pages_dir` instead of `pre_computed_alfred_json`, which has all of them.
+# 0 to show all of them
+alfred_json_page_size = 0
+# `page=2` shows the page of conversations updated before the ones an empty query shows, and so on
+page_query_prefix = 'page='
 
 
 # cSpell:disable
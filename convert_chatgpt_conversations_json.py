@@ -6,10 +6,25 @@ Purpose: Convert conversations.json to a linear conversation format
 """
 
 import argparse
+import io
 import json
+import os
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Any, Literal, Union
-from utils import date_from_chatgpt_unix_timestamp
+from typing import IO, Any, Callable, Iterator, Literal
+from utils import (
+    RawJSON,
+    content_hash,
+    date_from_chatgpt_unix_timestamp,
+    get_manifest_path,
+    iter_json_array,
+    json_array_element,
+    load_manifest,
+    load_manifest_spans,
+    save_manifest,
+    split_json_array,
+    write_json_array,
+)
 from config import (
     chatgpt_exported_conversations_json_path,
     chatgpt_linear_conversations_json_path,
@@ -18,37 +33,71 @@ from config import (
 
 
 class ChatGPTChatHistoryMessage:
+    # one of these is created for every node of every conversation, slots keep them small
+    __slots__ = (
+        'id',
+        'parent_id',
+        'children_ids',
+        'role',
+        'content_type',
+        'content',
+        'model_slug',
+        'plugin',
+        'recipient',
+        'finish_details_marker',
+        'finish_details_type',
+        'response_message_type',
+        'message_type',
+        'tool_name',
+    )
+
     id: str
-    parent_id: str | None = None
-    children_ids: list[str] = []
-    parent: Union['ChatGPTChatHistoryMessage', None] = None
-    children: list['ChatGPTChatHistoryMessage'] = []
-    role: Literal['system', 'assistant', 'user', 'tool'] | None = None
-    content_type: Literal['text', 'multimodal_text'] | None = None
-    content: str | None = None
+    parent_id: str | None
+    children_ids: list[str]
+    role: Literal['system', 'assistant', 'user', 'tool'] | None
+    content_type: Literal['text', 'multimodal_text'] | None
+    content: str | None
 
     # None when role == user or system, not none when role == assistant
     # text-davinci-002-render: text-davinci-002-render-sha
     # gpt-4: gpt-4
-    model_slug: str = 'text-davinci-002-render'
+    model_slug: str
 
-    plugin: bool = False
+    plugin: bool
     # None, 'all', 'kayak.whatever' etc
-    recipient: str | None = None
+    recipient: str | None
 
     # <|im_end|> if it's a message to a tool (always json)
     # tool response could be json or text
     # <|diff_marker|> if it's the final response to the user
-    finish_details_marker: Literal['<|im_end|>', '<|diff_marker|>'] | None = None
-    finish_details_type: Literal['stop', 'interrupted'] | None = None
+    finish_details_marker: Literal['<|im_end|>', '<|diff_marker|>'] | None
+    finish_details_type: Literal['stop', 'interrupted'] | None
 
-    response_message_type: Literal['request', 'tool', 'finish'] | None = None
+    response_message_type: Literal['request', 'tool', 'finish'] | None
     message_type: Literal[
         'system', 'user', 'non_plugin_response', 'request', 'tool', 'finish'
-    ] | None = None
+    ] | None
     # like 'rentable_apartments.getApartments'
     # not none when role == tool
-    tool_name: str | None = None
+    tool_name: str | None
+
+    def __init__(
+        self, id: str, parent_id: str | None = None, children_ids: list[str] | None = None
+    ):
+        self.id = id
+        self.parent_id = parent_id
+        self.children_ids = [] if children_ids is None else children_ids
+        self.role = None
+        self.content_type = None
+        self.content = None
+        self.model_slug = 'text-davinci-002-render'
+        self.plugin = False
+        self.recipient = None
+        self.finish_details_marker = None
+        self.finish_details_type = None
+        self.response_message_type = None
+        self.message_type = None
+        self.tool_name = None
 
     def set_response_message_type(self):
         if not self.plugin:
@@ -83,11 +132,10 @@ def chatgpt_conversation_to_linear_chat_history(
     plugin_enabled: bool = bool(chatgpt_conversation['plugin_ids'])
 
     id_to_m: dict[str, ChatGPTChatHistoryMessage] = {}
+    # the root message is the first one that has role None and content None
+    root_message: ChatGPTChatHistoryMessage | None = None
     for msg_id, message in messages.items():
-        m = ChatGPTChatHistoryMessage()
-        m.id = msg_id
-        m.parent_id = message['parent']
-        m.children_ids = message['children']
+        m = ChatGPTChatHistoryMessage(msg_id, message['parent'], message['children'])
         id_to_m[msg_id] = m
         msg = message['message']
 
@@ -136,30 +184,17 @@ def chatgpt_conversation_to_linear_chat_history(
                     m.finish_details_marker = finish_details.get('stop', None)
                     m.finish_details_type = finish_details.get('type', None)
                 m.set_response_message_type
-        else:
-            m.role = None
-            m.content = None
-
-    for msg_id, message in id_to_m.items():
-        if message.parent_id:
-            message.parent = id_to_m[message.parent_id]
-        message.children = [id_to_m[child_id] for child_id in message.children_ids]
+        elif root_message is None:
+            root_message = m
 
-    # in id_to_m, find the root message, that has role None and content None
-    root_message = [
-        x for x in id_to_m.values() if x.role is None and x.content is None
-    ][0]
+    if root_message is None:
+        raise ValueError(f'No root message found in conversation {conversation_id}')
 
     # starting from the root message, go down the tree; if a message has more than 1 children, only go for the last one.
     # if a message has no children, stop.
     linear_messages: list[ChatGPTChatHistoryMessage] = []
-    while True:
-        if len(root_message.children) == 0:
-            break
-        elif len(root_message.children) == 1:
-            root_message = root_message.children[0]
-        else:
-            root_message = root_message.children[-1]
+    while root_message.children_ids:
+        root_message = id_to_m[root_message.children_ids[-1]]
         linear_messages.append(root_message)
 
     return {
@@ -199,25 +234,263 @@ def get_args():
         default=chatgpt_linear_conversations_json_path,
     )
 
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='Number of processes to convert conversations with, 0 for one per CPU',
+        metavar='N',
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        '-f',
+        '--full',
+        help='Convert every conversation, instead of only the ones that are new or changed since the last run',
+        action='store_true',
+    )
+
+    parser.add_argument(
+        '-b',
+        '--benchmark',
+        help='Instead of converting to the output, time converting every conversation in one process and with --jobs (into a temporary dir), and the CPU time the main process and the workers take',
+        action='store_true',
+    )
+
     return parser.parse_args()
 
 
+# the manifest of the previous run, in the worker processes
+_previous_manifest: dict[str, list] = {}
+
+
+def _init_worker(previous_manifest: dict[str, list]):
+    global _previous_manifest
+    _previous_manifest = previous_manifest
+
+
+def _convert_raw_conversation(
+    raw: bytes,
+) -> tuple[str, list, RawJSON | None] | None:
+    """
+    Runs in the worker processes: the id and manifest entry of the conversation `raw` (a piece
+    from `split_json_array`), and its output, None if it's unchanged since the previous run.
+    None if `raw` isn't a whole conversation.
+    Takes and returns JSON text since it's much cheaper to pickle than dicts.
+    """
+    text = raw.decode()
+    try:
+        c = json.loads(text)
+        entry = [c['update_time'], content_hash(text)]
+        if _previous_manifest.get(c['id']) == entry:
+            return c['id'], entry, None
+        return (
+            c['id'],
+            entry,
+            json_array_element(chatgpt_conversation_to_linear_chat_history(c)),
+        )
+    except Exception:
+        # e.g. a part of a conversation, which the parent process joins with the next pieces
+        # (and converts itself, raising the error if it's a conversation it can't convert)
+        return None
+
+
+def _output_prefix(id: str) -> str:
+    """How the output of the conversation `id` starts in the output file"""
+    return '{\n' + ' ' * 4 + f'"id": {json.dumps(id, ensure_ascii=False)},'
+
+
+def convert_conversations(
+    input_fp: IO[bytes],
+    output_path: Path,
+    incremental: bool = True,
+    jobs: int = 1,
+    chunk_size: int = 16,
+) -> int:
+    """Convert the exported conversations read from `input_fp` and write them to `output_path`.
+
+    Conversations are parsed, converted and written one at a time,
+    so peak memory depends on the largest conversation rather than the whole export.
+    With `incremental`, conversations whose update_time and content hash match the manifest
+    of the previous run are copied over from the previous output instead of being converted again.
+    With `jobs` > 1, this process only cuts the input into conversations (see `split_json_array`),
+    which are parsed, checked against the manifest and converted in that many processes,
+    in chunks of `chunk_size`. The output stays the same.
+    Returns the number of conversations written.
+    """
+    manifest_path = get_manifest_path(output_path)
+    previous_manifest = (
+        load_manifest(manifest_path) if incremental and output_path.exists() else {}
+    )
+    # where the previous outputs are in the previous output file, which they're copied from
+    previous_spans = load_manifest_spans(manifest_path) if previous_manifest else {}
+    manifest: dict[str, list] = {}
+    # the ids of the conversations in the order they're written, for their spans
+    ids: list[str] = []
+    num_converted = 0
+
+    def read_previous_output(previous_fp: IO[bytes], id: str) -> RawJSON | None:
+        """The previous output of the conversation `id`, None if it isn't where the manifest says"""
+        if id not in previous_spans:
+            return None
+        offset, length = previous_spans[id]
+        previous_fp.seek(offset)
+        raw = previous_fp.read(length).decode('utf-8', errors='replace')
+        # the id is the first field of a linear conversation
+        if raw.startswith(_output_prefix(id)) and raw.endswith('}'):
+            return RawJSON(raw)
+        return None
+
+    def get_linear_conversation(
+        previous_fp: IO[bytes] | None,
+        id: str,
+        entry: list,
+        convert: Callable[[], dict[str, Any] | RawJSON],
+    ) -> dict[str, Any] | RawJSON:
+        """The previous output of the conversation if it's unchanged, otherwise `convert()`"""
+        nonlocal num_converted
+        manifest[id] = entry
+        ids.append(id)
+        if (
+            previous_fp is not None
+            and previous_manifest.get(id) == entry
+            and (previous_output := read_previous_output(previous_fp, id)) is not None
+        ):
+            return previous_output
+        num_converted += 1
+        return convert()
+
+    def get_linear_conversations(
+        previous_fp: IO[bytes] | None,
+    ) -> Iterator[dict[str, Any] | RawJSON]:
+        if jobs <= 1:
+            for c, raw in iter_json_array(input_fp, with_raw=True):
+                yield get_linear_conversation(
+                    previous_fp,
+                    c['id'],
+                    [c['update_time'], content_hash(raw)],
+                    lambda: chatgpt_conversation_to_linear_chat_history(c),
+                )
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+        from itertools import islice
+
+        # the pieces the workers couldn't parse, which are parts of conversations,
+        # with their separators
+        unparsed: list[bytes] = []
+
+        def get_batch_outputs(batch, results) -> Iterator[dict[str, Any] | RawJSON]:
+            for (piece, separator), result in zip(batch, results):
+                if result is not None and not unparsed:
+                    id, entry, output = result
+                    yield get_linear_conversation(
+                        previous_fp,
+                        id,
+                        entry,
+                        # unchanged, but not where the manifest says in the previous output
+                        lambda: output
+                        or chatgpt_conversation_to_linear_chat_history(json.loads(piece)),
+                    )
+                    continue
+                # join the pieces until they make whole conversations, and convert those here
+                unparsed.append(piece)
+                joined = b'[' + b''.join(unparsed) + b']'
+                unparsed.append(separator)
+                try:
+                    conversations = list(iter_json_array(io.BytesIO(joined), with_raw=True))
+                except ValueError:
+                    continue
+                unparsed.clear()
+                for c, raw in conversations:
+                    yield get_linear_conversation(
+                        previous_fp,
+                        c['id'],
+                        [c['update_time'], content_hash(raw)],
+                        lambda: chatgpt_conversation_to_linear_chat_history(c),
+                    )
+
+        # the parent process only cuts the input into pieces, the workers parse them
+        pieces = split_json_array(input_fp)
+        with ProcessPoolExecutor(
+            jobs, initializer=_init_worker, initargs=(previous_manifest,)
+        ) as executor:
+            # keep one batch in flight while the previous one is being written
+            in_flight = []
+            while batch := list(islice(pieces, jobs * chunk_size * 4)):
+                results = executor.map(
+                    _convert_raw_conversation,
+                    [piece for piece, _ in batch],
+                    chunksize=chunk_size,
+                )
+                in_flight.append((batch, results))
+                if len(in_flight) > 1:
+                    yield from get_batch_outputs(*in_flight.pop(0))
+            for batch, results in in_flight:
+                yield from get_batch_outputs(batch, results)
+        if unparsed:
+            # raises the error of the pieces that don't make whole conversations
+            list(iter_json_array(io.BytesIO(b'[' + b''.join(unparsed[:-1]) + b']')))
+
+    # write to a temp file first so a failed conversion doesn't clobber the previous output
+    tmp_output_path = output_path.with_name(f'{output_path.name}.tmp')
+    spans: list[tuple[int, int]] = []
+    with (
+        output_path.open('rb') if previous_spans else nullcontext()
+    ) as previous_fp, tmp_output_path.open('w') as f:
+        n = write_json_array(get_linear_conversations(previous_fp), f, spans=spans)
+    tmp_output_path.replace(output_path)
+    save_manifest(manifest_path, manifest, spans=dict(zip(ids, spans)))
+    if previous_manifest:
+        num_deleted = len(previous_manifest.keys() - manifest.keys())
+        print(
+            f'{num_converted} new or changed, {n - num_converted} unchanged, {num_deleted} deleted conversations'
+        )
+    return n
+
+
+def benchmark(input_path: Path, jobs: int):
+    """Compare converting `input_path` in one process and in `jobs` processes"""
+    import resource
+    import tempfile
+    import time
+
+    outputs = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in dict.fromkeys([1, jobs]):
+            output_path = Path(tmp_dir) / f'{n}.json'
+            workers_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start, cpu_start = time.perf_counter(), time.process_time()
+            with input_path.open('rb') as f:
+                convert_conversations(f, output_path, incremental=False, jobs=n)
+            seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+            # the workers have exited, so their CPU time is counted
+            workers_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            workers_cpu_seconds = (workers_end.ru_utime + workers_end.ru_stime) - (
+                workers_start.ru_utime + workers_start.ru_stime
+            )
+            print(
+                f'-j {n}: {seconds:.2f}s, {cpu_seconds:.2f}s CPU in the main process, '
+                f'{workers_cpu_seconds:.2f}s in the workers'
+            )
+            outputs.append(output_path.read_bytes())
+    # the main process cuts the input into conversations and writes them, so with enough CPUs
+    # -j N takes about as long as its CPU time in the main process
+    print(f'Outputs are {"identical" if len(set(outputs)) == 1 else "different"}')
+
+
 def main():
     """Make a jazz noise here"""
 
     args = get_args()
-    conversations = json.loads(args.input.read_text())
-    linear_conversations = [
-        chatgpt_conversation_to_linear_chat_history(c) for c in conversations
-    ]
-    args.output.write_text(
-        json.dumps(
-            linear_conversations,
-            indent=2,
-            ensure_ascii=False,
+    if args.benchmark:
+        benchmark(args.input, max(2, args.jobs or os.cpu_count() or 1))
+        return
+    with args.input.open('rb') as f:
+        n = convert_conversations(
+            f, args.output, not args.full, args.jobs or os.cpu_count() or 1
         )
-    )
-    print(f'Done! {len(linear_conversations)} conversations written to {args.output} .')
+    print(f'Done! {n} conversations written to {args.output} .')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,85 @@
+"""
+The `field=value` subqueries of queries:
+
+- `after=2024-01`, `before=2024-06-30`: conversations updated at or after / before
+  the start of a year, month or day
+- `created_after=`, `created_before=`: the same for when they were created
+- `model=gpt-4` and any other field of the rows: the field contains the value
+
+`search_index.FieldIndex` answers the model and time filters from indexes,
+and `row_matches` checks any of them against a row.
+"""
+
+import re
+from datetime import date
+from typing import Any, Mapping
+
+# the time filters, with the field they filter and whether they match the times before the date
+time_filters = {
+    'after': ('update_time', False),
+    'before': ('update_time', True),
+    'created_after': ('create_time', False),
+    'created_before': ('create_time', True),
+}
+
+_date_pattern = re.compile(r'(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?')
+
+
+class InvalidFilterError(ValueError):
+    pass
+
+
+def parse_date(value: str) -> str:
+    """
+    `value` (a year, month or day) as the start of an ISO 8601 time, which compares with the
+    ISO 8601 times of the rows as strings: the times in it are greater or equal.
+    """
+    m = _date_pattern.fullmatch(value)
+    if m is None:
+        raise InvalidFilterError(
+            f'Invalid date {value!r}, expected YYYY, YYYY-MM or YYYY-MM-DD'
+        )
+    year, month, day = (int(x) if x else None for x in m.groups())
+    try:
+        date(year, 1 if month is None else month, 1 if day is None else day)  # type: ignore
+    except ValueError as e:
+        raise InvalidFilterError(f'Invalid date {value!r}: {e}') from None
+    if month is None:
+        return f'{year:04}'
+    if day is None:
+        return f'{year:04}-{month:02}'
+    return f'{year:04}-{month:02}-{day:02}'
+
+
+def parse_field_filter(subquery: str) -> tuple[str, str]:
+    """The field and (lowercased) value of a `field=value` subquery, the date of a time filter"""
+    k, _, v = subquery.partition('=')
+    v = v.strip().lower()
+    return k, parse_date(v) if k in time_filters else v
+
+
+def row_matches(row: Mapping[str, Any], k: str, v: str) -> bool:
+    """Whether `row` matches the filter parsed by `parse_field_filter`"""
+    if k in time_filters:
+        field, before = time_filters[k]
+        time = row.get(field)
+        if not isinstance(time, str):
+            return False
+        return time < v if before else time >= v
+    if k not in row:
+        return False
+    value = row[k]
+    # not every field is a string
+    return v in ('' if value is None else str(value)).lower()
+
+
+def filter_narrows(k: str, v: str, cached_v: str) -> bool:
+    """Whether every row matching the filter `k=v` matches `k=cached_v` too (both unparsed)"""
+    if k not in time_filters:
+        return cached_v.strip() in v.strip()
+    try:
+        start, cached_start = parse_date(v.strip()), parse_date(cached_v.strip())
+    except InvalidFilterError:
+        return False
+    _, before = time_filters[k]
+    return start <= cached_start if before else start >= cached_start
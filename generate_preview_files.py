@@ -5,22 +5,40 @@ Date   : 2023-05-11
 Purpose: Generate preview files for Alfred list filter preview
 """
 
+import os
+import html
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
+from itertools import islice
 from textwrap import dedent
+from typing import Any, Container, Iterable, Iterator, Mapping
 from tqdm import tqdm
 import argparse
-from config import chatgpt_linear_conversations_json_path, generated_dir
+from config import (
+    chatgpt_linear_conversations_json_path,
+    generated_dir,
+    preview_files_manifest_json,
+    preview_pack_db,
+    preview_mode,
+    alfred_json_page_size,
+)
 from utils import (
     model_slug_to_model_name,
     chatgpt_conversation_id_to_url,
     get_model_short_subtitle_suffix_update_item3_kwargs,
+    iter_json_array,
+    row_messages,
+    write_text_if_changed,
+    get_manifest_path,
+    load_manifest,
+    save_manifest,
 )
+from preview_pack import PreviewPack, check_preview_mode, extract_previews
 
 
-def generate_preview_markdown(conversation: dict) -> str:
-    title = conversation['title']
+def get_title_suffix(update_time: str, model: str) -> str:
     # date_short = iso_to_month_day(conversation['update_time'])
-    date_short = conversation['update_time']
-    model = model_slug_to_model_name(conversation['model_slug'])
+    date_short = update_time
     # match model:
     #     case 'gpt-3.5-turbo':
     #         model_short = ''
@@ -33,7 +51,14 @@ def generate_preview_markdown(conversation: dict) -> str:
     model_short, _ = get_model_short_subtitle_suffix_update_item3_kwargs(
         model=model, date_short=date_short, item3_kwargs={}
     )
-    title_suffix = f"""{date_short}{f' ({model_short})' if model_short else ''}"""
+    return f"""{date_short}{f' ({model_short})' if model_short else ''}"""
+
+
+def generate_preview_markdown(conversation: dict) -> str:
+    title = conversation['title']
+    title_suffix = get_title_suffix(
+        conversation['update_time'], model_slug_to_model_name(conversation['model_slug'])
+    )
 
     template = """
     <link rel="stylesheet" href="../css/markdown_preview.css">
@@ -52,7 +77,7 @@ def generate_preview_markdown(conversation: dict) -> str:
     """
     template = dedent(template).strip()
 
-    processed_lm: list[str] = conversation['linear_messages']
+    processed_lm: list[str] = list(conversation['linear_messages'])
     # processed_lm[::2] = [f'<pre>\n{m}\n</pre>' for m in processed_lm[::2]]
     processed_lm[::2] = [f'<pre class="user">\n{m}\n</pre>' for m in processed_lm[::2]]
     processed_lm[1::2] = [
@@ -68,27 +93,195 @@ def generate_preview_markdown(conversation: dict) -> str:
     )
 
 
+def generate_preview_html(row: Mapping[str, Any]) -> str:
+    """The preview of a pre-computed row as an HTML page, for `preview_server.py`"""
+    messages = [
+        f'<pre class="{"user" if i % 2 == 0 else "assistant"}">\n{html.escape(m)}\n</pre>'
+        for i, m in enumerate(row_messages(row))
+    ]
+    title = html.escape(row['title'] or '')
+    return dedent(
+        """\
+        <!DOCTYPE html>
+        <html>
+        <head>
+        <meta charset="utf-8">
+        <title>{title}</title>
+        <link rel="stylesheet" href="/css/markdown_preview.css">
+        </head>
+        <body>
+        <h1>{title}</h1>
+        <p><a href="{chatgpt_url}">ChatGPT</a></p>
+        <p><a href="{typingmind_url}">TypingMind</a></p>
+        <p>{title_suffix}</p>
+        <hr>
+        {formatted_messages}
+        </body>
+        </html>
+        """
+    ).format(
+        title=title,
+        title_suffix=html.escape(get_title_suffix(row['update_time'], row['model'])),
+        formatted_messages='\n<hr>\n'.join(messages),
+        chatgpt_url=html.escape(row['_chatgpt_url']),
+        typingmind_url=html.escape(row['_typingmind_url']),
+    )
+
+
+# how many conversations a worker renders at a time
+batch_size = 64
+
+
+def write_previews(conversations: list[dict]) -> int:
+    """Render the previews of `conversations`, only writing the changed ones. Returns how many were written"""
+    return sum(
+        write_text_if_changed(
+            generated_dir / f'{conversation["id"]}.md',
+            generate_preview_markdown(conversation),
+        )
+        for conversation in conversations
+    )
+
+
+def render_previews(conversations: list[dict]) -> list[tuple[str, str]]:
+    """The ids and previews of `conversations`, for the `PreviewPack`"""
+    return [
+        (conversation['id'], generate_preview_markdown(conversation))
+        for conversation in conversations
+    ]
+
+
+def remove_orphaned_previews(ids: Container[str]) -> int:
+    """Remove the previews in `generated_dir` of the conversations not in `ids`. Returns how many"""
+    num_removed = 0
+    for path in generated_dir.glob('*.md'):
+        if path.stem not in ids:
+            path.unlink(missing_ok=True)
+            num_removed += 1
+    return num_removed
+
+
+def batched(iterable: Iterable, n: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
+
+
 def get_args():
     parser = argparse.ArgumentParser(
         description='Generate preview files for Alfred list filter preview',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
 
+    parser.add_argument(
+        '-f',
+        '--full',
+        help='Regenerate every preview file, instead of only the ones for conversations that are new or changed since the last run',
+        action='store_true',
+    )
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='Number of worker processes rendering the previews',
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+
     return parser.parse_args()
 
 
 def main():
     """Make a jazz noise here"""
 
-    get_args()
-    import json
+    args = get_args()
+    check_preview_mode()
+    if preview_mode == 'server':
+        num_removed = remove_orphaned_previews(())
+        preview_files_manifest_json.unlink(missing_ok=True)
+        preview_pack_db.unlink(missing_ok=True)
+        print(
+            f'The previews are served by preview_server.py, removed {num_removed} preview files'
+        )
+        return
+    if preview_mode != 'pack':
+        preview_pack_db.unlink(missing_ok=True)
+    manifest = load_manifest(get_manifest_path(chatgpt_linear_conversations_json_path))
+    previous_manifest = {} if args.full else load_manifest(preview_files_manifest_json)
+
+    num_skipped = num_rendered = num_written = 0
+    ids = set()
+    # the update times of the conversations, to find the ones an empty query lists
+    update_times: list[tuple[str, str]] = []
 
-    linear_conversations: list[dict] = json.loads(
-        chatgpt_linear_conversations_json_path.read_text()
+    def get_changed_conversations(conversations: Iterable[dict]) -> Iterator[dict]:
+        nonlocal num_skipped
+        for conversation in conversations:
+            ids.add(conversation['id'])
+            update_times.append((conversation['update_time'] or '', conversation['id']))
+            entry = manifest.get(conversation['id'])
+            if (
+                entry is not None
+                and previous_manifest.get(conversation['id']) == entry
+                and (
+                    conversation['id'] in pack
+                    if pack is not None
+                    else (generated_dir / f'{conversation["id"]}.md').exists()
+                )
+            ):
+                num_skipped += 1
+                progress.update()
+                continue
+            yield conversation
+
+    # the batches being rendered, and their sizes
+    pending: dict[Future, int] = {}
+
+    def collect(futures: Iterable[Future]):
+        nonlocal num_rendered, num_written
+        for future in futures:
+            if pack is not None:
+                num_written += sum(pack.put(*x) for x in future.result())
+            else:
+                num_written += future.result()
+            size = pending.pop(future)
+            num_rendered += size
+            progress.update(size)
+
+    with (
+        chatgpt_linear_conversations_json_path.open('rb') as f,
+        tqdm(total=len(manifest) or None) as progress,
+        (PreviewPack(args.full) if preview_mode == 'pack' else nullcontext()) as pack,
+        ProcessPoolExecutor(args.jobs) as executor,
+    ):
+        # the pack is written by this process, the files by the workers
+        worker = render_previews if pack is not None else write_previews
+        for batch in batched(get_changed_conversations(iter_json_array(f)), batch_size):
+            # don't read ahead more than the workers can keep up with
+            if len(pending) >= 2 * args.jobs:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending[executor.submit(worker, batch)] = len(batch)
+        collect(list(pending))
+        # the previews of deleted conversations (the files extracted from the pack, with one)
+        num_removed = remove_orphaned_previews(ids)
+        if pack is not None:
+            num_removed += pack.remove_except(ids)
+    if preview_mode == 'pack':
+        # the ones an empty query lists (in the order of `sort_rows`), which `alfred.py`
+        # would extract otherwise
+        update_times.sort(key=lambda x: x[0], reverse=True)
+        extract_previews(
+            id
+            for _, id in update_times[:alfred_json_page_size]
+            if not (generated_dir / f'{id}.md').exists()
+        )
+    save_manifest(
+        preview_files_manifest_json, {id: manifest.get(id) for id in ids}
+    )
+    print(
+        f'Skipped {num_skipped} unchanged conversations, rendered {num_rendered} previews '
+        f'({num_rendered - num_written} unchanged, not rewritten), removed {num_removed} orphaned previews'
     )
-    for conversation in tqdm(linear_conversations):
-        output_path = generated_dir / f'{conversation["id"]}.md'
-        output_path.write_text(generate_preview_markdown(conversation))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Author : Xinyuan Chen <45612704+tddschn@users.noreply.github.com>
+Date   : 2024-08-20
+Purpose: Convert, pre-process and generate previews for conversations.json in a single pass
+"""
+
+import argparse
+from pathlib import Path
+from typing import IO, Iterator
+from config import (
+    chatgpt_exported_conversations_json_path,
+    chatgpt_linear_conversations_json_path,
+    generated_dir,
+    pre_computed_alfred_json,
+    pre_computed_alfred_pages_dir,
+    pre_computed_rows_json,
+    preview_files_manifest_json,
+    preview_pack_db,
+    preview_mode,
+    alfred_json_page_size,
+)
+from utils import (
+    content_hash,
+    iter_json_array,
+    write_json_array,
+    get_manifest_path,
+    load_manifest,
+    save_manifest,
+    write_alfred_json,
+    write_text_if_changed,
+)
+from convert_chatgpt_conversations_json import (
+    chatgpt_conversation_to_linear_chat_history,
+)
+from preprocess_conversations import (
+    linear_conversation_to_row,
+    process_row,
+    load_pre_computed_rows,
+    get_manifest_meta,
+    sort_rows,
+    write_pre_computed_rows,
+)
+from generate_preview_files import generate_preview_markdown, remove_orphaned_previews
+from preview_pack import PreviewPack, check_preview_mode, extract_previews
+from search_db import write_search_db
+from search_index import write_search_index, write_trigram_index
+from related_index import write_tfidf_index
+
+
+def import_conversations(
+    input_fp: IO[bytes],
+    full: bool = False,
+    linear_output: Path | None = None,
+    rows_json: bool = False,
+) -> int:
+    """
+    Parse the exported conversations once, and pass each one through linearization,
+    row pre-computation, preview rendering and Alfred item serialization.
+
+    Conversations whose pre-computed row and preview are unchanged since the last run
+    (see the manifests of `preprocess_conversations.py` and `generate_preview_files.py`)
+    aren't converted at all, unless `full` or `linear_output` is given.
+    The intermediate linear conversations are only written to `linear_output` if it's given,
+    and the pre-computed rows are only written to a single JSON file if `rows_json`.
+    Returns the number of conversations imported.
+    """
+    rows_manifest_path = get_manifest_path(pre_computed_rows_json)
+    rows_manifest_meta = get_manifest_meta()
+    previous_rows_manifest = (
+        {} if full else load_manifest(rows_manifest_path, rows_manifest_meta)
+    )
+    previous_previews_manifest = (
+        {} if full else load_manifest(preview_files_manifest_json)
+    )
+    previous_rows = (
+        {row['id']: row for row in load_pre_computed_rows()}
+        if previous_rows_manifest
+        else {}
+    )
+    manifest: dict[str, list] = {}
+    rows: list[dict] = []
+    num_converted = num_previews = 0
+    pack = PreviewPack(full) if preview_mode == 'pack' else None
+
+    def get_linear_conversations() -> Iterator[dict]:
+        nonlocal num_converted, num_previews
+        for c, raw in iter_json_array(input_fp, with_raw=True):
+            id = c['id']
+            entry = manifest[id] = [c['update_time'], content_hash(raw)]
+            row_unchanged = previous_rows_manifest.get(id) == entry and id in previous_rows
+            preview_path = generated_dir / f'{id}.md'
+            # the preview server renders the previews itself
+            preview_unchanged = preview_mode == 'server' or (
+                previous_previews_manifest.get(id) == entry
+                and (id in pack if pack is not None else preview_path.exists())
+            )
+            if row_unchanged and preview_unchanged and linear_output is None:
+                row = previous_rows[id]
+            else:
+                linear = chatgpt_conversation_to_linear_chat_history(c)
+                num_converted += 1
+                row = (
+                    previous_rows[id]
+                    if row_unchanged
+                    else process_row(linear_conversation_to_row(dict(linear)))
+                )
+                if not preview_unchanged:
+                    if pack is not None:
+                        pack.put(id, generate_preview_markdown(linear))
+                    else:
+                        write_text_if_changed(preview_path, generate_preview_markdown(linear))
+                    num_previews += 1
+                yield linear
+            rows.append(row)
+
+    # where the linear conversations are in `linear_output`, for the converter's manifest
+    linear_spans: list[tuple[int, int]] = []
+    if linear_output is None:
+        for _ in get_linear_conversations():
+            pass
+    else:
+        with linear_output.open('w') as f:
+            write_json_array(get_linear_conversations(), f, spans=linear_spans)
+    sort_rows(rows)
+    # the same as `alfred.py -g`
+    num_pages = write_alfred_json(rows)
+
+    if not write_pre_computed_rows(rows, rows_json):
+        # don't leave outdated JSON rows around for anything to read
+        pre_computed_rows_json.unlink(missing_ok=True)
+    write_search_index(rows)
+    write_trigram_index(rows, full)
+    write_search_db(rows, full)
+    write_tfidf_index(rows)
+    save_manifest(rows_manifest_path, manifest, rows_manifest_meta)
+
+    if preview_mode == 'server':
+        remove_orphaned_previews(())
+        preview_files_manifest_json.unlink(missing_ok=True)
+    else:
+        # remove the previews of deleted conversations
+        remove_orphaned_previews(manifest)
+        if pack is not None:
+            with pack:
+                pack.remove_except(manifest)
+            # the ones an empty query lists, which `alfred.py` would extract otherwise
+            extract_previews(
+                row['id']
+                for row in rows[:alfred_json_page_size]
+                if not (generated_dir / f'{row["id"]}.md').exists()
+            )
+        save_manifest(preview_files_manifest_json, manifest)
+    if preview_mode != 'pack':
+        preview_pack_db.unlink(missing_ok=True)
+
+    # the converter may only reuse the outputs in its manifest if they're really in its output file
+    if (
+        linear_output is not None
+        and linear_output.resolve() == chatgpt_linear_conversations_json_path.resolve()
+    ):
+        # every conversation is written to `linear_output`, in order
+        save_manifest(
+            get_manifest_path(linear_output), manifest, spans=dict(zip(manifest, linear_spans))
+        )
+
+    print(
+        f'{num_converted} conversations converted, {num_previews} previews rendered, {len(rows) - num_converted} unchanged'
+    )
+    if num_pages:
+        print(f'Generated {num_pages} pages in {pre_computed_alfred_pages_dir}')
+    else:
+        print(f'Generated {pre_computed_alfred_json}')
+    return len(rows)
+
+
+def get_args():
+    """Get command-line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description='Convert, pre-process and generate previews for conversations.json in a single pass',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        '-i',
+        '--input',
+        help='Input conversations.json file',
+        metavar='PATH',
+        type=Path,
+        default=chatgpt_exported_conversations_json_path,
+    )
+
+    parser.add_argument(
+        '-z',
+        '--zip',
+        help='Stream conversations.json out of the latest ChatGPT data export zip in ~/Downloads instead of reading --input',
+        action='store_true',
+    )
+
+    parser.add_argument(
+        '-f',
+        '--full',
+        help='Process every conversation, instead of only the ones that are new or changed since the last run',
+        action='store_true',
+    )
+
+    parser.add_argument(
+        '-l',
+        '--linear-output',
+        help=f'Also write the linear conversations to this file for debugging, e.g. {chatgpt_linear_conversations_json_path.name}',
+        metavar='PATH',
+        type=Path,
+    )
+
+    parser.add_argument(
+        '-r',
+        '--rows-json',
+        help=f'Also write the pre-computed rows to {pre_computed_rows_json.name} for debugging',
+        action='store_true',
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Make a jazz noise here"""
+
+    args = get_args()
+    check_preview_mode()
+    if args.zip:
+        import zipfile
+        from config import (
+            downloads_dir,
+            chatgpt_data_export_zip_glob_pattern,
+            chatgpt_data_export_zip_regex_pattern,
+        )
+        from utils import find_last_added_file
+        from update_conversations_json import get_conversations_json_member
+
+        zip_file_path = find_last_added_file(
+            downloads_dir,
+            chatgpt_data_export_zip_glob_pattern,
+            regex_pattern=chatgpt_data_export_zip_regex_pattern,
+        )
+        with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+            with zip_ref.open(get_conversations_json_member(zip_ref)) as f:
+                n = import_conversations(f, args.full, args.linear_output, args.rows_json)
+    else:
+        with args.input.open('rb') as f:
+            n = import_conversations(f, args.full, args.linear_output, args.rows_json)
+    print(f'Done! {n} conversations imported.')
+
+
+if __name__ == '__main__':
+    main()
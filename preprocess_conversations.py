@@ -7,78 +7,138 @@ Purpose: Pre-compute attributes and other data for the conversations
 
 import argparse
 import json
+from typing import Container
 from config import (
     pre_computed_rows_json,
-    pre_computed_rows_msgpack,
     chatgpt_linear_conversations_json_path,
     alfred_title_max_length,
     generated_dir,
     message_preview_len,
+    preview_mode,
+    preview_server_url,
 )
+from row_store import write_row_store, write_split_rows, load_split_rows
+from search_db import write_search_db
+from search_index import write_search_index, write_trigram_index
+from related_index import write_tfidf_index
 from utils import (
     model_slug_to_model_name,
     chatgpt_conversation_id_to_url,
     iso_to_month_day,
+    get_current_year,
     get_model_short_subtitle_suffix_update_item3_kwargs,
+    row_to_alfred_item_fragment,
+    iter_json_array,
+    messages_separator,
+    get_manifest_path,
+    load_manifest,
+    save_manifest,
 )
 
 
-def get_rows() -> list[dict]:
-    linear_conversations: list[dict] = json.loads(
-        chatgpt_linear_conversations_json_path.read_text()
-    )
-    for conversation in linear_conversations:
-        conversation['concatenated_messages'] = '\n---\n'.join(
-            conversation.pop('linear_messages')
-        )
-        conversation['model'] = model_slug_to_model_name(conversation.pop('model_slug'))
-    return linear_conversations
+def linear_conversation_to_row(conversation: dict) -> dict:
+    messages = conversation.pop('linear_messages')
+    conversation['concatenated_messages'] = messages_separator.join(messages)
+    # so that the messages can be split out again, even if they contain the separator
+    conversation['_message_lengths'] = [len(x) for x in messages]
+    conversation['model'] = model_slug_to_model_name(conversation.pop('model_slug'))
+    return conversation
 
 
-def search_key_for_rows(row: dict) -> str:
-    return ' '.join(
-        x
-        for _, x in row.items()
+def load_pre_computed_rows() -> list[dict]:
+    """Load the rows written by the previous run"""
+    rows, _ = load_split_rows() or ([], 0)
+    return rows
+
+
+def search_key_fields(row: dict) -> list[str]:
+    return [
+        k
+        for k, x in row.items()
         if x
         and isinstance(x, str)
-        and not _.startswith('non_key_')
-        and not _.startswith('_')
-    ).lower()
-
-
-def get_and_process_rows() -> list[dict]:
-    rows = get_rows()
-    for row in rows:
-        date_short = iso_to_month_day(row['update_time'])
-        model = row['model']
-        chatgpt_url = chatgpt_conversation_id_to_url(row['id'], 'chatgpt')
-        typingmind_url = chatgpt_conversation_id_to_url(row['id'], 'typingmind')
-        item3_kwargs = {}
-        (
-            model_short,
-            subtitle_prefix,
-        ) = get_model_short_subtitle_suffix_update_item3_kwargs(
-            date_short, model, item3_kwargs
-        )
-        title_suffix = f"""{date_short}{f' ({model_short})' if model_short else ''}"""
-        row_title = row.get('title', '') or ''
-        num_white_spaces = max(
-            2, alfred_title_max_length - len(row_title) - len(title_suffix)
-        )
-        title = f"""{row_title}{' ' * num_white_spaces}{title_suffix}"""
-        # subtitle_remaining_length = (
-        #     alfred_subtitle_max_length - len(subtitle_prefix) - 3
-        # )
-        # message_preview = get_message_preview(alfred_subtitle_max_length)
-        row['_title'] = title
-        row['_quicklookurl'] = str(generated_dir / f"{row['id']}.md")
-        row['_chatgpt_url'] = chatgpt_url
-        row['_typingmind_url'] = typingmind_url
-        row['_item3_kwargs'] = item3_kwargs
-        row['_search_key'] = search_key_for_rows(row)
-        message_preview = row['concatenated_messages'].strip()[:message_preview_len]
-        row['_message_preview'] = message_preview
+        and not k.startswith('non_key_')
+        and not k.startswith('_')
+    ]
+
 
+def search_key_for_rows(row: dict) -> str:
+    return ' '.join(row[k] for k in search_key_fields(row)).lower()
+
+
+def messages_offset_in_search_key(row: dict) -> int:
+    """
+    Where the search key has the lowercased `concatenated_messages` of the row,
+    so that snippets can be searched for without lowercasing the messages again.
+    -1 if it doesn't (lowercasing changed the length of the messages, or there aren't any).
+    """
+    messages = row['concatenated_messages']
+    fields = search_key_fields(row)
+    if 'concatenated_messages' not in fields:
+        return -1
+    before = fields[: fields.index('concatenated_messages')]
+    offset = len(' '.join(row[k] for k in before).lower()) + (1 if before else 0)
+    if row['_search_key'][offset : offset + len(messages)] != messages.lower():
+        return -1
+    return offset
+
+
+def process_row(row: dict) -> dict:
+    date_short = iso_to_month_day(row['update_time'])
+    model = row['model']
+    chatgpt_url = chatgpt_conversation_id_to_url(row['id'], 'chatgpt')
+    typingmind_url = chatgpt_conversation_id_to_url(row['id'], 'typingmind')
+    item3_kwargs = {}
+    (
+        model_short,
+        subtitle_prefix,
+    ) = get_model_short_subtitle_suffix_update_item3_kwargs(
+        date_short, model, item3_kwargs
+    )
+    title_suffix = f"""{date_short}{f' ({model_short})' if model_short else ''}"""
+    row_title = row.get('title', '') or ''
+    num_white_spaces = max(
+        2, alfred_title_max_length - len(row_title) - len(title_suffix)
+    )
+    title = f"""{row_title}{' ' * num_white_spaces}{title_suffix}"""
+    # subtitle_remaining_length = (
+    #     alfred_subtitle_max_length - len(subtitle_prefix) - 3
+    # )
+    # message_preview = get_message_preview(alfred_subtitle_max_length)
+    row['_title'] = title
+    row['_quicklookurl'] = (
+        f"{preview_server_url}/{row['id']}"
+        if preview_mode == 'server'
+        else str(generated_dir / f"{row['id']}.md")
+    )
+    row['_chatgpt_url'] = chatgpt_url
+    row['_typingmind_url'] = typingmind_url
+    row['_item3_kwargs'] = item3_kwargs
+    row['_search_key'] = search_key_for_rows(row)
+    row['_search_key_messages_offset'] = messages_offset_in_search_key(row)
+    message_preview = row['concatenated_messages'].strip()[:message_preview_len]
+    row['_message_preview'] = message_preview
+    # the Alfred item, pre-encoded, but for the subtitle
+    row['_alfred_item'] = row_to_alfred_item_fragment(row)
+    return row
+
+
+def get_and_process_rows(
+    previous_rows: dict[str, dict] | None = None,
+    unchanged_ids: Container[str] = frozenset(),
+) -> list[dict]:
+    """Process the rows of conversations, reusing `previous_rows` for the ones in `unchanged_ids`"""
+    previous_rows = previous_rows or {}
+    rows = []
+    with chatgpt_linear_conversations_json_path.open('rb') as f:
+        for conversation in iter_json_array(f):
+            if (
+                conversation['id'] in unchanged_ids
+                and conversation['id'] in previous_rows
+            ):
+                rows.append(previous_rows[conversation['id']])
+            else:
+                rows.append(process_row(linear_conversation_to_row(conversation)))
     return rows
 
 
@@ -90,23 +150,83 @@ def get_args():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
 
+    parser.add_argument(
+        '-f',
+        '--full',
+        help='Process every conversation, instead of only the ones that are new or changed since the last run',
+        action='store_true',
+    )
+
     return parser.parse_args()
 
 
+# bump when the fields of the rows change, so that the rows of previous runs aren't reused
+row_fields_version = 5
+
+
+def get_manifest_meta() -> dict:
+    # rows have the year in their titles and the absolute quicklook path (or the server's URL)
+    return {
+        'year': get_current_year(),
+        'generated_dir': str(generated_dir),
+        'row_fields_version': row_fields_version,
+        'preview_server': preview_mode == 'server' and preview_server_url,
+    }
+
+
+def sort_rows(rows: list[dict]):
+    """
+    Sort the rows by update time, most recent first, the order they (and the indexes of them)
+    are written in, so that the rows `alfred.py --first N` considers are the first N written
+    """
+    rows.sort(key=lambda row: row.get('update_time') or '', reverse=True)
+
+
+def write_pre_computed_rows(rows: list[dict], write_json: bool = True) -> bool:
+    """
+    Write the rows to the row store and the split metadata and text files `alfred.py`
+    reads them from, and as JSON if `write_json`.
+
+    Returns whether the JSON was written.
+    """
+    write_row_store(rows)
+    write_split_rows(rows)
+    if write_json:
+        pre_computed_rows_json.write_text(
+            json.dumps(rows, indent=2, ensure_ascii=False)
+        )
+        print(f'Wrote pre-computed rows to {pre_computed_rows_json}')
+    return write_json
+
+
 def main():
     """Make a jazz noise here"""
 
-    get_args()
-    rows = get_and_process_rows()
-    pre_computed_rows_json.write_text(json.dumps(rows, indent=2, ensure_ascii=False))
-    print(f'Wrote pre-computed rows to {pre_computed_rows_json}')
-    try:
-        import msgpack
-
-        pre_computed_rows_msgpack.write_bytes(msgpack.packb(rows))  # type: ignore
-        print(f'Wrote pre-computed rows to {pre_computed_rows_msgpack}')
-    except ImportError:
-        pass
+    args = get_args()
+    manifest_meta = get_manifest_meta()
+    manifest_path = get_manifest_path(pre_computed_rows_json)
+    manifest = load_manifest(get_manifest_path(chatgpt_linear_conversations_json_path))
+    previous_manifest = {} if args.full else load_manifest(manifest_path, manifest_meta)
+    unchanged_ids = {
+        id for id, entry in manifest.items() if previous_manifest.get(id) == entry
+    }
+    previous_rows = (
+        {row['id']: row for row in load_pre_computed_rows()} if unchanged_ids else {}
+    )
+    rows = get_and_process_rows(previous_rows, unchanged_ids)
+    sort_rows(rows)
+    num_reused = len(unchanged_ids & previous_rows.keys())
+    print(
+        f'{len(rows) - num_reused} new or changed conversations processed, {num_reused} unchanged'
+    )
+    write_pre_computed_rows(rows)
+    write_search_index(rows)
+    write_trigram_index(rows, args.full)
+    write_search_db(rows, args.full)
+    write_tfidf_index(rows)
+    save_manifest(
+        manifest_path, {row['id']: manifest.get(row['id']) for row in rows}, manifest_meta
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+"""
+Pack of the rendered Markdown previews in one SQLite file, `preview_pack_db`, for
+`preview_mode = 'pack'`: a file per conversation in `generated_dir` is slow to create,
+delete and sync, and wastes a block per conversation.
+
+Alfred Quick Looks files, so `alfred.py` extracts the previews of the conversations it shows
+to `generated_dir` with `extract_previews`, and the pack removes the extracted files of the
+previews that change. An empty query shows a page of conversations at a time, which
+`alfred.py` extracts the previews of, so the pack needs `alfred_json_page_size`.
+"""
+
+import sqlite3
+import sys
+from typing import Container, Iterable
+from config import generated_dir, preview_pack_db, preview_mode, alfred_json_page_size
+from utils import content_hash
+
+_schema = """
+CREATE TABLE IF NOT EXISTS previews (
+    id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    markdown TEXT NOT NULL
+);
+"""
+
+
+def check_preview_mode():
+    """Exit if `preview_mode` is 'pack' but an empty query lists every conversation at once"""
+    if preview_mode == 'pack' and not alfred_json_page_size:
+        sys.exit(
+            "preview_mode = 'pack' needs alfred_json_page_size in config.py, "
+            'so that an empty query only lists the conversations whose previews alfred.py extracts'
+        )
+
+
+class PreviewPack:
+    """The pack opened for writing, in one transaction that's committed on exit"""
+
+    def __init__(self, full: bool = False):
+        if full:
+            preview_pack_db.unlink(missing_ok=True)
+        self.db = sqlite3.connect(preview_pack_db)
+        self.db.executescript(_schema)
+        # the hashes of the previews in the pack, to only write the changed ones
+        self.hashes: dict[str, str] = dict(self.db.execute('SELECT id, hash FROM previews'))
+
+    def __enter__(self) -> 'PreviewPack':
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.db.commit()
+        self.db.close()
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.hashes
+
+    def put(self, id: str, markdown: str) -> bool:
+        """Store the preview of the conversation `id` unless it's unchanged. Returns whether it was written"""
+        hash = content_hash(markdown)
+        if self.hashes.get(id) == hash:
+            return False
+        self.db.execute(
+            'INSERT OR REPLACE INTO previews (id, hash, markdown) VALUES (?, ?, ?)',
+            (id, hash, markdown),
+        )
+        self.hashes[id] = hash
+        # extracted from the previous version
+        (generated_dir / f'{id}.md').unlink(missing_ok=True)
+        return True
+
+    def remove_except(self, ids: Container[str]) -> int:
+        """Remove the previews of the conversations not in `ids`. Returns how many"""
+        removed = [(id,) for id in self.hashes if id not in ids]
+        self.db.executemany('DELETE FROM previews WHERE id = ?', removed)
+        for (id,) in removed:
+            del self.hashes[id]
+        return len(removed)
+
+
+def extract_previews(ids: Iterable[str]) -> int:
+    """Write the previews of the conversations `ids` from the pack to `generated_dir`. Returns how many"""
+    ids = list(ids)
+    try:
+        db = sqlite3.connect(f'{preview_pack_db.as_uri()}?mode=ro', uri=True)
+    except sqlite3.Error:
+        return 0
+    num_extracted = 0
+    try:
+        # in chunks, since SQLite limits how many parameters a statement can have
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            for id, markdown in db.execute(
+                f'SELECT id, markdown FROM previews WHERE id IN ({", ".join("?" * len(chunk))})',
+                chunk,
+            ):
+                (generated_dir / f'{id}.md').write_text(markdown)
+                num_extracted += 1
+    except sqlite3.Error:
+        pass
+    finally:
+        db.close()
+    return num_extracted
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Author : Xinyuan Chen <45612704+tddschn@users.noreply.github.com>
+Date   : 2024-08-27
+Purpose: Serve the previews of the conversations, rendered from the row store on demand
+"""
+
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import (
+    css_dir,
+    row_store_bin,
+    preview_mode,
+    preview_server_port,
+    preview_cache_max_bytes,
+)
+from row_store import RowStore, LazyRow
+from generate_preview_files import generate_preview_html
+
+
+class LRUCache:
+    """Byte strings by key, dropping the least recently used ones once they add up to more than `max_bytes`"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+
+    def get(self, key: str) -> bytes | None:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes):
+        if key in self._items:
+            self.num_bytes -= len(self._items.pop(key))
+        self._items[key] = value
+        self.num_bytes += len(value)
+        while self.num_bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.num_bytes -= len(evicted)
+
+    def clear(self):
+        self._items.clear()
+        self.num_bytes = 0
+
+
+class Previews:
+    """The previews rendered from the row store, which is mapped again when it changes"""
+
+    def __init__(self, max_bytes: int):
+        self.cache = LRUCache(max_bytes)
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._store: RowStore | None = None
+        self._row_indices: dict[str, int] = {}
+
+    def _reload(self):
+        try:
+            stat = row_store_bin.stat()
+            fingerprint = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            fingerprint = None
+        if fingerprint == self._fingerprint:
+            return
+        self._fingerprint = fingerprint
+        self._store = RowStore.load() if fingerprint is not None else None
+        self._row_indices = (
+            {id: i for i, id in enumerate(self._store.columns['id'])}
+            if self._store is not None
+            else {}
+        )
+        self.cache.clear()
+
+    def get(self, id: str) -> bytes | None:
+        """The HTML preview of the conversation with `id`, None if there isn't one"""
+        with self._lock:
+            self._reload()
+            if (preview := self.cache.get(id)) is not None:
+                return preview
+            if self._store is None or (i := self._row_indices.get(id)) is None:
+                return None
+            preview = generate_preview_html(LazyRow(self._store, i)).encode()
+            self.cache.put(id, preview)
+            return preview
+
+
+def make_handler(previews: Previews, verbose: bool = False):
+    css_files = {f'/css/{path.name}': path for path in css_dir.glob('*.css')}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path in css_files:
+                self._send(css_files[path].read_bytes(), 'text/css; charset=utf-8')
+                return
+            preview = previews.get(path.lstrip('/'))
+            if preview is None:
+                self.send_error(404, 'No such conversation')
+                return
+            self._send(preview, 'text/html; charset=utf-8')
+
+        def _send(self, body: bytes, content_type: str):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if verbose:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+def get_args():
+    """Get command-line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Serve the previews of the conversations, rendered from the row store on demand, '
+        "for Alfred to Quick Look when `preview_mode` is 'server' in config.py",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument(
+        '-p',
+        '--port',
+        help='Port to listen on, on localhost (the rows link to `preview_server_port`)',
+        type=int,
+        default=preview_server_port,
+    )
+
+    parser.add_argument(
+        '-m',
+        '--max-cache-bytes',
+        help='How many bytes of rendered previews to keep in memory',
+        type=int,
+        default=preview_cache_max_bytes,
+    )
+
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        help='Log every request',
+        action='store_true',
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """Make a jazz noise here"""
+
+    args = get_args()
+    if preview_mode != 'server':
+        print(
+            "Warning: `preview_mode` is not 'server' in config.py, so Alfred doesn't preview from the server"
+        )
+    previews = Previews(args.max_cache_bytes)
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', args.port), make_handler(previews, args.verbose)
+    )
+    print(f'Serving previews on http://127.0.0.1:{args.port}')
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
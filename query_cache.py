@@ -0,0 +1,115 @@
+"""
+Cache of the ids of the rows matching recent queries, kept in the workflow cache dir.
+
+Alfred runs the Script Filter again for every keystroke, and the new query usually narrows
+down the previous one (`foo` -> `foob`, `foo` -> `foo|bar`), so only the rows that matched
+the cached query have to be checked again.
+"""
+
+import os
+import pickle
+from pathlib import Path
+from typing import Any
+from field_filters import filter_narrows
+from config import (
+    alfred_query_cache_key,
+    query_cache_size,
+    regex_query_prefix,
+    fuzzy_query_prefix,
+    row_store_bin,
+    pre_computed_rows_meta_msgpack,
+    pre_computed_rows_meta_json,
+)
+
+
+def _subquery_narrows(subquery: str, cached_subquery: str) -> bool:
+    """Whether every row matching `subquery` matches `cached_subquery` too"""
+    if subquery.startswith(fuzzy_query_prefix) or cached_subquery.startswith(
+        fuzzy_query_prefix
+    ):
+        # a longer word can have different typos
+        return subquery == cached_subquery
+    if ('=' in subquery) != ('=' in cached_subquery):
+        return False
+    if '=' not in subquery:
+        return cached_subquery in subquery
+    k, _, v = subquery.partition('=')
+    cached_k, _, cached_v = cached_subquery.partition('=')
+    return k == cached_k and filter_narrows(k, v, cached_v)
+
+
+def query_narrows(query: str, cached_query: str) -> bool:
+    """Whether every row matching `query` matches `cached_query` too"""
+    if query == cached_query:
+        return True
+    if query.startswith(regex_query_prefix) or cached_query.startswith(
+        regex_query_prefix
+    ):
+        return False
+    subqueries = query.lower().split('|')
+    # every subquery of the cached query has to be narrowed down by one of the query
+    return all(
+        any(_subquery_narrows(x, cached_subquery) for x in subqueries)
+        for cached_subquery in cached_query.lower().split('|')
+    )
+
+
+def get_cache_dir() -> Path:
+    """`Workflow3().cachedir`, without constructing a workflow if Alfred says where it is"""
+    if cache_dir := os.environ.get('alfred_workflow_cache'):
+        return Path(cache_dir)
+    from workflow import Workflow3
+
+    return Path(Workflow3().cachedir)
+
+
+def get_rows_fingerprint(first: int | None) -> list[Any]:
+    """Changes when the rows `alfred.py` reads (or how many of them it considers) change"""
+    for path in (row_store_bin, pre_computed_rows_meta_msgpack, pre_computed_rows_meta_json):
+        if path.exists():
+            stat = path.stat()
+            return [str(path), stat.st_mtime_ns, stat.st_size, first]
+    return [first]
+
+
+class QueryCache:
+    """The matching row ids of the last `query_cache_size` queries, least recently used first"""
+
+    def __init__(self, first: int | None = None):
+        # where `Workflow3.cache_data` would keep it, so that `workflow:delcache` clears it
+        self.path = get_cache_dir() / f'{alfred_query_cache_key}.cpickle'
+        self.fingerprint = get_rows_fingerprint(first)
+        try:
+            with self.path.open('rb') as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            data = None
+        self.entries: list[tuple[str, list[int]]] = (
+            data['entries']
+            if isinstance(data, dict) and data.get('fingerprint') == self.fingerprint
+            else []
+        )
+
+    def get(self, query: str) -> list[int] | None:
+        """The matches of the cached query that `query` narrows down the most, None if there isn't one"""
+        best = None
+        for i, (cached_query, row_ids) in enumerate(self.entries):
+            if query_narrows(query, cached_query) and (
+                best is None or len(row_ids) < len(self.entries[best][1])
+            ):
+                best = i
+        if best is None:
+            return None
+        entry = self.entries.pop(best)
+        self.entries.append(entry)
+        return entry[1]
+
+    def add(self, query: str, row_ids: list[int]):
+        self.entries = [x for x in self.entries if x[0] != query]
+        self.entries.append((query, row_ids))
+        del self.entries[:-query_cache_size]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f'{self.path.name}.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump({'fingerprint': self.fingerprint, 'entries': self.entries}, f, -1)
+        tmp_path.replace(self.path)
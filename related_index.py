@@ -0,0 +1,121 @@
+"""
+TF-IDF vectors of the rows' `concatenated_messages`, built by `preprocess_conversations.py`,
+for the `related=<id>` queries of `alfred.py`, which show the conversations most similar
+(by cosine similarity) to the one with that id.
+
+The sparse matrix of the L2-normalized vectors is stored with NumPy, both by row (CSR),
+to get the vector of a conversation, and by term (CSC), to compute its dot products with
+every other conversation at once. Only the terms of more than one conversation are stored,
+since the others don't make any two conversations similar.
+
+NumPy is optional: without it, the index isn't built and `related=` queries aren't answered.
+"""
+
+from collections import Counter
+from config import tfidf_index_npz
+from search_index import tokenize
+
+# terms in more than this fraction of the conversations are too common to tell them apart
+max_document_frequency = 0.5
+
+
+def _terms(text: str) -> list[str]:
+    return [x for x in tokenize(text.lower()) if len(x) > 1 and not x.isdigit()]
+
+
+def write_tfidf_index(rows: list[dict]):
+    """Write the TF-IDF matrix of the `concatenated_messages` of `rows` to `tfidf_index_npz`"""
+    try:
+        import numpy as np
+    except ImportError:
+        tfidf_index_npz.unlink(missing_ok=True)
+        print('NumPy is not installed, not writing the index of related conversations')
+        return
+
+    vocabulary: dict[str, int] = {}
+    term_ids, counts, row_lengths = [], [], []
+    for row in rows:
+        term_counts = Counter(_terms(row['concatenated_messages']))
+        term_ids.extend(vocabulary.setdefault(x, len(vocabulary)) for x in term_counts)
+        counts.extend(term_counts.values())
+        row_lengths.append(len(term_counts))
+    num_rows = len(rows)
+    term_ids = np.array(term_ids, dtype=np.int32)
+    row_ids = np.repeat(np.arange(num_rows, dtype=np.int32), row_lengths)
+    document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+    idf = np.log((1 + num_rows) / (1 + document_frequency)) + 1
+    weights = (1 + np.log(np.array(counts, dtype=np.float64))) * idf[term_ids]
+    weights[document_frequency[term_ids] > max_document_frequency * num_rows] = 0
+    norms = np.sqrt(np.bincount(row_ids, weights=weights**2, minlength=num_rows))
+    weights /= np.maximum(norms, 1e-12)[row_ids]
+    stored = (weights > 0) & (document_frequency[term_ids] > 1)
+    term_ids, row_ids, weights = term_ids[stored], row_ids[stored], weights[stored]
+
+    # by term, then by row
+    order = np.lexsort((row_ids, term_ids))
+    tmp_path = tfidf_index_npz.with_name(f'{tfidf_index_npz.stem}.tmp.npz')
+    np.savez(
+        tmp_path,
+        row_indptr=np.concatenate(([0], np.cumsum(np.bincount(row_ids, minlength=num_rows)))),
+        row_terms=term_ids,
+        row_weights=weights.astype(np.float32),
+        term_indptr=np.concatenate(
+            ([0], np.cumsum(np.bincount(term_ids, minlength=len(vocabulary))))
+        ),
+        term_rows=row_ids[order],
+        term_weights=weights[order].astype(np.float32),
+    )
+    tmp_path.replace(tfidf_index_npz)
+    print(f'Wrote index of related conversations to {tfidf_index_npz}')
+
+
+class TfidfIndex:
+    def __init__(self, arrays):
+        self.row_indptr = arrays['row_indptr']
+        self.row_terms = arrays['row_terms']
+        self.row_weights = arrays['row_weights']
+        self.term_indptr = arrays['term_indptr']
+        self.term_rows = arrays['term_rows']
+        self.term_weights = arrays['term_weights']
+        self.num_rows = len(self.row_indptr) - 1
+
+    @classmethod
+    def load(cls) -> 'TfidfIndex | None':
+        """Load the index written by `write_tfidf_index`, None if there isn't one or no NumPy"""
+        try:
+            import numpy as np
+
+            with np.load(tfidf_index_npz) as arrays:
+                return cls(arrays)
+        except (ImportError, OSError, KeyError, ValueError):
+            return None
+
+    def related(self, row_id: int, k: int, first: int | None = None) -> list[int]:
+        """
+        Ids of the (at most `k`) rows most similar to the row `row_id`, most similar first,
+        among the `first` rows if given.
+        """
+        import numpy as np
+
+        start, end = self.row_indptr[row_id], self.row_indptr[row_id + 1]
+        terms, weights = self.row_terms[start:end], self.row_weights[start:end]
+        # the postings of every term of the row, one after another
+        starts, ends = self.term_indptr[terms], self.term_indptr[terms + 1]
+        lengths = ends - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(
+            lengths.sum()
+        )
+        # the dot products with the row, i.e. the cosine similarities
+        scores = np.bincount(
+            self.term_rows[positions],
+            weights=self.term_weights[positions] * np.repeat(weights, lengths),
+            minlength=self.num_rows,
+        )
+        scores[row_id] = 0
+        if first:
+            scores[first:] = 0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind='stable')].tolist()
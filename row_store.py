@@ -0,0 +1,329 @@
+"""
+Stores of the pre-computed rows that keep the message bodies apart from the small fields,
+so that `alfred.py` doesn't read or decode the bodies of every conversation:
+
+- the binary row store that `alfred.py` memory-maps
+- separate metadata and text files (msgpack, or JSON without it), read with `load_split_rows`
+
+Both are written with the most recently updated rows first, and are read a part at a time,
+so that `alfred.py --first N` only decodes the first N rows.
+
+Layout of the row store (little-endian):
+
+- header: magic, metadata format, number of rows, rows per metadata block,
+  metadata offset and length
+- metadata offset table: `num_blocks + 2` uint64 offsets of the metadata entries, relative to
+  the start of the metadata
+- body offset table: `len(body_fields) * num_rows + 1` uint64 offsets of the bodies,
+  relative to the end of the metadata
+- metadata (msgpack, or JSON without it): the names of the body fields, then a block per
+  `rows_per_block` rows with every field of them but the bodies, one column per field
+- bodies: the UTF-8 `body_fields` of every row, one after another
+
+The split files are a msgpack array of the rows without their bodies, and one of the names
+of the body fields followed by the bodies of each row, or the same as JSON Lines without msgpack.
+"""
+
+import json
+import mmap
+import struct
+from array import array
+from itertools import chain, islice
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Mapping
+from config import (
+    row_store_bin,
+    pre_computed_rows_meta_msgpack,
+    pre_computed_rows_text_msgpack,
+    pre_computed_rows_meta_json,
+    pre_computed_rows_text_json,
+)
+
+# the big fields, only read for the rows that need them
+# (`_alfred_item` is only needed for the rows that are shown)
+body_fields = ('concatenated_messages', '_search_key', '_alfred_item')
+
+_magic = b'ROW2'
+_metadata_json, _metadata_msgpack = 0, 1
+# magic, metadata format, number of rows, rows per metadata block, metadata offset and length
+_header = struct.Struct('<4sIIIQQ')
+rows_per_block = 256
+
+
+class LazyRow(Mapping[str, Any]):
+    """A row of the store, which reads its `body_fields` from the store when they're accessed"""
+
+    __slots__ = ('_store', '_i', '_bodies')
+
+    def __init__(self, store: 'RowStore', i: int):
+        self._store = store
+        self._i = i
+        self._bodies: dict[str, str] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._store.body_indices:
+            try:
+                return self._bodies[key]
+            except KeyError:
+                body = self._bodies[key] = self._store.body(self._i, key)
+                return body
+        if key in self._store.columns:
+            return self._store.columns[key][self._i]
+        return self._store.extras.get(self._i, {})[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._store.columns
+        yield from self._store.body_indices
+        yield from self._store.extras.get(self._i, ())
+
+    def __len__(self) -> int:
+        return (
+            len(self._store.columns)
+            + len(self._store.body_indices)
+            + len(self._store.extras.get(self._i, ()))
+        )
+
+    def __repr__(self) -> str:
+        return f'LazyRow({self._store.columns["id"][self._i]!r})'
+
+
+def write_row_store(rows: list[dict]):
+    """Write `rows` to `row_store_bin`"""
+    common_fields = [
+        k
+        for k in (rows[0] if rows else ())
+        if k not in body_fields and all(k in row for row in rows)
+    ]
+    entries: list[Any] = [body_fields]
+    for start in range(0, len(rows), rows_per_block):
+        block = rows[start : start + rows_per_block]
+        entries.append(
+            {
+                'columns': {k: [row[k] for row in block] for k in common_fields},
+                # fields that not every row has, by row index
+                'extras': {
+                    str(i): extra
+                    for i, row in enumerate(block, start)
+                    if (
+                        extra := {
+                            k: v
+                            for k, v in row.items()
+                            if k not in body_fields and k not in common_fields
+                        }
+                    )
+                },
+            }
+        )
+    try:
+        import msgpack
+
+        metadata_format, encode = _metadata_msgpack, msgpack.packb
+    except ImportError:
+        metadata_format = _metadata_json
+        encode = lambda x: json.dumps(x, ensure_ascii=False).encode()  # noqa: E731
+    encoded_entries = [encode(x) for x in entries]
+    entry_offsets = array('Q', [0])
+    for x in encoded_entries:
+        entry_offsets.append(entry_offsets[-1] + len(x))
+
+    offsets = array('Q', [0])
+    bodies = bytearray()
+    for row in rows:
+        for field in body_fields:
+            bodies += row[field].encode()
+            offsets.append(len(bodies))
+
+    metadata_offset = _header.size + (len(entry_offsets) + len(offsets)) * 8
+    tmp_path = row_store_bin.with_name(f'{row_store_bin.name}.tmp')
+    with tmp_path.open('wb') as f:
+        f.write(
+            _header.pack(
+                _magic,
+                metadata_format,
+                len(rows),
+                rows_per_block,
+                metadata_offset,
+                entry_offsets[-1],
+            )
+        )
+        f.write(entry_offsets.tobytes())
+        f.write(offsets.tobytes())
+        f.writelines(encoded_entries)
+        f.write(bodies)
+    tmp_path.replace(row_store_bin)
+    print(f'Wrote row store to {row_store_bin}')
+
+
+class RowStore:
+    """
+    The rows of the store, of which only the first `first` (all if None) are decoded.
+    `num_rows` is the number of rows in the store.
+    """
+
+    def __init__(self, buffer: mmap.mmap, first: int | None = None):
+        self._buffer = buffer
+        magic, metadata_format, self.num_rows, block_rows, metadata_offset, metadata_length = (
+            _header.unpack_from(buffer)
+        )
+        if magic != _magic:
+            raise ValueError(f'{row_store_bin} is not a row store')
+        if metadata_format == _metadata_msgpack:
+            import msgpack
+
+            decode = msgpack.unpackb
+        else:
+            decode = json.loads
+        num_blocks = -(-self.num_rows // block_rows)
+        entry_offsets = memoryview(buffer)[
+            _header.size : _header.size + (num_blocks + 2) * 8
+        ].cast('Q')
+
+        def entry(i: int) -> Any:
+            start, end = entry_offsets[i : i + 2]
+            return decode(buffer[metadata_offset + start : metadata_offset + end])
+
+        self._bodies_offset = metadata_offset + metadata_length
+        # the body fields the store was written with, which are the ones it has offsets for
+        self.body_indices = {field: i for i, field in enumerate(entry(0))}
+        body_offsets_start = _header.size + len(entry_offsets) * 8
+        self._offsets = memoryview(buffer)[
+            body_offsets_start : body_offsets_start
+            + (len(self.body_indices) * self.num_rows + 1) * 8
+        ].cast('Q')
+        self.num_decoded_rows = (
+            self.num_rows if first is None else max(0, min(first, self.num_rows))
+        )
+        self.columns: dict[str, list] = {}
+        self.extras: dict[int, dict] = {}
+        for block in range(1, -(-self.num_decoded_rows // block_rows) + 1):
+            metadata = entry(block)
+            for k, values in metadata['columns'].items():
+                self.columns.setdefault(k, []).extend(values)
+            self.extras.update((int(i), extra) for i, extra in metadata['extras'].items())
+
+    @classmethod
+    def load(cls, first: int | None = None) -> 'RowStore | None':
+        """Map the store written by `write_row_store`, None if there isn't a readable one"""
+        try:
+            with row_store_bin.open('rb') as f:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), first)
+        except (OSError, ValueError, TypeError, KeyError, ImportError, struct.error):
+            return None
+
+    def body(self, i: int, field: str) -> str:
+        j = i * len(self.body_indices) + self.body_indices[field]
+        start = self._bodies_offset + self._offsets[j]
+        end = self._bodies_offset + self._offsets[j + 1]
+        return str(self._buffer[start:end], 'utf-8')
+
+    def rows(self) -> list[LazyRow]:
+        """The decoded rows"""
+        return [LazyRow(self, i) for i in range(self.num_decoded_rows)]
+
+
+def write_split_rows(rows: list[dict]):
+    """
+    Write the rows without their `body_fields` (which are kept as None placeholders,
+    so that the fields stay in order) and the `body_fields` of every row to separate files,
+    each starting with a header: the number of rows, and the names of the body fields.
+    """
+    metadata = [
+        {k: None if k in body_fields else v for k, v in row.items()} for row in rows
+    ]
+    text = ([row[field] for field in body_fields] for row in rows)
+    try:
+        import msgpack
+
+        pre_computed_rows_meta_msgpack.write_bytes(msgpack.packb([len(rows), *metadata]))  # type: ignore
+        pre_computed_rows_text_msgpack.write_bytes(msgpack.packb([body_fields, *text]))  # type: ignore
+        paths = pre_computed_rows_meta_msgpack, pre_computed_rows_text_msgpack
+        stale_paths = pre_computed_rows_meta_json, pre_computed_rows_text_json
+    except ImportError:
+        _write_json_lines(pre_computed_rows_meta_json, len(rows), metadata)
+        _write_json_lines(pre_computed_rows_text_json, body_fields, text)
+        paths = pre_computed_rows_meta_json, pre_computed_rows_text_json
+        stale_paths = pre_computed_rows_meta_msgpack, pre_computed_rows_text_msgpack
+    for path in stale_paths:
+        path.unlink(missing_ok=True)
+    print(f'Wrote pre-computed rows to {paths[0]} and {paths[1]}')
+
+
+def _write_json_lines(path: Path, header: Any, records: Iterable[Any]):
+    with path.open('w') as f:
+        for x in chain([header], records):
+            f.write(json.dumps(x, ensure_ascii=False))
+            f.write('\n')
+
+
+def load_split_rows(
+    text: bool = True, first: int | None = None
+) -> tuple[list[dict], int] | None:
+    """
+    Load the first `first` (all if None) rows written by `write_split_rows`, and the number
+    of rows there are, None if there aren't any.
+
+    Unless `text`, the text file isn't read at all, and the `body_fields` of the rows are None.
+    """
+    if first is not None:
+        first = max(0, first)
+    try:
+        import msgpack  # noqa: F401
+
+        if pre_computed_rows_meta_msgpack.exists():
+            return _load_split_rows(
+                _read_msgpack_records,
+                pre_computed_rows_meta_msgpack,
+                pre_computed_rows_text_msgpack,
+                text,
+                first,
+            )
+    except ImportError:
+        pass
+    if pre_computed_rows_meta_json.exists():
+        return _load_split_rows(
+            _read_json_lines,
+            pre_computed_rows_meta_json,
+            pre_computed_rows_text_json,
+            text,
+            first,
+        )
+    return None
+
+
+def _read_msgpack_records(path: Path, first: int | None) -> tuple[Any, list]:
+    """The header and the first `first` (all if None) records of a split rows file"""
+    import msgpack
+
+    if first is None:
+        header, *records = msgpack.unpackb(path.read_bytes())
+        return header, records
+    with path.open('rb') as f:
+        unpacker = msgpack.Unpacker(f)
+        num_records = unpacker.read_array_header() - 1
+        header = unpacker.unpack()
+        return header, [unpacker.unpack() for _ in range(min(first, num_records))]
+
+
+def _read_json_lines(path: Path, first: int | None) -> tuple[Any, list]:
+    """The header and the first `first` (all if None) records of a split rows file"""
+    with path.open() as f:
+        header = json.loads(next(f))
+        return header, [json.loads(x) for x in islice(f, first)]
+
+
+def _load_split_rows(
+    read: Callable[[Path, int | None], tuple[Any, list]],
+    meta_path: Path,
+    text_path: Path,
+    text: bool,
+    first: int | None,
+) -> tuple[list[dict], int] | None:
+    num_rows, rows = read(meta_path, first)
+    if not isinstance(num_rows, int):
+        # written by an older version
+        return None
+    if text:
+        fields, bodies = read(text_path, first)
+        for row, values in zip(rows, bodies):
+            row.update(zip(fields, values))
+    return rows, num_rows
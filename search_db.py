@@ -0,0 +1,161 @@
+"""
+SQLite database of the pre-computed rows, with an FTS5 table over their titles and messages
+and indexed columns for the model and timestamps, built by `preprocess_conversations.py`.
+
+`alfred.py --backend fts` answers queries from it with FTS5 `MATCH`, ordered by `bm25()`.
+"""
+
+import re
+import sqlite3
+from config import search_db_path, regex_query_prefix, fuzzy_query_prefix
+from field_filters import time_filters, parse_field_filter
+from utils import content_hash
+
+# the fields that `field=value` subqueries can filter on
+filter_fields = ('id', 'title', 'model', 'create_time', 'update_time')
+# how much more a match in the title counts than one in the messages
+title_weight = 10.0
+
+_schema = f"""
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS conversations (
+    doc INTEGER PRIMARY KEY,
+    row_id INTEGER NOT NULL,
+    key_hash TEXT NOT NULL,
+    {', '.join(f'{field} TEXT' for field in filter_fields)}
+);
+CREATE INDEX IF NOT EXISTS conversations_id ON conversations (id);
+CREATE INDEX IF NOT EXISTS conversations_model ON conversations (model);
+CREATE INDEX IF NOT EXISTS conversations_create_time ON conversations (create_time);
+CREATE INDEX IF NOT EXISTS conversations_update_time ON conversations (update_time);
+CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5 (
+    title, messages, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+"""
+
+
+def write_search_db(rows: list[dict], full: bool = False):
+    """
+    Write the rows to `search_db_path`, only (re-)indexing the ones whose `_search_key` changed
+    since the last run, unless `full`.
+    """
+    if full:
+        search_db_path.unlink(missing_ok=True)
+    db = sqlite3.connect(search_db_path)
+    with db:
+        db.executescript(_schema)
+        previous = {
+            id: (doc, key_hash)
+            for doc, id, key_hash in db.execute('SELECT doc, id, key_hash FROM conversations')
+        }
+        unchanged, new = [], []
+        for row_id, row in enumerate(rows):
+            key_hash = content_hash(row['_search_key'])
+            doc, previous_key_hash = previous.pop(row['id'], (None, None))
+            if previous_key_hash == key_hash:
+                unchanged.append((row_id, doc))
+            else:
+                new.append((row_id, key_hash, row))
+                if doc is not None:
+                    previous[row['id']] = (doc, previous_key_hash)
+        # the conversations that were deleted or changed
+        deleted_docs = [(doc,) for doc, _ in previous.values()]
+        db.executemany('DELETE FROM conversations WHERE doc = ?', deleted_docs)
+        db.executemany('DELETE FROM conversations_fts WHERE rowid = ?', deleted_docs)
+        db.executemany('UPDATE conversations SET row_id = ? WHERE doc = ?', unchanged)
+        for row_id, key_hash, row in new:
+            doc = db.execute(
+                f'INSERT INTO conversations (row_id, key_hash, {", ".join(filter_fields)}) '
+                f'VALUES (?, ?, {", ".join("?" * len(filter_fields))})',
+                (row_id, key_hash, *(_field_text(row.get(x)) for x in filter_fields)),
+            ).lastrowid
+            db.execute(
+                'INSERT INTO conversations_fts (rowid, title, messages) VALUES (?, ?, ?)',
+                (doc, row.get('title') or '', row['concatenated_messages']),
+            )
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('num_rows', ?)", (len(rows),))
+    db.close()
+    print(
+        f'Wrote search database to {search_db_path}, {len(new)} conversations indexed, {len(deleted_docs)} removed'
+    )
+
+
+def _field_text(value) -> str | None:
+    return None if value is None else str(value)
+
+
+def _fts_phrase(text: str) -> str | None:
+    """FTS5 phrase of the words of `text`, the last one a prefix since it may still be typed"""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return '"{}" *'.format(' '.join(words))
+
+
+class SearchDB:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.num_rows: int = db.execute(
+            "SELECT value FROM meta WHERE key = 'num_rows'"
+        ).fetchone()[0]
+
+    @classmethod
+    def load(cls) -> 'SearchDB | None':
+        """Open the database written by `write_search_db`, None if there isn't a usable one"""
+        if not search_db_path.exists():
+            return None
+        try:
+            return cls(sqlite3.connect(f'{search_db_path.as_uri()}?mode=ro', uri=True))
+        except (sqlite3.Error, TypeError):
+            return None
+
+    def search(
+        self, query: str, first: int | None = None, limit: int | None = None
+    ) -> list[int] | None:
+        """
+        Ids of the (at most `limit`) rows matching the subqueries of `query` (split by `|`),
+        best match first.
+
+        Plain subqueries are matched as phrases of words with FTS5, `field=value` ones
+        as substrings of the `filter_fields`, and the `time_filters` by the indexed times.
+        None if `query` has nothing to match with FTS5, filters a field that isn't in the database,
+        is a regular expression, or has a fuzzy subquery.
+        """
+        if query.startswith(regex_query_prefix):
+            return None
+        phrases, conditions, params = [], [], []
+        for subquery in query.lower().split('|'):
+            if subquery.startswith(fuzzy_query_prefix):
+                return None
+            if '=' in subquery:
+                k, v = parse_field_filter(subquery)
+                if k in time_filters:
+                    field, before = time_filters[k]
+                    conditions.append(f'c.{field} {"<" if before else ">="} ?')
+                elif k in filter_fields:
+                    conditions.append(f'instr(lower(c.{k}), ?) > 0')
+                else:
+                    return None
+                params.append(v)
+            elif (phrase := _fts_phrase(subquery)) is not None:
+                phrases.append(phrase)
+        if not phrases:
+            return None
+        if first:
+            conditions.append('c.row_id < ?')
+            params.append(first)
+        sql = (
+            'SELECT c.row_id FROM conversations_fts f JOIN conversations c ON c.doc = f.rowid '
+            f'WHERE conversations_fts MATCH ? {"".join(f" AND {x}" for x in conditions)} '
+            f'ORDER BY bm25(conversations_fts, {title_weight}, 1.0) LIMIT ?'
+        )
+        try:
+            return [
+                row_id
+                for row_id, in self.db.execute(
+                    sql, (' AND '.join(phrases), *params, limit or -1)
+                )
+            ]
+        except sqlite3.OperationalError:
+            # e.g. the FTS5 query couldn't be parsed
+            return None
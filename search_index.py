@@ -0,0 +1,731 @@
+"""
+Indexes of the rows' `_search_key`s, built by `preprocess_conversations.py` and used by
+`alfred.filter_query` to narrow down the rows it has to check:
+
+- `SearchIndex`: inverted index from the tokens to sorted posting lists of row ids.
+  Everything is stored in a few big strings and uint32 arrays, so loading the index
+  doesn't need to build an object per token.
+- `FieldIndex`: the rows by model and sorted by their times, for the typed filters of
+  `field_filters`. It's stored with the `SearchIndex`.
+- `TitleIndex`: the words of the titles, and what they become with a few characters deleted
+  (symmetric delete), to find the words a misspelled one can be. Also stored with the `SearchIndex`.
+- `TrigramIndex`: inverted index from every 3 characters to posting lists of documents,
+  for arbitrary substrings and regular expressions (like Google Code Search).
+  It's memory-mapped, so only the posting lists a query needs are read,
+  and updated in place for new or changed rows, since indexing every trigram is slow.
+"""
+
+import re
+import mmap
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from itertools import repeat
+from typing import Any, Callable, Iterable, Mapping
+from config import (
+    search_index_json,
+    search_index_msgpack,
+    trigram_index_bin,
+    fuzzy_query_prefix,
+)
+from field_filters import time_filters, parse_field_filter
+from utils import content_hash, get_manifest_path, load_manifest, save_manifest
+
+try:
+    # Python 3.11+
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:
+    import sre_parse  # type: ignore
+
+_token_pattern = re.compile(r'\w+')
+# sorts after every token that starts with the string it's appended to
+_max_char = '\U0010ffff'
+_few_candidates = 32
+
+
+def tokenize(text: str) -> list[str]:
+    return _token_pattern.findall(text)
+
+
+def _uint32s(values: Iterable[int]) -> bytes:
+    return array('I', values).tobytes()
+
+
+def _from_uint32s(b: bytes) -> array:
+    a = array('I')
+    a.frombytes(b)
+    return a
+
+
+def _join_strings(strings: list[str]) -> tuple[str, bytes]:
+    """Join `strings` (which can't contain newlines) into one string, with the offsets of each"""
+    offsets = [0]
+    for s in strings:
+        offsets.append(offsets[-1] + len(s) + 1)
+    return '\n'.join(strings) + '\n', _uint32s(offsets)
+
+
+class _JoinedStrings:
+    """Read-only sequence of the strings joined by `_join_strings`, usable with bisect"""
+
+    def __init__(self, joined: str, offsets: bytes):
+        self.joined = joined
+        self.offsets = _from_uint32s(offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.joined[self.offsets[i] : self.offsets[i + 1] - 1]
+
+    def search(self, substring: str) -> list[int]:
+        """Indices of the strings that contain `substring`"""
+        indices = []
+        for m in re.finditer(re.escape(substring), self.joined):
+            i = bisect_right(self.offsets, m.start()) - 1
+            if not indices or indices[-1] != i:
+                indices.append(i)
+        return indices
+
+
+def build_search_index(rows: list[dict]) -> dict:
+    """Build the index of the `_search_key` tokens of `rows`"""
+    token_to_row_ids: dict[str, list[int]] = {}
+    for row_id, row in enumerate(rows):
+        for token in set(tokenize(row['_search_key'])):
+            token_to_row_ids.setdefault(token, []).append(row_id)
+    tokens = sorted(token_to_row_ids)
+    joined_tokens, token_offsets = _join_strings(tokens)
+    posting_offsets = [0]
+    for token in tokens:
+        posting_offsets.append(posting_offsets[-1] + len(token_to_row_ids[token]))
+    # for looking up tokens by suffix
+    reversed_tokens = sorted((token[::-1], i) for i, token in enumerate(tokens))
+    joined_reversed_tokens, reversed_token_offsets = _join_strings(
+        [x for x, _ in reversed_tokens]
+    )
+    return build_field_index(rows) | build_title_index(rows) | {
+        'num_rows': len(rows),
+        'tokens': joined_tokens,
+        'token_offsets': token_offsets,
+        'postings': _uint32s(
+            row_id for token in tokens for row_id in token_to_row_ids[token]
+        ),
+        'posting_offsets': _uint32s(posting_offsets),
+        'reversed_tokens': joined_reversed_tokens,
+        'reversed_token_offsets': reversed_token_offsets,
+        'reversed_token_ids': _uint32s(i for _, i in reversed_tokens),
+    }
+
+
+# the fields of the `time_filters`
+_time_fields = sorted({field for field, _ in time_filters.values()})
+
+
+def build_field_index(rows: list[dict]) -> dict:
+    """Build the index of the models and times of `rows`"""
+    model_to_row_ids: dict[str, list[int]] = {}
+    for row_id, row in enumerate(rows):
+        if isinstance(model := row.get('model'), str):
+            model_to_row_ids.setdefault(model, []).append(row_id)
+    model_offsets = [0]
+    for row_ids in model_to_row_ids.values():
+        model_offsets.append(model_offsets[-1] + len(row_ids))
+    index = {
+        'models': list(model_to_row_ids),
+        'model_offsets': _uint32s(model_offsets),
+        'model_row_ids': _uint32s(
+            row_id for row_ids in model_to_row_ids.values() for row_id in row_ids
+        ),
+    }
+    for field in _time_fields:
+        times = sorted(
+            (row[field], row_id)
+            for row_id, row in enumerate(rows)
+            if isinstance(row.get(field), str)
+        )
+        index[f'{field}s'] = [time for time, _ in times]
+        index[f'{field}_row_ids'] = _uint32s(row_id for _, row_id in times)
+    return index
+
+
+# how many typos the words of the titles are indexed for
+_max_fuzzy_distance = 2
+
+
+def fuzzy_max_distance(word: str) -> int:
+    """How many typos a word of a fuzzy subquery can have"""
+    return 0 if len(word) < 3 else 1 if len(word) < 6 else 2
+
+
+def osa_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Edit distance of `a` and `b`, counting swapping adjacent characters as one edit
+    (optimal string alignment), or `max_distance + 1` if it's more than `max_distance`.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    before_previous, previous, current = [], [], list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        previous, current = current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if (
+                i > 1
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+                and before_previous[j - 2] + 1 < current[j]
+            ):
+                current[j] = before_previous[j - 2] + 1
+        if min(current) > max_distance:
+            return max_distance + 1
+        before_previous = previous
+    return min(current[-1], max_distance + 1)
+
+
+def _deletes(word: str, n: int) -> set[str]:
+    """`word` with up to `n` of its characters deleted (but not all of them)"""
+    deletes = frontier = {word}
+    for _ in range(n):
+        frontier = {x[:i] + x[i + 1 :] for x in frontier if len(x) > 1 for i in range(len(x))}
+        deletes = deletes | frontier
+    return deletes
+
+
+def title_words(row: Mapping[str, Any]) -> set[str]:
+    return set(tokenize((row.get('title') or '').lower()))
+
+
+def similar_words(word: str, words: Iterable[str]) -> set[str]:
+    """The `words` that `word` can be a misspelling of, without an index"""
+    max_distance = fuzzy_max_distance(word)
+    return {x for x in words if osa_distance(word, x, max_distance) <= max_distance}
+
+
+def build_title_index(rows: list[dict]) -> dict:
+    """Build the index of the words of the titles of `rows`"""
+    token_to_row_ids: dict[str, list[int]] = {}
+    for row_id, row in enumerate(rows):
+        for token in title_words(row):
+            token_to_row_ids.setdefault(token, []).append(row_id)
+    tokens = sorted(token_to_row_ids)
+    posting_offsets = [0]
+    for token in tokens:
+        posting_offsets.append(posting_offsets[-1] + len(token_to_row_ids[token]))
+    delete_to_token_ids: dict[str, list[int]] = {}
+    for token_id, token in enumerate(tokens):
+        for delete in _deletes(token, _max_fuzzy_distance):
+            delete_to_token_ids.setdefault(delete, []).append(token_id)
+    deletes = sorted(delete_to_token_ids)
+    delete_offsets = [0]
+    for delete in deletes:
+        delete_offsets.append(delete_offsets[-1] + len(delete_to_token_ids[delete]))
+    joined_tokens, token_offsets = _join_strings(tokens)
+    joined_deletes, delete_token_offsets = _join_strings(deletes)
+    return {
+        'title_tokens': joined_tokens,
+        'title_token_offsets': token_offsets,
+        'title_postings': _uint32s(
+            row_id for token in tokens for row_id in token_to_row_ids[token]
+        ),
+        'title_posting_offsets': _uint32s(posting_offsets),
+        'title_delete_tokens': joined_deletes,
+        'title_delete_token_offsets': delete_token_offsets,
+        'title_delete_token_ids': _uint32s(
+            token_id for delete in deletes for token_id in delete_to_token_ids[delete]
+        ),
+        'title_delete_offsets': _uint32s(delete_offsets),
+    }
+
+
+def write_search_index(rows: list[dict]):
+    index = build_search_index(rows)
+    try:
+        import msgpack
+
+        search_index_msgpack.write_bytes(msgpack.packb(index))  # type: ignore
+        search_index_json.unlink(missing_ok=True)
+        print(f'Wrote search index to {search_index_msgpack}')
+    except ImportError:
+        import json
+        import base64
+
+        search_index_json.write_text(
+            json.dumps(
+                {
+                    k: base64.b64encode(v).decode() if isinstance(v, bytes) else v
+                    for k, v in index.items()
+                }
+            )
+        )
+        search_index_msgpack.unlink(missing_ok=True)
+        print(f'Wrote search index to {search_index_json}')
+
+
+class SearchIndex:
+    def __init__(self, data: dict):
+        self.num_rows: int = data['num_rows']
+        self.tokens = _JoinedStrings(data['tokens'], data['token_offsets'])
+        self._postings = memoryview(data['postings'])
+        self._posting_offsets = _from_uint32s(data['posting_offsets'])
+        self.reversed_tokens = _JoinedStrings(
+            data['reversed_tokens'], data['reversed_token_offsets']
+        )
+        self.reversed_token_ids = _from_uint32s(data['reversed_token_ids'])
+        # indexes written before there were typed filters don't have it
+        self.fields = FieldIndex(data) if 'models' in data else None
+        self.titles = TitleIndex(data) if 'title_tokens' in data else None
+
+    @classmethod
+    def load(cls) -> 'SearchIndex | None':
+        """Load the index written by `write_search_index`, None if there isn't one"""
+        try:
+            import msgpack
+
+            if search_index_msgpack.exists():
+                return cls(msgpack.unpackb(search_index_msgpack.read_bytes()))
+        except ImportError:
+            pass
+        if search_index_json.exists():
+            import json
+            import base64
+
+            data = json.loads(search_index_json.read_text())
+            return cls(
+                {
+                    k: v
+                    if not isinstance(v, str) or k.endswith('tokens')
+                    else base64.b64decode(v)
+                    for k, v in data.items()
+                }
+            )
+        return None
+
+    def postings(self, token_id: int) -> array:
+        start, end = self._posting_offsets[token_id], self._posting_offsets[token_id + 1]
+        return _from_uint32s(self._postings[start * 4 : end * 4])
+
+    def _num_postings(self, token_ids: list[int], limit: int) -> int:
+        """Total length of the posting lists of `token_ids`, counting only up to `limit`"""
+        n = 0
+        for token_id in token_ids:
+            n += self._posting_offsets[token_id + 1] - self._posting_offsets[token_id]
+            if n >= limit:
+                break
+        return n
+
+    def _token_ids(
+        self, token: str, exact_start: bool, exact_end: bool
+    ) -> list[int] | None:
+        """Ids of the indexed tokens that `token` can be part of, None if it's not worth finding out"""
+        if exact_start:
+            lo = bisect_left(self.tokens, token)
+            if exact_end:
+                return [lo] if lo < len(self.tokens) and self.tokens[lo] == token else []
+            return list(range(lo, bisect_left(self.tokens, token + _max_char, lo)))
+        if exact_end:
+            reversed_token = token[::-1]
+            lo = bisect_left(self.reversed_tokens, reversed_token)
+            hi = bisect_left(self.reversed_tokens, reversed_token + _max_char, lo)
+            return self.reversed_token_ids[lo:hi].tolist()
+        if len(token) < 3:
+            # part of too many tokens
+            return None
+        return self.tokens.search(token)
+
+    def _token_row_ids(self, token_ids: list[int]) -> set[int]:
+        row_ids = set()
+        for token_id in token_ids:
+            row_ids.update(self.postings(token_id))
+        return row_ids
+
+    def candidates(self, subqueries: list[str]) -> set[int] | None:
+        """
+        Ids of the rows whose `_search_key` can contain all of the plain (lowercased) `subqueries`
+        and that can match their `field=value` filters, a superset of the matching rows.
+        None if the subqueries can't narrow anything down.
+        """
+        # each word of a subquery must be a part of a token of the row,
+        # and a whole token if it's in the middle of the subquery
+        token_id_lists = [
+            token_ids
+            for subquery in subqueries
+            if '=' not in subquery and not subquery.startswith(fuzzy_query_prefix)
+            for m in _token_pattern.finditer(subquery)
+            if (
+                token_ids := self._token_ids(
+                    m.group(), m.start() > 0, m.end() < len(subquery)
+                )
+            )
+            is not None
+        ]
+        # words and filters that most rows match don't narrow anything down and are expensive
+        # to intersect, leave them to the caller's check
+        limit = self.num_rows // 4
+        # (how many rows can match, a function returning their ids)
+        sized: list[tuple[int, Callable[[], set[int]]]] = [
+            (self._num_postings(ids, limit), lambda ids=ids: self._token_row_ids(ids))
+            for ids in token_id_lists
+        ]
+        if self.fields is not None:
+            sized += [
+                constraint
+                for subquery in subqueries
+                if '=' in subquery
+                and not subquery.startswith(fuzzy_query_prefix)
+                and (constraint := self.fields.constraint(*parse_field_filter(subquery)))
+                is not None
+            ]
+        if self.titles is not None:
+            titles = self.titles
+            for subquery in subqueries:
+                if subquery.startswith(fuzzy_query_prefix):
+                    for word in tokenize(subquery[len(fuzzy_query_prefix) :]):
+                        ids = titles.similar_token_ids(word)
+                        sized.append(
+                            (titles.num_postings(ids), lambda ids=ids: titles.row_ids(ids))
+                        )
+        sized = sorted((x for x in sized if x[0] < limit), key=lambda x: x[0])
+        # intersect the most selective ones first, and stop once there are few enough
+        # candidates left for the caller to check directly
+        result: set[int] | None = None
+        for _, get_row_ids in sized:
+            row_ids = get_row_ids()
+            result = row_ids if result is None else result & row_ids
+            if len(result) <= _few_candidates:
+                break
+        return result
+
+
+class TitleIndex:
+    """The rows by the words of their titles, and the words by what they become with typos"""
+
+    def __init__(self, data: dict):
+        self.tokens = _JoinedStrings(data['title_tokens'], data['title_token_offsets'])
+        self._postings = memoryview(data['title_postings'])
+        self._posting_offsets = _from_uint32s(data['title_posting_offsets'])
+        self.deletes = _JoinedStrings(
+            data['title_delete_tokens'], data['title_delete_token_offsets']
+        )
+        self._delete_token_ids = memoryview(data['title_delete_token_ids'])
+        self._delete_offsets = _from_uint32s(data['title_delete_offsets'])
+
+    def similar_token_ids(self, word: str) -> list[int]:
+        """Ids of the words of the titles that `word` can be a misspelling of"""
+        max_distance = fuzzy_max_distance(word)
+        # a word within `max_distance` edits becomes the same as `word` with up to
+        # `max_distance` characters deleted from each
+        token_ids = set()
+        for delete in _deletes(word, max_distance):
+            i = bisect_left(self.deletes, delete)
+            if i < len(self.deletes) and self.deletes[i] == delete:
+                start, end = self._delete_offsets[i], self._delete_offsets[i + 1]
+                token_ids.update(_from_uint32s(self._delete_token_ids[start * 4 : end * 4]))
+        return sorted(
+            i
+            for i in token_ids
+            if osa_distance(word, self.tokens[i], max_distance) <= max_distance
+        )
+
+    def similar_words(self, word: str) -> set[str]:
+        return {self.tokens[i] for i in self.similar_token_ids(word)}
+
+    def num_postings(self, token_ids: list[int]) -> int:
+        return sum(
+            self._posting_offsets[i + 1] - self._posting_offsets[i] for i in token_ids
+        )
+
+    def row_ids(self, token_ids: list[int]) -> set[int]:
+        row_ids = set()
+        for i in token_ids:
+            start, end = self._posting_offsets[i], self._posting_offsets[i + 1]
+            row_ids.update(_from_uint32s(self._postings[start * 4 : end * 4]))
+        return row_ids
+
+
+class FieldIndex:
+    """Hash index of the rows by model, and the rows sorted by each of their times"""
+
+    def __init__(self, data: dict):
+        self.models: list[str] = data['models']
+        self._model_offsets = _from_uint32s(data['model_offsets'])
+        self._model_row_ids = memoryview(data['model_row_ids'])
+        self.times: dict[str, list[str]] = {field: data[f'{field}s'] for field in _time_fields}
+        # the ids of the rows in the order of `times`
+        self._time_row_ids = {
+            field: memoryview(data[f'{field}_row_ids']) for field in _time_fields
+        }
+
+    def constraint(self, k: str, v: str) -> tuple[int, Callable[[], set[int]]] | None:
+        """
+        How many rows match the filter parsed by `field_filters.parse_field_filter`,
+        and a function returning their ids. None if the filter isn't indexed.
+        """
+        if k == 'model' and v:
+            spans = [
+                (self._model_offsets[i], self._model_offsets[i + 1])
+                for i, model in enumerate(self.models)
+                if v in model.lower()
+            ]
+            return sum(end - start for start, end in spans), lambda: {
+                row_id
+                for start, end in spans
+                for row_id in _from_uint32s(self._model_row_ids[start * 4 : end * 4])
+            }
+        if k in time_filters:
+            field, before = time_filters[k]
+            # the times before `v` sort before it
+            i = bisect_left(self.times[field], v)
+            start, end = (0, i) if before else (i, len(self.times[field]))
+            return end - start, lambda: set(
+                _from_uint32s(self._time_row_ids[field][start * 4 : end * 4])
+            )
+        return None
+
+
+# `re.IGNORECASE` treats these as the same letter, but `str.casefold` doesn't
+_fold_table = str.maketrans({'\u0131': 'i'})
+
+
+def fold(text: str) -> str:
+    """Fold the case of `text`, so that whatever `re.IGNORECASE` matches folds to the same thing"""
+    return text.casefold().translate(_fold_table)
+
+
+def _trigram_key(trigram: Iterable[str]) -> int:
+    a, b, c = trigram
+    return ord(a) << 42 | ord(b) << 21 | ord(c)
+
+
+def _trigram_keys(text: str) -> set[int]:
+    text = fold(text)
+    return set(map(_trigram_key, zip(text, text[1:], text[2:])))
+
+
+_trigram_index_magic = b'TRI1'
+# magic, number of rows, documents, trigrams and postings, padded to 8 bytes
+_trigram_index_header = struct.Struct('<4sIIII4x')
+_no_row = 0xFFFFFFFF
+
+
+def write_trigram_index(rows: list[dict], full: bool = False):
+    """
+    Write the trigram index of the `_search_key`s of `rows` to `trigram_index_bin`.
+
+    Every row is a document, numbered in the order they were first indexed. The documents
+    of rows whose `_search_key` is unchanged since the last run (see the manifest) are kept,
+    only the new ones are indexed and appended to the posting lists, and the documents of
+    changed or deleted rows are left behind without a row. Unless `full`, or there are more
+    than twice as many documents as rows, then everything is indexed again.
+    """
+    manifest_path = get_manifest_path(trigram_index_bin)
+    previous = None if full else TrigramIndex.load()
+    previous_manifest = (
+        load_manifest(manifest_path, {'num_docs': previous.num_docs})
+        if previous is not None
+        else {}
+    )
+    num_docs = previous.num_docs if previous_manifest else 0
+    if num_docs > 2 * len(rows):
+        num_docs, previous_manifest = 0, {}
+
+    manifest: dict[str, list] = {}
+    doc_to_row = array('I', repeat(_no_row, num_docs))
+    new_postings: defaultdict[int, list[int]] = defaultdict(list)
+    for row_id, row in enumerate(rows):
+        key = row['_search_key']
+        key_hash = content_hash(key)
+        entry = previous_manifest.get(row['id'])
+        if entry is not None and entry[1] == key_hash and doc_to_row[entry[0]] == _no_row:
+            doc = entry[0]
+            doc_to_row[doc] = row_id
+        else:
+            doc = len(doc_to_row)
+            doc_to_row.append(row_id)
+            # the C-level equivalent of appending `doc` to the posting list of every trigram
+            deque(
+                map(list.append, map(new_postings.__getitem__, _trigram_keys(key)), repeat(doc)),
+                maxlen=0,
+            )
+        manifest[row['id']] = [doc, key_hash]
+
+    keys = sorted(new_postings.keys() | (previous.keys if num_docs else ()))
+    offsets = array('I', [0])
+    postings = bytearray()
+    for key in keys:
+        if num_docs:
+            postings += previous.postings(key)  # type: ignore
+        postings += array('I', new_postings.get(key, ())).tobytes()
+        offsets.append(len(postings) // 4)
+
+    tmp_path = trigram_index_bin.with_name(f'{trigram_index_bin.name}.tmp')
+    with tmp_path.open('wb') as f:
+        f.write(
+            _trigram_index_header.pack(
+                _trigram_index_magic, len(rows), len(doc_to_row), len(keys), len(postings) // 4
+            )
+        )
+        f.write(array('Q', keys).tobytes())
+        f.write(offsets.tobytes())
+        f.write(postings)
+        f.write(doc_to_row.tobytes())
+    tmp_path.replace(trigram_index_bin)
+    save_manifest(manifest_path, manifest, {'num_docs': len(doc_to_row)})
+    print(
+        f'Wrote trigram index to {trigram_index_bin}, {len(doc_to_row) - num_docs} documents indexed'
+    )
+
+
+def _and(parts: list) -> 'str | tuple | None':
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else ('and', parts)
+
+
+def _regex_query(items) -> tuple[list, str | None]:
+    """
+    The substrings (or ORs of them) that every match of the parsed regular expression `items`
+    contains, and the string it matches if it's only literal characters
+    """
+    parts: list = []
+    run = ''
+    literal_only = True
+    for op, arg in items:
+        if op is sre_parse.LITERAL:
+            run += chr(arg)
+            continue
+        if op is sre_parse.AT:
+            # zero-width, the literals around it are still next to each other
+            continue
+        sub_parts: list = []
+        if op is sre_parse.SUBPATTERN or op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            sub_parts, literal = _regex_query(arg[-1] if op is sre_parse.SUBPATTERN else arg)
+            if literal is not None:
+                run += literal
+                continue
+        elif op is sre_parse.BRANCH:
+            alternatives = [_and(_regex_query(x)[0]) for x in arg[1]]
+            if None not in alternatives:
+                sub_parts = [('or', alternatives)]
+        elif op in (
+            sre_parse.MAX_REPEAT,
+            sre_parse.MIN_REPEAT,
+            getattr(sre_parse, 'POSSESSIVE_REPEAT', None),
+        ) and arg[0] >= 1:
+            sub_parts = _regex_query(arg[2])[0]
+        literal_only = False
+        parts.append(run)
+        parts.extend(sub_parts)
+        run = ''
+    parts.append(run)
+    # shorter strings don't have a trigram to look up
+    parts = [x for x in parts if not isinstance(x, str) or len(x) >= 3]
+    return parts, run if literal_only else None
+
+
+def regex_query(pattern: str) -> 'str | tuple | None':
+    """
+    What every match of `pattern` (with `re.IGNORECASE`) must contain:
+    a string, `('and', [...])` or `('or', [...])` of them, or None if nothing is known
+    """
+    return _and(_regex_query(sre_parse.parse(pattern, re.IGNORECASE))[0])
+
+
+class TrigramIndex:
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        magic, self.num_rows, self.num_docs, num_keys, num_postings = (
+            _trigram_index_header.unpack_from(view)
+        )
+        if magic != _trigram_index_magic:
+            raise ValueError(f'{trigram_index_bin} is not a trigram index')
+        start = _trigram_index_header.size
+        self.keys = view[start : (start := start + num_keys * 8)].cast('Q')
+        self._offsets = view[start : (start := start + (num_keys + 1) * 4)].cast('I')
+        self._postings = view[start : (start := start + num_postings * 4)]
+        self._doc_to_row = view[start : start + self.num_docs * 4].cast('I')
+
+    @classmethod
+    def load(cls) -> 'TrigramIndex | None':
+        """Map the index written by `write_trigram_index`, None if there isn't a valid one"""
+        try:
+            with trigram_index_bin.open('rb') as f:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError, TypeError, struct.error):
+            return None
+
+    def _key_range(self, key: int) -> tuple[int, int]:
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return 0, 0
+        return self._offsets[i], self._offsets[i + 1]
+
+    def postings(self, key: int) -> memoryview:
+        """The documents containing the trigram `key`, as uint32 bytes"""
+        start, end = self._key_range(key)
+        return self._postings[start * 4 : end * 4]
+
+    def _substring_docs(self, substring: str) -> set[int] | None:
+        ranges = sorted(
+            (self._key_range(key) for key in _trigram_keys(substring)),
+            key=lambda x: x[1] - x[0],
+        )
+        # trigrams in most documents don't narrow anything down and are expensive to intersect
+        limit = self.num_docs // 4
+        result: set[int] | None = None
+        for start, end in ranges:
+            if end - start >= limit:
+                break
+            docs = set(self._postings[start * 4 : end * 4].cast('I'))
+            result = docs if result is None else result & docs
+            if len(result) <= _few_candidates:
+                break
+        return result
+
+    def _docs(self, query) -> set[int] | None:
+        if query is None:
+            return None
+        if isinstance(query, str):
+            return self._substring_docs(query)
+        op, parts = query
+        results = [self._docs(x) for x in parts]
+        if op == 'or':
+            return None if None in results else set().union(*results)
+        results = sorted((x for x in results if x is not None), key=len)
+        return set.intersection(*results) if results else None
+
+    def _rows(self, docs: set[int] | None) -> set[int] | None:
+        if docs is None:
+            return None
+        rows = set(map(self._doc_to_row.__getitem__, docs))
+        rows.discard(_no_row)
+        return rows
+
+    def candidates(self, subqueries: list[str]) -> set[int] | None:
+        """
+        Ids of the rows whose `_search_key` can contain all of the plain (lowercased) `subqueries`,
+        a superset of the matching rows. None if the subqueries can't narrow anything down.
+        """
+        return self._rows(
+            self._docs(
+                _and(
+                    [
+                        x
+                        for x in subqueries
+                        if '=' not in x
+                        and not x.startswith(fuzzy_query_prefix)
+                        and len(x) >= 3
+                    ]
+                )
+            )
+        )
+
+    def regex_candidates(self, pattern: str) -> set[int] | None:
+        """Ids of the rows whose `_search_key` can match `pattern`, like `candidates`"""
+        return self._rows(self._docs(regex_query(pattern)))
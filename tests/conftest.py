@@ -0,0 +1,137 @@
+import json
+import random
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+repo_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_dir))
+
+
+def make_conversation(
+    id: str, title: str, update_time: float, messages: list[str], model_slug: str = 'gpt-4'
+) -> dict:
+    """A conversation as ChatGPT exports it, with the `messages` alternating between user and assistant"""
+    mapping = {'root': {'id': 'root', 'message': None, 'parent': None, 'children': []}}
+    parent = 'root'
+    for i, text in enumerate(messages):
+        node_id = f'{id}-{i}'
+        role = 'user' if i % 2 == 0 else 'assistant'
+        mapping[node_id] = {
+            'id': node_id,
+            'message': {
+                'id': node_id,
+                'author': {'role': role, 'name': None},
+                'content': {'content_type': 'text', 'parts': [text]},
+                'recipient': 'all',
+                'metadata': {'model_slug': model_slug} if role == 'assistant' else {},
+            },
+            'parent': parent,
+            'children': [],
+        }
+        mapping[parent]['children'].append(node_id)
+        parent = node_id
+    return {
+        'title': title,
+        'create_time': update_time - 60,
+        'update_time': update_time,
+        'mapping': mapping,
+        'id': id,
+        'plugin_ids': None,
+        'moderation_results': [],
+    }
+
+
+def make_branched_conversation(
+    id: str, title: str, update_time: float, messages: list[str], abandoned: list[str], fork_after: int
+) -> dict:
+    """
+    `make_conversation`, with the `abandoned` messages (say a regenerated reply and what followed it)
+    branching off after the first `fork_after` `messages` before them, and the root node last in the mapping
+    """
+    conversation = make_conversation(id, title, update_time, messages)
+    mapping = conversation['mapping']
+    parent = f'{id}-{fork_after - 1}' if fork_after else 'root'
+    for i, text in enumerate(abandoned, fork_after):
+        node_id = f'{id}-abandoned-{i}'
+        role = 'user' if i % 2 == 0 else 'assistant'
+        mapping[node_id] = {
+            'id': node_id,
+            'message': {
+                'id': node_id,
+                'author': {'role': role, 'name': None},
+                'content': {'content_type': 'text', 'parts': [text]},
+                'recipient': 'all',
+                'metadata': {'model_slug': 'gpt-4'} if role == 'assistant' else {},
+            },
+            'parent': parent,
+            'children': [],
+        }
+        # the older branch comes first at the fork
+        mapping[parent]['children'].insert(0 if i == fork_after else len(mapping[parent]['children']), node_id)
+        parent = node_id
+    mapping['root'] = mapping.pop('root')
+    return conversation
+
+
+# in export order, which isn't the order they were updated in
+conversations = [
+    make_conversation('c-old', 'Old python question', 1_700_000_000, ['How do I sort a list in Python?', 'Use sorted().']),
+    make_conversation('c-new', 'New cooking question', 1_720_000_000, ['How long do I boil an egg?', 'About 9 minutes.']),
+    make_conversation('c-mid', 'Middle python tips', 1_710_000_000, ['Python list comprehension tips', 'Keep them short.']),
+]
+
+
+@pytest.fixture
+def workdir(tmp_path: Path) -> Path:
+    """A copy of the workflow, whose `generated` dir the scripts run in it write to"""
+    for path in repo_dir.glob('*.py'):
+        shutil.copy(path, tmp_path)
+    for name in ('assets', 'css'):
+        shutil.copytree(repo_dir / name, tmp_path / name)
+    (tmp_path / 'conversations.json').write_text(json.dumps(conversations))
+    return tmp_path
+
+
+def run_python(workdir: Path, *args: str) -> str:
+    """Run `python args` in `workdir`, returning what it printed"""
+    return subprocess.run(
+        [sys.executable, *args], cwd=workdir, capture_output=True, text=True, check=True
+    ).stdout
+
+
+def set_config(workdir: Path, **values):
+    """Set the variables of the `config.py` in `workdir`"""
+    path = workdir / 'config.py'
+    config = path.read_text()
+    for name, value in values.items():
+        config, n = re.subn(rf'^{name} = .*$', f'{name} = {value!r}', config, flags=re.M)
+        assert n == 1, name
+    path.write_text(config)
+
+
+# the words of the `make_rows`
+words = ['python', 'pythonic', 'cython', 'sort', 'sorted', 'list', 'egg', 'boil', 'rust', 'trust']
+
+
+def make_rows(n: int = 200) -> list[dict]:
+    """Rows with a few random `words` each, so that most words are in few enough rows to narrow by"""
+    rng = random.Random(0)
+    rows = []
+    for i in range(n):
+        text = ' '.join(rng.sample(words, 2) + [f'w{i}'])
+        rows.append(
+            {
+                'id': f'r{i}',
+                'title': text.title(),
+                '_search_key': text,
+                'model': rng.choice(['gpt-4', 'gpt-4o', 'gpt-3.5-turbo']),
+                'create_time': f'2024-{i % 12 + 1:02}-01T00:00:00',
+                'update_time': f'2024-{i % 12 + 1:02}-{i % 28 + 1:02}T12:00:00',
+            }
+        )
+    return rows
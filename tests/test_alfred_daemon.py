@@ -0,0 +1,92 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+import alfred_daemon
+from conftest import run_python
+
+
+@pytest.fixture
+def short_tmp_dir():
+    """A temporary dir for sockets, whose paths can't be long"""
+    path = Path(tempfile.mkdtemp(dir='/tmp'))
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def daemon(workdir, short_tmp_dir, monkeypatch):
+    """A daemon serving the conversations of `workdir`, and the dir of its socket"""
+    run_python(workdir, 'import_conversations_json.py')
+    socket_dir = short_tmp_dir / 'd'
+    socket_path = socket_dir / 'daemon.sock'
+    monkeypatch.setattr(alfred_daemon, 'daemon_socket_dir', socket_dir)
+    monkeypatch.setattr(alfred_daemon, 'daemon_socket_path', socket_path)
+    monkeypatch.setenv('alfred_workflow_cache', str(workdir / 'cache'))
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            '-c',
+            'import sys, config; from pathlib import Path; '
+            'config.daemon_socket_dir = Path(sys.argv.pop(1)); '
+            'config.daemon_socket_path = config.daemon_socket_dir / "daemon.sock"; '
+            'import alfred_daemon; alfred_daemon.main()',
+            str(socket_dir),
+        ],
+        cwd=workdir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    for _ in range(100):
+        if alfred_daemon.is_running():
+            break
+        time.sleep(0.05)
+    yield socket_dir, process
+    process.terminate()
+    process.wait()
+
+
+def test_daemon_answers_like_alfred(workdir, daemon):
+    socket_dir, _ = daemon
+    assert os.stat(socket_dir).st_mode & 0o777 == 0o700
+    for argv in ([], ['python'], ['-n', '1', 'python']):
+        answer = alfred_daemon.query_daemon(argv)
+        assert answer is not None
+        assert answer == run_python(workdir, '-c', f'import alfred; alfred.main({argv!r})')
+
+
+def test_argparse_exits_are_answered_with_nothing(daemon):
+    _, process = daemon
+    assert alfred_daemon.query_daemon(['--help']) is None
+    assert alfred_daemon.query_daemon(['--no-such-option']) is None
+    assert alfred_daemon.query_daemon(['python']) is not None
+    process.terminate()
+    _, stderr = process.communicate()
+    assert 'Traceback' not in stderr
+
+
+def test_daemon_in_a_dir_others_can_access_isnt_trusted(daemon):
+    socket_dir, _ = daemon
+    os.chmod(socket_dir, 0o755)
+    assert alfred_daemon.query_daemon(['python']) is None
+
+
+def test_only_a_socket_is_trusted(short_tmp_dir, monkeypatch):
+    socket_dir = short_tmp_dir
+    monkeypatch.setattr(alfred_daemon, 'daemon_socket_dir', socket_dir)
+    real_socket = socket_dir / 'real.sock'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(str(real_socket))
+        sock.listen()
+        # a symlink to a socket
+        (socket_dir / 'daemon.sock').symlink_to(real_socket)
+        monkeypatch.setattr(alfred_daemon, 'daemon_socket_path', socket_dir / 'daemon.sock')
+        assert alfred_daemon.query_daemon(['python']) is None
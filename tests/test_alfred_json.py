@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from conftest import run_python, set_config
+from utils import fill_alfred_item_fragment, row_to_alfred_item, row_to_alfred_item_fragment
+
+
+def test_import_lists_the_most_recently_updated_first_like_generate(workdir):
+    run_python(workdir, 'import_conversations_json.py')
+    imported = (workdir / 'generated' / 'pre_computed_alfred.json').read_text()
+    urls = [x['arg'] for x in json.loads(imported)['items']]
+    assert [x.rsplit('/', 1)[1] for x in urls] == ['c-new', 'c-mid', 'c-old']
+
+    run_python(workdir, '-c', 'import alfred; alfred.main(["-g"])')
+    assert (workdir / 'generated' / 'pre_computed_alfred.json').read_text() == imported
+
+
+def show(workdir, query: str) -> list[dict]:
+    """The items `alfred.py` shows for `query`"""
+    output = run_python(workdir, '-c', f'import alfred; alfred.main([{query!r}])')
+    return json.loads(output)['items']
+
+
+def test_the_empty_query_shows_the_first_page(workdir):
+    set_config(workdir, alfred_json_page_size=2)
+    run_python(workdir, 'import_conversations_json.py')
+    generated = workdir / 'generated'
+    pages_dir = generated / 'pre_computed_alfred_pages'
+    assert sorted(x.name for x in pages_dir.iterdir()) == ['1.json', '2.json']
+    assert not (generated / 'pre_computed_alfred.json').exists()
+
+    *items, next_page = show(workdir, '')
+    assert [x['arg'].rsplit('/', 1)[1] for x in items] == ['c-new', 'c-mid']
+    assert next_page['autocomplete'] == 'page=2'
+    assert [x['arg'].rsplit('/', 1)[1] for x in show(workdir, 'page=2')] == ['c-old']
+    assert show(workdir, 'page=3')[0]['title'] == 'No page 3'
+    assert show(workdir, 'page=x')[0]['title'] == 'Invalid page'
+
+    set_config(workdir, alfred_json_page_size=0)
+    run_python(workdir, '-c', 'import alfred; alfred.main(["-g"])')
+    assert not list(pages_dir.iterdir())
+    assert len(show(workdir, '')) == 3
+
+
+tricky_texts = ['', 'plain', 'say "hi"', 'C:\\path\\', 'Ünïcode ☃ 😀', 'nul\0byte', '\0', '"\\"\0', 'line\nbreak\u2028']
+
+
+def make_item_row(title: str, **item3_kwargs) -> dict:
+    return {
+        'id': f'id-{title}',
+        '_title': title,
+        '_message_preview': 'preview',
+        '_chatgpt_url': f'https://chatgpt.com/c/{title}',
+        '_typingmind_url': 'https://www.typingmind.com/#chat=x',
+        '_quicklookurl': f'/generated/{title}.md',
+        '_item3_kwargs': item3_kwargs,
+    }
+
+
+@pytest.mark.parametrize('item3_kwargs', [{}, {'icon': 'assets/gpt-4.png'}, {'icon': '/Ünï "icon"\\', 'icontype': 'fileicon'}])
+@pytest.mark.parametrize('title', tricky_texts)
+@pytest.mark.parametrize('subtitle', tricky_texts)
+def test_filled_item_fragments_are_the_encoded_items(title, subtitle, item3_kwargs):
+    row = make_item_row(title, **item3_kwargs)
+    fragment = row_to_alfred_item_fragment(row)
+    filled = fill_alfred_item_fragment(fragment, subtitle)
+    assert filled == json.dumps(row_to_alfred_item(row, subtitle))
+    assert json.loads(filled)['subtitle'] == subtitle
+    assert json.loads(filled)['title'] == title
+
+
+def test_errors_are_shown_without_running_the_query_again(tmp_path, monkeypatch, capsys):
+    pytest.importorskip('workflow')
+    import alfred
+
+    for name in ('cache', 'data'):
+        monkeypatch.setenv(f'alfred_workflow_{name}', str(tmp_path / name))
+    monkeypatch.setenv('alfred_workflow_bundleid', 'chatgpt-alfred-workflow-test')
+    calls = []
+
+    def main(argv):
+        calls.append(argv)
+        print('partial output')
+        raise RuntimeError('broken row store')
+
+    monkeypatch.setattr(alfred, 'main', main)
+    assert alfred.run(['python']) == 1
+    assert calls == [['python']]
+    output = capsys.readouterr().out
+    assert 'broken row store' in output
+    assert 'partial output' not in output
@@ -0,0 +1,127 @@
+import io
+import json
+
+import pytest
+
+from conftest import conversations, make_branched_conversation, make_conversation, run_python
+from convert_chatgpt_conversations_json import convert_conversations
+from utils import get_manifest_path, load_manifest_spans
+
+
+def convert(conversations: list[dict], output_path, **kwargs) -> bytes:
+    convert_conversations(io.BytesIO(json.dumps(conversations).encode()), output_path, **kwargs)
+    return output_path.read_bytes()
+
+
+def test_incremental_output_is_the_same_as_a_full_conversion(tmp_path):
+    output_path = tmp_path / 'linear.json'
+    convert(conversations, output_path)
+    changed = [
+        conversations[0],
+        make_conversation('c-new', 'Ünïcode title', 1_720_000_001, ['Changed', 'Yes']),
+        conversations[2],
+    ]
+    incremental = convert(changed, output_path)
+    assert incremental == convert(changed, tmp_path / 'full.json', incremental=False)
+    assert [x['title'] for x in json.loads(incremental)] == [
+        'Old python question',
+        'Ünïcode title',
+        'Middle python tips',
+    ]
+
+
+def test_unchanged_outputs_are_copied_from_where_the_manifest_says(tmp_path, capsys):
+    output_path = tmp_path / 'linear.json'
+    full = convert(conversations, output_path)
+    spans = load_manifest_spans(get_manifest_path(output_path))
+    for c in conversations:
+        offset, length = spans[c['id']]
+        assert json.loads(full[offset : offset + length])['id'] == c['id']
+
+    capsys.readouterr()
+    assert convert(conversations, output_path) == full
+    assert '0 new or changed, 3 unchanged' in capsys.readouterr().out
+
+
+def test_outputs_that_arent_where_the_manifest_says_are_converted_again(tmp_path, capsys):
+    output_path = tmp_path / 'linear.json'
+    full = convert(conversations, output_path)
+    manifest_path = get_manifest_path(output_path)
+    manifest = json.loads(manifest_path.read_text())
+    manifest['spans']['c-old'], manifest['spans']['c-new'] = (
+        manifest['spans']['c-new'],
+        manifest['spans']['c-old'],
+    )
+    manifest_path.write_text(json.dumps(manifest))
+
+    capsys.readouterr()
+    assert convert(conversations, output_path) == full
+    assert '2 new or changed, 1 unchanged' in capsys.readouterr().out
+
+
+def test_the_import_saves_where_the_linear_conversations_are(workdir):
+    run_python(workdir, 'import_conversations_json.py', '-l', 'linear_conversations.json')
+    imported = (workdir / 'linear_conversations.json').read_bytes()
+    output = run_python(workdir, 'convert_chatgpt_conversations_json.py')
+    assert '0 new or changed, 3 unchanged' in output
+    assert (workdir / 'linear_conversations.json').read_bytes() == imported
+
+
+def make_many_conversations() -> list[dict]:
+    many = [
+        make_conversation(f'c-{i}', f'Title {i}', 1_700_000_000 + i, [f'Question {i}', f'Answer {i}'])
+        for i in range(50)
+    ]
+    # lists of objects, which the parent process cuts the conversation at,
+    # one of them like a conversation
+    many[3]['moderation_results'] = [{'id': 'm-1', 'update_time': 1}, {'id': 'm-2', 'update_time': 2}]
+    many[7]['moderation_results'] = [{'flagged': False}, {'flagged': True}]
+    return many
+
+
+def test_converting_in_a_process_pool_writes_the_same_output(tmp_path):
+    many = make_many_conversations()
+    serial = convert(many, tmp_path / 'serial.json', incremental=False)
+    assert convert(many, tmp_path / 'pool.json', incremental=False, jobs=2, chunk_size=4) == serial
+    assert load_manifest_spans(get_manifest_path(tmp_path / 'pool.json')) == load_manifest_spans(
+        get_manifest_path(tmp_path / 'serial.json')
+    )
+
+
+def test_the_process_pool_copies_unchanged_conversations(tmp_path, capsys):
+    many = make_many_conversations()
+    output_path = tmp_path / 'linear.json'
+    full = convert(many, output_path, jobs=2, chunk_size=4)
+    many[3] = make_conversation('c-3', 'Changed', 1_800_000_000, ['Changed', 'Yes'])
+    capsys.readouterr()
+    incremental = convert(many, output_path, jobs=2, chunk_size=4)
+    assert '1 new or changed, 49 unchanged' in capsys.readouterr().out
+    assert incremental == convert(many, tmp_path / 'full.json', incremental=False)
+    assert incremental != full
+
+    # converted again if the previous outputs aren't where the manifest says
+    manifest_path = get_manifest_path(output_path)
+    manifest = json.loads(manifest_path.read_text())
+    manifest['spans']['c-0'], manifest['spans']['c-1'] = manifest['spans']['c-1'], manifest['spans']['c-0']
+    manifest_path.write_text(json.dumps(manifest))
+    assert convert(many, output_path, jobs=2, chunk_size=4) == incremental
+    assert '2 new or changed, 48 unchanged' in capsys.readouterr().out
+
+
+def test_the_process_pool_raises_the_error_of_what_it_cant_convert(tmp_path):
+    with pytest.raises(TypeError):
+        convert([*conversations, 1], tmp_path / 'pool.json', incremental=False, jobs=2)
+
+
+@pytest.mark.parametrize('fork_after', [0, 1, 2])
+def test_branched_conversations_follow_the_last_child_from_the_root_anywhere_in_the_mapping(tmp_path, fork_after):
+    messages = ['How do I sort a list?', 'Use sorted().', 'And in reverse?', 'Pass reverse=True.']
+    conversation = make_branched_conversation(
+        'c-branched', 'Branched', 1_720_000_000, messages, ['Abandoned', 'Abandoned reply', 'Abandoned again'], fork_after
+    )
+    assert list(conversation['mapping'])[-1] == 'root'
+    fork = conversation['mapping'][f'c-branched-{fork_after - 1}' if fork_after else 'root']
+    assert fork['children'] == [f'c-branched-abandoned-{fork_after}', f'c-branched-{fork_after}']
+
+    [linear] = json.loads(convert([conversation], tmp_path / 'linear.json'))
+    assert linear['linear_messages'] == messages
@@ -0,0 +1,75 @@
+import json
+import os
+
+from conftest import conversations, make_conversation, run_python, set_config
+from utils import write_text_if_changed
+
+# long ago, so that a rewritten file has a different mtime
+old_mtime_ns = 1_000_000_000 * 1_000_000_000
+
+
+def generate(workdir, *args: str) -> str:
+    run_python(workdir, 'convert_chatgpt_conversations_json.py')
+    return run_python(workdir, 'generate_preview_files.py', '-j', '1', *args)
+
+
+def age_previews(workdir):
+    for path in (workdir / 'generated').glob('*.md'):
+        os.utime(path, ns=(old_mtime_ns, old_mtime_ns))
+
+
+def preview_mtimes(workdir) -> dict[str, int]:
+    return {x.name: x.stat().st_mtime_ns for x in (workdir / 'generated').glob('*.md')}
+
+
+def test_unchanged_conversations_are_skipped(workdir):
+    assert 'rendered 3 previews' in generate(workdir)
+    age_previews(workdir)
+    changed = [
+        conversations[0],
+        make_conversation('c-new', 'New cooking question', 1_720_000_001, ['How long?', 'Longer.']),
+        conversations[2],
+    ]
+    (workdir / 'conversations.json').write_text(json.dumps(changed))
+    output = generate(workdir)
+    assert 'Skipped 2 unchanged conversations, rendered 1 previews (0 unchanged' in output
+    mtimes = preview_mtimes(workdir)
+    assert mtimes.pop('c-new.md') != old_mtime_ns
+    assert set(mtimes.values()) == {old_mtime_ns}
+    assert 'Longer.' in (workdir / 'generated' / 'c-new.md').read_text()
+
+
+def test_identical_previews_arent_rewritten(workdir):
+    generate(workdir)
+    age_previews(workdir)
+    output = generate(workdir, '--full')
+    assert 'Skipped 0 unchanged conversations, rendered 3 previews (3 unchanged, not rewritten)' in output
+    assert set(preview_mtimes(workdir).values()) == {old_mtime_ns}
+
+
+def test_write_text_if_changed(tmp_path):
+    path = tmp_path / 'preview.md'
+    assert write_text_if_changed(path, 'Ünïcode')
+    os.utime(path, ns=(old_mtime_ns, old_mtime_ns))
+    assert not write_text_if_changed(path, 'Ünïcode')
+    assert path.stat().st_mtime_ns == old_mtime_ns
+    # the same size
+    assert write_text_if_changed(path, 'Ünïcodf')
+    assert path.read_text() == 'Ünïcodf'
+
+
+def test_the_previews_of_deleted_conversations_are_removed(workdir):
+    generate(workdir)
+    (workdir / 'conversations.json').write_text(json.dumps(conversations[1:]))
+    assert 'removed 1 orphaned previews' in generate(workdir)
+    assert sorted(preview_mtimes(workdir)) == ['c-mid.md', 'c-new.md']
+
+
+def test_the_pack_and_the_extracted_previews_of_deleted_conversations_are_removed(workdir):
+    set_config(workdir, preview_mode='pack', alfred_json_page_size=2)
+    generate(workdir)
+    assert sorted(preview_mtimes(workdir)) == ['c-mid.md', 'c-new.md']
+    (workdir / 'conversations.json').write_text(json.dumps([conversations[0], conversations[2]]))
+    # c-new from the pack, and the file extracted from it
+    assert 'removed 2 orphaned previews' in generate(workdir)
+    assert 'c-new.md' not in preview_mtimes(workdir)
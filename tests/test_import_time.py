@@ -0,0 +1,55 @@
+import json
+import subprocess
+import sys
+
+from conftest import repo_dir, run_python
+
+# microseconds that importing what alfred.py needs for an empty query may take,
+# a few times what it takes, so that a slow machine doesn't fail it
+import_time_budget_us = 100_000
+# imported by the queries that need them, never for an empty query
+heavy_modules = {
+    'workflow',
+    'msgpack',
+    'numpy',
+    'argparse',
+    'sqlite3',
+    'utils',
+    'row_store',
+    'search_index',
+    'query_cache',
+}
+
+
+def test_empty_query_imports_nothing_heavy(workdir):
+    run_python(workdir, 'import_conversations_json.py')
+    output = run_python(
+        workdir,
+        '-c',
+        'import contextlib, io, json, sys; import alfred_daemon, alfred\n'
+        'with contextlib.redirect_stdout(io.StringIO()): alfred.main([])\n'
+        'print(json.dumps(sorted(sys.modules)))',
+    )
+    assert not heavy_modules & set(json.loads(output))
+
+
+def test_import_time(tmp_path):
+    # compiled first, so that compiling isn't counted
+    subprocess.run(
+        [sys.executable, '-m', 'compileall', '-q', 'alfred.py', 'alfred_daemon.py', 'config.py'],
+        cwd=repo_dir,
+        check=True,
+    )
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import alfred_daemon, alfred'],
+        cwd=repo_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    # `import time: self [us] | cumulative | imported package`
+    cumulative = {
+        name.strip(): int(us)
+        for _, us, name in (x.split('|') for x in stderr.splitlines()[1:])
+    }
+    assert cumulative['alfred_daemon'] + cumulative['alfred'] < import_time_budget_us
@@ -0,0 +1,82 @@
+import io
+import json
+
+import pytest
+
+from conftest import conversations
+from utils import iter_json_array, split_json_array, write_json_array
+
+# numbers and multi-byte chars that small chunks cut in the middle of
+elements = [12345, -1.5e10, 'Ünïcode ☃ text', {'a': [1, 2, {'b': None}]}, [], True, *conversations]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1 << 20])
+def test_elements_are_parsed_like_json_loads(chunk_size):
+    data = ('\ufeff' + json.dumps(elements, indent=2, ensure_ascii=False)).encode()
+    assert list(iter_json_array(io.BytesIO(data), chunk_size=chunk_size)) == elements
+
+
+@pytest.mark.parametrize('data', [b'[]', b' [ ] ', b'[\n]'])
+def test_empty_arrays(data):
+    assert list(iter_json_array(io.BytesIO(data), chunk_size=1)) == []
+
+
+@pytest.mark.parametrize('data', [b'{}', b'[1 2]', b'[1,', b'[1'])
+def test_invalid_arrays(data):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(data), chunk_size=1))
+
+
+@pytest.mark.parametrize('items', [[], elements])
+def test_written_arrays_are_the_same_as_json_dumps(items):
+    fp = io.StringIO()
+    assert write_json_array(iter(items), fp) == len(items)
+    assert fp.getvalue() == json.dumps(items, indent=2, ensure_ascii=False)
+
+
+def test_raw_elements_are_written_verbatim():
+    fp = io.StringIO()
+    write_json_array(elements, fp)
+    written = fp.getvalue().encode()
+    raw = [x for _, x in iter_json_array(io.BytesIO(written), chunk_size=3, with_raw=True)]
+
+    fp = io.StringIO()
+    spans = []
+    write_json_array(raw, fp, spans=spans)
+    assert fp.getvalue().encode() == written
+    assert [json.loads(written[offset : offset + length]) for offset, length in spans] == elements
+
+
+def join_pieces(pieces) -> list:
+    """The elements the `split_json_array` pieces make"""
+    return json.loads(b'[' + b''.join(piece + separator for piece, separator in pieces) + b']')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1 << 20])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_arrays_of_objects_are_cut_into_their_elements(chunk_size, indent):
+    data = ('\ufeff' + json.dumps(conversations, indent=indent, ensure_ascii=False)).encode()
+    pieces = list(split_json_array(io.BytesIO(data), chunk_size=chunk_size))
+    assert [json.loads(piece) for piece, _ in pieces] == conversations
+    # the same text as `iter_json_array` yields for them
+    raw = [x for _, x in iter_json_array(io.BytesIO(data), with_raw=True)]
+    assert [piece.decode() for piece, _ in pieces] == raw
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1 << 20])
+def test_pieces_join_into_the_elements(chunk_size):
+    # objects in arrays of objects, strings that look like boundaries, and elements that aren't objects
+    items = [{'a': [{'b': 1}, {'c': '}, {"d'}]}, {}, 1, 'x}, {"y', [{'e': 2}, {'f': 3}], *elements]
+    data = json.dumps(items).encode()
+    assert join_pieces(split_json_array(io.BytesIO(data), chunk_size=chunk_size)) == items
+
+
+@pytest.mark.parametrize('data', [b'[]', b' [ ] ', b'[\n]'])
+def test_empty_arrays_have_no_pieces(data):
+    assert list(split_json_array(io.BytesIO(data), chunk_size=1)) == []
+
+
+@pytest.mark.parametrize('data', [b'{}', b'[{}', b'[{}] x', b''])
+def test_invalid_arrays_cant_be_cut(data):
+    with pytest.raises(ValueError):
+        list(split_json_array(io.BytesIO(data), chunk_size=1))
@@ -0,0 +1,40 @@
+import json
+import subprocess
+import sys
+
+from conftest import run_python, set_config
+
+
+def test_the_previews_of_the_listed_items_are_extracted(workdir):
+    set_config(workdir, preview_mode='pack', alfred_json_page_size=2)
+    run_python(workdir, 'import_conversations_json.py')
+    generated = workdir / 'generated'
+    assert (generated / 'previews.db').exists()
+    # the first page, the newest ones
+    assert sorted(x.name for x in generated.glob('*.md')) == ['c-mid.md', 'c-new.md']
+
+    output = run_python(workdir, '-c', 'import alfred; alfred.main(["page=2"])')
+    items = json.loads(output)['items']
+    assert [x['quicklookurl'] for x in items] == [str(generated / 'c-old.md')]
+    assert (generated / 'c-old.md').exists()
+
+
+def test_pack_mode_needs_paging(workdir):
+    set_config(workdir, preview_mode='pack', alfred_json_page_size=0)
+    result = subprocess.run(
+        [sys.executable, 'import_conversations_json.py'],
+        cwd=workdir,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0
+    assert 'alfred_json_page_size' in result.stderr
+    assert not (workdir / 'generated' / 'previews.db').exists()
+
+
+def test_generate_preview_files_extracts_the_first_page(workdir):
+    set_config(workdir, preview_mode='pack', alfred_json_page_size=2)
+    run_python(workdir, 'convert_chatgpt_conversations_json.py')
+    run_python(workdir, 'generate_preview_files.py')
+    generated = workdir / 'generated'
+    assert sorted(x.name for x in generated.glob('*.md')) == ['c-mid.md', 'c-new.md']
@@ -0,0 +1,94 @@
+import json
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import conversations, make_conversation, run_python
+from preview_server import LRUCache
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server(workdir):
+    """A preview server of the conversations of `workdir`, and a function getting a path from it"""
+    run_python(workdir, 'import_conversations_json.py')
+    port = get_free_port()
+    process = subprocess.Popen(
+        [sys.executable, 'preview_server.py', '-p', str(port)],
+        cwd=workdir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    def get(path: str) -> str:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=5) as response:
+            return response.read().decode()
+
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    yield get
+    process.terminate()
+    process.wait()
+
+
+def test_previews_are_rendered_from_the_row_store(server):
+    preview = server('/c-new')
+    assert '<title>New cooking question</title>' in preview
+    assert 'How long do I boil an egg?' in preview
+    assert 'About 9 minutes.' in preview
+    assert 'markdown_preview.css' in preview
+    assert server('/css/markdown_preview.css')
+
+
+def test_unknown_conversations_arent_found(server):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        server('/no-such-id')
+    assert e.value.code == 404
+
+
+def test_a_rebuilt_row_store_is_served(workdir, server):
+    assert 'About 9 minutes.' in server('/c-new')
+    changed = [
+        conversations[0],
+        make_conversation('c-new', 'New cooking question', 1_720_000_001, ['How long do I boil an egg?', 'About 7 minutes.']),
+        conversations[2],
+    ]
+    (workdir / 'conversations.json').write_text(json.dumps(changed))
+    run_python(workdir, 'import_conversations_json.py')
+    preview = server('/c-new')
+    assert 'About 7 minutes.' in preview
+    assert 'About 9 minutes.' not in preview
+
+
+def test_the_least_recently_used_previews_are_evicted():
+    cache = LRUCache(10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('c') == b'cccc'
+    assert cache.num_bytes == 8
+
+    # replacing one doesn't count it twice
+    cache.put('a', b'aa')
+    assert cache.num_bytes == 6
+    # nor is one bigger than the cache kept
+    cache.put('d', b'd' * 11)
+    assert cache.get('d') is None
+    assert cache.num_bytes == 0
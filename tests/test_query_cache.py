@@ -0,0 +1,93 @@
+import itertools
+
+import pytest
+
+import query_cache
+from alfred import filter_row_ids
+from conftest import make_rows
+from config import query_cache_size
+from query_cache import QueryCache, query_narrows
+
+queries = [
+    'py',
+    'pyt',
+    'python',
+    'thon',
+    'python|sort',
+    'sort|python',
+    'sort',
+    'sorted',
+    'egg|rust',
+    'model=gpt',
+    'model=gpt-4o',
+    'python|model=gpt-4',
+    'after=2024',
+    'after=2024-06',
+    'after=2024-06-15',
+    'before=2024-06',
+    'before=2024-03',
+    '~pythn',
+    '~pythno',
+    're:pyt',
+]
+
+
+def test_narrowed_queries_only_match_the_cached_querys_rows():
+    rows = make_rows(50)
+    matches = {x: set(filter_row_ids(rows, x)) for x in queries}
+    for query, cached_query in itertools.permutations(queries, 2):
+        if query_narrows(query, cached_query):
+            assert matches[query] <= matches[cached_query], (query, cached_query)
+
+
+@pytest.mark.parametrize(
+    'query, cached_query',
+    [
+        ('python', 'pyt'),
+        ('python', 'thon'),
+        ('python|sort', 'sort|python'),
+        ('python|sort', 'py'),
+        ('model=gpt-4o', 'model=gpt'),
+        ('after=2024-06-15', 'after=2024-06'),
+        ('before=2024-03', 'before=2024-06'),
+        ('~pythn', '~pythn'),
+    ],
+)
+def test_queries_narrow_down_the_ones_they_extend(query, cached_query):
+    assert query_narrows(query, cached_query)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('alfred_workflow_cache', str(tmp_path / 'cache'))
+    for name in ('row_store_bin', 'pre_computed_rows_meta_msgpack', 'pre_computed_rows_meta_json'):
+        monkeypatch.setattr(query_cache, name, tmp_path / getattr(query_cache, name).name)
+    return tmp_path / 'cache'
+
+
+def test_the_narrowest_cached_matches_are_used(cache_dir):
+    QueryCache().add('py', [1, 2, 3])
+    QueryCache().add('python', [1, 2])
+    QueryCache().add('egg', [4])
+    cache = QueryCache()
+    assert cache.get('pythonic') == [1, 2]
+    assert cache.get('pyth') == [1, 2, 3]
+    assert cache.get('boil') is None
+
+
+def test_the_least_recently_used_queries_are_evicted(cache_dir):
+    cache = QueryCache()
+    for i in range(query_cache_size):
+        cache.add(f'q{i}', [i])
+    assert cache.get('q0') == [0]
+    cache.add('new', [])
+    cache = QueryCache()
+    assert [x for x, _ in cache.entries] == [f'q{i}' for i in range(2, query_cache_size)] + ['q0', 'new']
+
+
+def test_the_cache_is_dropped_when_the_rows_change(cache_dir, tmp_path):
+    QueryCache().add('python', [1])
+    assert QueryCache().get('python') == [1]
+    assert QueryCache(first=10).get('python') is None
+    (tmp_path / 'row_store.bin').write_bytes(b'rows')
+    assert QueryCache().get('python') is None
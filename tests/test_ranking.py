@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from alfred import get_args, rank_rows
+from conftest import make_rows
+
+
+def days_ago(days: int) -> str:
+    return (datetime.now() - timedelta(days=days)).isoformat()
+
+
+def make_ranked_rows(*rows: tuple[str, str, str | None]) -> list[dict]:
+    """`make_rows` with the (title, messages, update_time) of `rows`"""
+    ranked_rows = make_rows(len(rows))
+    for row, (title, messages, update_time) in zip(ranked_rows, rows):
+        row['title'] = title
+        # like `preprocess_conversations.search_key_for_rows`, which includes the title
+        row['_search_key'] = f'{title}\n{messages}'.lower()
+        row['update_time'] = update_time
+    return ranked_rows
+
+
+def titles(rows) -> list[str]:
+    return [x['title'] for x in rows]
+
+
+def test_a_title_hit_beats_many_message_hits():
+    rows = make_ranked_rows(
+        ('Breakfast', 'egg ' * 500, days_ago(30)),
+        ('Boiled egg', '', days_ago(30)),
+    )
+    assert titles(rank_rows(rows, 'egg', 0)) == ['Boiled egg', 'Breakfast']
+
+
+def test_more_message_hits_count_less_and_less():
+    rows = make_ranked_rows(
+        ('One', 'egg', days_ago(0)),
+        ('Three', 'egg egg egg', days_ago(0)),
+        ('Two', 'egg egg', days_ago(0)),
+        ('None', 'toast', days_ago(0)),
+    )
+    assert titles(rank_rows(rows, 'egg', 0)) == ['Three', 'Two', 'One', 'None']
+    # being 30 days newer (half the recency score, 0.5) makes up for 20 hits instead of 30
+    # (log1p(30) - log1p(20) < 0.5), but not for 1 hit instead of 3 (log1p(3) - log1p(1) > 0.5)
+    rows = make_ranked_rows(
+        ('Twenty', 'egg ' * 20, days_ago(0)),
+        ('Thirty', 'egg ' * 30, days_ago(30)),
+        ('One', 'egg', days_ago(0)),
+        ('Three', 'egg egg egg', days_ago(30)),
+    )
+    assert titles(rank_rows(rows, 'egg', 0)) == ['Twenty', 'Thirty', 'Three', 'One']
+
+
+def test_recency_breaks_ties():
+    rows = make_ranked_rows(
+        ('Month', 'egg', days_ago(30)),
+        ('Unknown', 'egg', None),
+        ('Today', 'egg', days_ago(0)),
+        ('Year', 'egg', days_ago(365)),
+    )
+    assert titles(rank_rows(rows, 'egg', 0)) == ['Today', 'Month', 'Year', 'Unknown']
+
+
+@pytest.mark.parametrize(
+    'k, expected', [(0, ['C', 'B', 'A']), (1, ['C']), (2, ['C', 'B']), (5, ['C', 'B', 'A'])]
+)
+def test_only_the_k_most_relevant_rows_are_kept(k, expected):
+    rows = make_ranked_rows(
+        ('A', 'egg', days_ago(0)),
+        ('B', 'egg egg', days_ago(0)),
+        ('C', 'egg egg egg', days_ago(0)),
+    )
+    assert titles(rank_rows(rows, 'egg', k)) == expected
+
+
+def test_a_regex_scores_one_hit_per_row():
+    rows = make_ranked_rows(
+        ('Many', 'egg ' * 20, days_ago(60)),
+        ('One', 'egg', days_ago(0)),
+    )
+    assert titles(rank_rows(rows, 'egg', 0)) == ['Many', 'One']
+    assert titles(rank_rows(rows, 're:e+g', 0)) == ['One', 'Many']
+
+
+def test_every_subquery_counts_and_filters_dont():
+    rows = make_ranked_rows(
+        ('A', 'egg', days_ago(0)),
+        ('B', 'toast', days_ago(30)),
+        ('Both', 'egg toast', days_ago(30)),
+    )
+    assert titles(rank_rows(rows, 'egg|toast|model=gpt', 0)) == ['A', 'Both', 'B']
+
+
+def test_k_defaults_to_max_results_and_0_is_all():
+    from config import max_results
+
+    assert get_args(['egg']).max_results == max_results
+    assert get_args(['-k', '0', 'egg']).max_results == 0
@@ -0,0 +1,50 @@
+import pytest
+
+import related_index
+from conftest import make_rows
+from related_index import TfidfIndex, write_tfidf_index
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def tfidf_index_npz(tmp_path, monkeypatch):
+    path = tmp_path / 'tfidf_index.npz'
+    monkeypatch.setattr(related_index, 'tfidf_index_npz', path)
+    return path
+
+
+def make_related_rows() -> list[dict]:
+    rows = make_rows(40)
+    for row in rows:
+        row['concatenated_messages'] = row['_search_key']
+    rows[5]['concatenated_messages'] = 'sourdough starter hydration crumb'
+    rows[17]['concatenated_messages'] = 'sourdough hydration crumb oven'
+    rows[30]['concatenated_messages'] = 'sourdough bagels'
+    return rows
+
+
+def test_the_rows_sharing_the_rarest_terms_are_the_most_related(tfidf_index_npz):
+    write_tfidf_index(make_related_rows())
+    index = TfidfIndex.load()
+    assert index.related(5, 2) == [17, 30]
+    assert index.related(5, 2, first=20) == [17]
+
+
+def test_related_rows_are_ranked_by_cosine_similarity(tfidf_index_npz):
+    write_tfidf_index(make_related_rows())
+    index = TfidfIndex.load()
+    vectors = np.zeros((index.num_rows, int(index.row_terms.max()) + 1))
+    for i in range(index.num_rows):
+        start, end = index.row_indptr[i], index.row_indptr[i + 1]
+        vectors[i, index.row_terms[start:end]] = index.row_weights[start:end]
+    for row_id in range(index.num_rows):
+        scores = vectors @ vectors[row_id]
+        scores[row_id] = 0
+        related = index.related(row_id, 5)
+        assert np.allclose(scores[related], -np.sort(-scores)[: len(related)])
+        assert len(related) == min(5, np.count_nonzero(scores))
+
+
+def test_there_is_no_index_to_load(tfidf_index_npz):
+    assert TfidfIndex.load() is None
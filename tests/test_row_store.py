@@ -0,0 +1,115 @@
+import sys
+
+import pytest
+
+import row_store
+from conftest import make_rows
+from row_store import (
+    RowStore,
+    body_fields,
+    load_split_rows,
+    rows_per_block,
+    write_row_store,
+    write_split_rows,
+)
+
+
+def make_store_rows(n: int) -> list[dict]:
+    """`make_rows` with the body fields, and a field that only some of them have"""
+    rows = make_rows(n)
+    for i, row in enumerate(rows):
+        row['concatenated_messages'] = f'Ünïcode message ☃ {i}'
+        row['_alfred_item'] = f'{{"title": "{i}"}}'
+        if i % 7 == 0:
+            row['plugin_ids'] = ['plugin', i]
+    return rows
+
+
+@pytest.fixture
+def row_store_bin(tmp_path, monkeypatch):
+    path = tmp_path / 'row_store.bin'
+    monkeypatch.setattr(row_store, 'row_store_bin', path)
+    return path
+
+
+@pytest.mark.parametrize('msgpack', [True, False])
+@pytest.mark.parametrize('n', [0, 1, rows_per_block, 2 * rows_per_block + 3])
+def test_rows_are_read_as_they_were_written(row_store_bin, monkeypatch, msgpack, n):
+    if not msgpack:
+        # the metadata is written as JSON without msgpack
+        monkeypatch.setitem(sys.modules, 'msgpack', None)
+    rows = make_store_rows(n)
+    write_row_store(rows)
+    store = RowStore.load()
+    assert store.num_rows == store.num_decoded_rows == n
+    assert [dict(x) for x in store.rows()] == rows
+
+
+def test_bodies_are_only_read_when_accessed(row_store_bin):
+    write_row_store(make_store_rows(3))
+    row = RowStore.load().rows()[1]
+    assert row._bodies == {}
+    assert row['_search_key'] == make_store_rows(3)[1]['_search_key']
+    assert list(row._bodies) == ['_search_key']
+
+
+def test_there_is_no_store_to_load(row_store_bin):
+    assert RowStore.load() is None
+    row_store_bin.write_bytes(b'not a row store')
+    assert RowStore.load() is None
+
+
+@pytest.fixture
+def split_rows_paths(tmp_path, monkeypatch):
+    for name in (
+        'pre_computed_rows_meta_msgpack',
+        'pre_computed_rows_text_msgpack',
+        'pre_computed_rows_meta_json',
+        'pre_computed_rows_text_json',
+    ):
+        monkeypatch.setattr(row_store, name, tmp_path / getattr(row_store, name).name)
+
+
+@pytest.mark.parametrize('msgpack', [True, False])
+def test_split_rows_are_read_as_they_were_written(split_rows_paths, monkeypatch, msgpack):
+    if not msgpack:
+        # written as JSON Lines without msgpack
+        monkeypatch.setitem(sys.modules, 'msgpack', None)
+    rows = make_store_rows(5)
+    write_split_rows(rows)
+    loaded, num_rows = load_split_rows()
+    assert num_rows == 5
+    assert loaded == rows
+    # in the same order
+    assert [list(x) for x in loaded] == [list(x) for x in rows]
+
+    loaded, num_rows = load_split_rows(text=False)
+    assert num_rows == 5
+    assert loaded == [{k: None if k in body_fields else v for k, v in x.items()} for x in rows]
+
+
+def test_there_are_no_split_rows_to_load(split_rows_paths):
+    assert load_split_rows() is None
+
+
+@pytest.mark.parametrize('first', [0, 1, rows_per_block + 1, 10_000, -1])
+def test_only_the_blocks_of_the_first_rows_are_decoded(row_store_bin, first):
+    rows = make_store_rows(3 * rows_per_block)
+    write_row_store(rows)
+    store = RowStore.load(first)
+    num_decoded_rows = max(0, min(first, len(rows)))
+    assert store.num_rows == len(rows)
+    assert store.num_decoded_rows == num_decoded_rows
+    assert [dict(x) for x in store.rows()] == rows[:num_decoded_rows]
+    # whole blocks are decoded, but not the ones after the first rows
+    assert len(store.columns.get('id', [])) == -(-num_decoded_rows // rows_per_block) * rows_per_block
+
+
+@pytest.mark.parametrize('msgpack', [True, False])
+@pytest.mark.parametrize('first', [0, 2, 10, -1])
+def test_only_the_first_split_rows_are_loaded(split_rows_paths, monkeypatch, msgpack, first):
+    if not msgpack:
+        monkeypatch.setitem(sys.modules, 'msgpack', None)
+    rows = make_store_rows(5)
+    write_split_rows(rows)
+    assert load_split_rows(first=first) == (rows[: max(0, first)], 5)
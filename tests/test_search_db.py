@@ -0,0 +1,78 @@
+import re
+
+import pytest
+
+import search_db
+from conftest import make_rows
+from field_filters import parse_field_filter, row_matches
+from search_db import SearchDB, write_search_db
+
+
+def make_db_rows() -> list[dict]:
+    rows = make_rows(50)
+    for row in rows:
+        row['concatenated_messages'] = row['_search_key']
+    return rows
+
+
+def expected_row_ids(rows: list[dict], query: str) -> set[int]:
+    """The rows with the words of the plain subqueries (the last one a prefix) that match the filters"""
+
+    def has_phrase(row: dict, subquery: str) -> bool:
+        pattern = r'\b' + r'\W+'.join(re.findall(r'\w+', subquery))
+        return any(re.search(pattern, row[x].lower()) for x in ('title', 'concatenated_messages'))
+
+    subqueries = query.lower().split('|')
+    return {
+        i
+        for i, row in enumerate(rows)
+        if all(
+            row_matches(row, *parse_field_filter(x)) if '=' in x else has_phrase(row, x)
+            for x in subqueries
+        )
+    }
+
+
+@pytest.fixture
+def search_db_path(tmp_path, monkeypatch):
+    path = tmp_path / 'search.db'
+    monkeypatch.setattr(search_db, 'search_db_path', path)
+    return path
+
+
+@pytest.mark.parametrize(
+    'query',
+    ['python', 'sort', 'pyth', 'python sort', 'rust|egg', 'python|model=gpt-4o', 'egg|after=2024-06', 'w1', 'zzz'],
+)
+def test_search_finds_the_rows_with_the_words(search_db_path, query):
+    rows = make_db_rows()
+    write_search_db(rows)
+    assert set(SearchDB.load().search(query)) == expected_row_ids(rows, query)
+
+
+def test_title_matches_are_ranked_first(search_db_path):
+    rows = make_db_rows()
+    rows[10]['concatenated_messages'] += ' pancake'
+    rows[20]['title'] += ' Pancake'
+    write_search_db(rows)
+    assert SearchDB.load().search('pancake') == [20, 10]
+
+
+@pytest.mark.parametrize('query', ['re:python', '~pythn', 'python|color=red', ''])
+def test_queries_it_cant_answer(search_db_path, query):
+    write_search_db(make_db_rows())
+    assert SearchDB.load().search(query) is None
+
+
+def test_only_new_and_changed_rows_are_indexed_again(search_db_path, capsys):
+    rows = make_db_rows()
+    write_search_db(rows)
+    rows = make_db_rows()[1:]
+    rows[0]['_search_key'] = rows[0]['concatenated_messages'] = 'changed pancake'
+    capsys.readouterr()
+    write_search_db(rows)
+    assert '1 conversations indexed, 2 removed' in capsys.readouterr().out
+    db = SearchDB.load()
+    assert db.num_rows == len(rows)
+    for query in ('pancake', 'python', 'w1'):
+        assert set(db.search(query)) == expected_row_ids(rows, query)
@@ -0,0 +1,87 @@
+import pytest
+
+from alfred import filter_row_ids
+from conftest import make_rows
+from field_filters import InvalidFilterError, parse_field_filter
+from search_index import (
+    SearchIndex,
+    build_search_index,
+    osa_distance,
+    similar_words,
+    title_words,
+)
+
+
+@pytest.fixture(scope='module')
+def rows() -> list[dict]:
+    return make_rows()
+
+
+@pytest.fixture(scope='module')
+def index(rows) -> SearchIndex:
+    return SearchIndex(build_search_index(rows))
+
+
+@pytest.mark.parametrize(
+    'query',
+    ['python', 'pyth', 'thon', 'ytho', 'sort', 'ted', 'python sort', 'on s', 'rust|egg', 'w1', 'w12 ', 'zzz', 'py', ''],
+)
+def test_index_finds_the_same_rows_as_checking_every_row(rows, index, query):
+    assert filter_row_ids(rows, query, index=index) == filter_row_ids(rows, query)
+
+
+@pytest.mark.parametrize('query', ['w12', 'w12|egg', 'cython|trust'])
+def test_index_narrows_down_the_rows(rows, index, query):
+    candidates = index.candidates(query.split('|'))
+    assert candidates is not None
+    assert set(filter_row_ids(rows, query)) <= candidates < set(range(len(rows)))
+
+
+@pytest.mark.parametrize(
+    'query',
+    [
+        'model=gpt-4o',
+        'model=gpt',
+        'model=claude',
+        'after=2024-06',
+        'before=2024-03-15',
+        'created_after=2024-11',
+        'created_before=2024',
+        'python|model=gpt-4o|after=2024-06',
+        'title=sort',
+    ],
+)
+def test_field_index_finds_the_same_rows_as_checking_every_row(rows, index, query):
+    assert filter_row_ids(rows, query, index=index) == filter_row_ids(rows, query)
+
+
+@pytest.mark.parametrize('query', ['after=2024-12-20', 'model=gpt-4o|before=2024-03'])
+def test_field_index_narrows_down_the_rows(rows, index, query):
+    candidates = index.candidates(query.split('|'))
+    assert candidates is not None
+    assert set(filter_row_ids(rows, query)) <= candidates < set(range(len(rows)))
+
+
+@pytest.mark.parametrize('value', ['2024-13', '24', '2024-02-30'])
+def test_invalid_dates(value):
+    with pytest.raises(InvalidFilterError):
+        parse_field_filter(f'after={value}')
+
+
+@pytest.mark.parametrize(
+    'a, b, distance',
+    [('python', 'python', 0), ('pythn', 'python', 1), ('pyhton', 'python', 1), ('ptyhno', 'python', 2), ('java', 'python', 3)],
+)
+def test_osa_distance(a, b, distance):
+    assert osa_distance(a, b, 2) == distance
+
+
+@pytest.mark.parametrize('word', ['pythn', 'pyhton', 'pythonc', 'cyton', 'sortde', 'rust', 'eg', 'trsut', 'w12', 'zzzz'])
+def test_title_index_finds_the_same_words_as_checking_every_word(rows, index, word):
+    words = {x for row in rows for x in title_words(row)}
+    assert index.titles.similar_words(word) == similar_words(word, words)
+
+
+@pytest.mark.parametrize('query', ['~pythn', '~pyhton sortde', '~trsut|egg', '~w12', '~zzzz'])
+def test_fuzzy_queries_find_the_same_rows_with_the_title_index(rows, index, query):
+    assert filter_row_ids(rows, query, index=index) == filter_row_ids(rows, query)
@@ -0,0 +1,39 @@
+import random
+
+from utils import extract_snippet, get_terms_pattern, search_and_extract_preview
+
+
+def test_snippet_has_the_query_in_the_middle():
+    message = 'a' * 50 + 'needle' + 'b' * 50
+    assert search_and_extract_preview('needle', message, 16) == 'aaaaaneedlebbbbb'
+    assert search_and_extract_preview('NEEDLE', message, 16, case_sensitive=False) == 'aaaaaneedlebbbbb'
+    assert search_and_extract_preview('NEEDLE', message, 16) == ''
+
+
+def test_snippet_when_lowercasing_changes_the_length():
+    # 'İ'.lower() is two characters long
+    assert search_and_extract_preview('bc', 'İİİbBacAa\nbc', 10, case_sensitive=False) == 'İbBacAa\nbc'
+    assert search_and_extract_preview('bc', 'İİİ xBC', 4, case_sensitive=False) == ' xBC'
+
+
+def test_snippet_has_the_most_different_terms():
+    message = 'foo ' + 'x' * 40 + ' foo bar ' + 'y' * 40 + ' bar'
+    snippet, matches = extract_snippet(
+        get_terms_pattern(['foo', 'bar']), message, 12, num_terms=2
+    )
+    assert snippet == 'xx foo bar y'
+    assert [snippet[x:y] for x, y in matches] == ['foo', 'bar']
+
+
+def test_snippets_have_the_query_ignoring_case():
+    rng = random.Random(0)
+    for _ in range(10_000):
+        message = ''.join(rng.choice('abAB \nİß') for _ in range(rng.randint(0, 30)))
+        query = ''.join(rng.choice('abAB') for _ in range(rng.randint(1, 3)))
+        return_len = rng.randint(len(query), 12)
+        snippet = search_and_extract_preview(query, message, return_len, case_sensitive=False)
+        if query.lower() in message.lower() and len(message.lower()) == len(message):
+            assert query.lower() in snippet.lower()
+        if snippet:
+            assert query.lower() in snippet.lower()
+            assert len(snippet) == min(return_len, len(message))
@@ -0,0 +1,63 @@
+import pytest
+
+import search_index
+from alfred import filter_row_ids
+from conftest import make_rows
+from search_index import TrigramIndex, regex_query, write_trigram_index
+
+queries = ['python', 'thon s', 'on s', 'ython', 'w12', 'rust|egg', 'w1|sort', 'zzz', 'py', '']
+regex_queries = ['re:py(thon|pi)', 're:^w', 're:sort(ed)? w1\\d', 're:r?ust', 're:egg|boil', 're:[a-z]+']
+
+
+@pytest.fixture
+def trigram_index_bin(tmp_path, monkeypatch):
+    path = tmp_path / 'trigram_index.bin'
+    monkeypatch.setattr(search_index, 'trigram_index_bin', path)
+    return path
+
+
+@pytest.mark.parametrize('query', queries + regex_queries)
+def test_index_finds_the_same_rows_as_checking_every_row(trigram_index_bin, query):
+    rows = make_rows()
+    write_trigram_index(rows)
+    index = TrigramIndex.load()
+    assert filter_row_ids(rows, query, trigram_index=index) == filter_row_ids(rows, query)
+
+
+def test_index_narrows_down_the_rows(trigram_index_bin):
+    rows = make_rows()
+    write_trigram_index(rows)
+    index = TrigramIndex.load()
+    matches = set(filter_row_ids(rows, 'thon s'))
+    assert matches <= index.candidates(['thon s']) < set(range(len(rows)))
+    matches = set(filter_row_ids(rows, 're:w12\\d'))
+    assert matches <= index.regex_candidates('w12\\d') < set(range(len(rows)))
+
+
+def test_only_new_and_changed_rows_are_indexed_again(trigram_index_bin, capsys):
+    rows = make_rows()
+    write_trigram_index(rows)
+    changed = make_rows()[1:]
+    changed[0]['_search_key'] = 'python boil w1'
+    changed.append({'id': 'r-new', '_search_key': 'new egg'})
+    capsys.readouterr()
+    write_trigram_index(changed)
+    assert '2 documents indexed' in capsys.readouterr().out
+
+    index = TrigramIndex.load()
+    for query in queries + regex_queries:
+        assert filter_row_ids(changed, query, trigram_index=index) == filter_row_ids(changed, query)
+
+
+@pytest.mark.parametrize(
+    'pattern, expected',
+    [
+        ('hello.*world', ('and', ['hello', 'world'])),
+        ('(?:abc)+d', 'abc'),
+        ('foo|quux', ('or', ['foo', 'quux'])),
+        ('ab', None),
+        ('x?yz', None),
+    ],
+)
+def test_regex_query(pattern, expected):
+    assert regex_query(pattern) == expected
@@ -0,0 +1,43 @@
+import json
+import zipfile
+
+import pytest
+
+from conftest import conversations, make_conversation, run_python, set_config
+
+exported = [
+    *conversations,
+    make_conversation('c-uni', 'Ünïcode "quoted" title', 1_730_000_000, ['Ça va?', 'Très bien \\o/']),
+]
+
+
+def make_export_zip(workdir, conversations_json_name: str):
+    """A ChatGPT data export in the `downloads_dir` of `workdir`, with a few other members next to conversations.json"""
+    downloads_dir = workdir / 'Downloads'
+    downloads_dir.mkdir()
+    set_config(workdir, downloads_dir=str(downloads_dir))
+    zip_path = downloads_dir / f'{"0123456789abcdef" * 4}-2024-05-01-10-00-00.zip'
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr('user.json', json.dumps({'id': 'user-1'}))
+        zip_ref.writestr(conversations_json_name, json.dumps(exported, indent=2))
+        zip_ref.writestr('chat.html', '<html></html>')
+    return zip_path
+
+
+@pytest.mark.parametrize('conversations_json_name, jobs', [('conversations.json', '1'), ('export/conversations.json', '2')])
+def test_streaming_converts_the_same_as_extracting_then_converting(workdir, conversations_json_name, jobs):
+    zip_path = make_export_zip(workdir, conversations_json_name)
+
+    output = run_python(workdir, 'update_conversations_json.py', '--stream', '-j', jobs)
+    assert f'{len(exported)} conversations streamed from {zip_path}:{conversations_json_name}' in output
+    assert 'skipped 2 other members' in output
+    # nothing was extracted or copied
+    assert not (zip_path.parent / zip_path.stem).exists()
+    assert json.loads((workdir / 'conversations.json').read_text()) == conversations
+    streamed = (workdir / 'linear_conversations.json').read_bytes()
+
+    run_python(workdir, 'update_conversations_json.py')
+    assert json.loads((workdir / 'conversations.json').read_text()) == exported
+    run_python(workdir, 'convert_chatgpt_conversations_json.py', '-o', 'extracted.json')
+    assert streamed == (workdir / 'extracted.json').read_bytes()
+    assert [x['id'] for x in json.loads(streamed)] == [c['id'] for c in exported]
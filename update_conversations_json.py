@@ -6,13 +6,17 @@ Purpose: Copy the conversations.json latest downloaded ChatGPT data export to de
 """
 
 import argparse
+import os
+from pathlib import Path
+import time
 from config import (
     chatgpt_exported_conversations_json_path,
+    chatgpt_linear_conversations_json_path,
     downloads_dir,
     chatgpt_data_export_zip_regex_pattern,
     chatgpt_data_export_zip_glob_pattern,
 )
-from utils import find_last_added_file
+from utils import find_last_added_file, human_readable_size
 import zipfile
 
 
@@ -24,30 +28,118 @@ def get_args():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
 
+    parser.add_argument(
+        '-s',
+        '--stream',
+        help='Stream conversations.json out of the zip file straight into the converter, without extracting the archive or copying anything',
+        action='store_true',
+    )
+
+    parser.add_argument(
+        '-c',
+        '--compare',
+        help='With --stream, also time the extract-then-copy path (in a temporary dir) and report the time saved',
+        action='store_true',
+    )
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='With --stream, number of processes to convert conversations with, 0 for one per CPU',
+        metavar='N',
+        type=int,
+        default=1,
+    )
+
     return parser.parse_args()
 
 
+def get_conversations_json_member(zip_ref: zipfile.ZipFile) -> zipfile.ZipInfo:
+    for info in zip_ref.infolist():
+        if info.filename.rsplit('/', 1)[-1] == 'conversations.json':
+            return info
+    raise ValueError(f'No conversations.json found in {zip_ref.filename}')
+
+
+def extract_and_copy(zip_file_path: Path, extracted_dir: Path, destination: Path) -> Path:
+    """Extract the whole archive to `extracted_dir`, then copy conversations.json to `destination`"""
+    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+        zip_ref.extractall(extracted_dir)
+        member = get_conversations_json_member(zip_ref)
+
+    conversations_json_path = extracted_dir / member.filename
+    # copy the conversations.json to destination
+    import shutil
+
+    shutil.copyfile(conversations_json_path, destination)
+    return conversations_json_path
+
+
+def stream_into_converter(zip_file_path: Path, compare: bool = False, jobs: int = 1):
+    from convert_chatgpt_conversations_json import convert_conversations
+
+    start = time.perf_counter()
+    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+        member = get_conversations_json_member(zip_ref)
+        skipped = [x for x in zip_ref.infolist() if x is not member and not x.is_dir()]
+        with zip_ref.open(member) as f:
+            n = convert_conversations(
+                f, chatgpt_linear_conversations_json_path, jobs=jobs
+            )
+            bytes_read = f.tell()
+    stream_seconds = time.perf_counter() - start
+
+    print(
+        f'Done! {n} conversations streamed from {zip_file_path}:{member.filename} to {chatgpt_linear_conversations_json_path} .'
+    )
+    print(
+        f'Read {human_readable_size(bytes_read)} ({human_readable_size(member.compress_size)} compressed) in {stream_seconds:.2f}s, '
+        f'skipped {len(skipped)} other members ({human_readable_size(sum(x.file_size for x in skipped))}) '
+        f'and a {human_readable_size(member.file_size)} copy'
+    )
+
+    if compare:
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            start = time.perf_counter()
+            extract_and_copy(
+                zip_file_path, tmp_dir / 'extracted', tmp_dir / 'conversations.json'
+            )
+            with (tmp_dir / 'conversations.json').open('rb') as f:
+                convert_conversations(
+                    f, tmp_dir / 'linear_conversations.json', jobs=jobs
+                )
+            extract_seconds = time.perf_counter() - start
+        print(
+            f'Extract-then-copy and convert took {extract_seconds:.2f}s, '
+            f'streaming saved {extract_seconds - stream_seconds:.2f}s'
+        )
+
+
 def main():
     """Make a jazz noise here"""
 
-    get_args()
+    args = get_args()
     zip_file_path = find_last_added_file(
         downloads_dir,
         chatgpt_data_export_zip_glob_pattern,
         regex_pattern=chatgpt_data_export_zip_regex_pattern,
     )
+    if args.stream:
+        stream_into_converter(
+            zip_file_path, args.compare, args.jobs or os.cpu_count() or 1
+        )
+        return
+
     zip_file_extracted_dir = zip_file_path.parent / zip_file_path.stem
     zip_file_extracted_dir.mkdir(exist_ok=True)
 
     # unzip the zip file, copy the conversations.json to chatgpt_exported_conversations_json_path
-    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-        zip_ref.extractall(zip_file_extracted_dir)
-
-    conversations_json_path = zip_file_extracted_dir / 'conversations.json'
-    # copy the conversations.json to chatgpt_exported_conversations_json_path
-    import shutil
-
-    shutil.copyfile(conversations_json_path, chatgpt_exported_conversations_json_path)
+    conversations_json_path = extract_and_copy(
+        zip_file_path, zip_file_extracted_dir, chatgpt_exported_conversations_json_path
+    )
     print(
         f'Copied {conversations_json_path} to {chatgpt_exported_conversations_json_path}'
     )
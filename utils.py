@@ -1,15 +1,23 @@
 import os
-import platform
+import re
+import json
+import codecs
 from pathlib import Path
 from datetime import datetime
 from functools import cache
-from typing import Iterable, Literal
+from collections import deque
+from typing import IO, Any, Iterable, Iterator, Literal, Mapping
 
 from config import (
     gpt_4_icon_path,
     gpt_4_plugins_icon_path,
     gpt_4_code_interpreter_icon_path,
-    gpt_4_gizmo_icon_path
+    gpt_4_gizmo_icon_path,
+    related_query_prefix,
+    pre_computed_alfred_json,
+    pre_computed_alfred_pages_dir,
+    alfred_json_page_size,
+    page_query_prefix,
 )
 
 model_slug_to_model_name_map = {
@@ -73,46 +81,348 @@ def search_and_extract_preview(
     query: str, message: str, return_len: int, case_sensitive: bool = True
 ) -> str:
     """
-    write a python function with args `query, message, return_len: int`, that searches a str `query` inside of a str `message`, if `query in message`, returns a str with len of return_len. the returned str should have `query` in the middle of it.
-    add a `case_sensitive` bool arg that controls if the search should be done case-insensitively. note that the returned str should always match the case of that of `message`.
+    The `return_len` long part of `message` with `query` in the middle of it,
+    '' if `query` isn't in `message`.
     """
-    # query = "world"
-    # message = "Hello, World! How are you?"
-    # return_len = 15
-    # result = search_and_extract_preview(query, message, return_len, case_sensitive=False)
-    # print(result)
+    if not query:
+        return message[:return_len]
     if not case_sensitive:
         query = query.lower()
-        message_lower = message.lower()
-    else:
-        message_lower = message
-
-    if query in message_lower:
-        if len(query) >= return_len:
-            query_start_index = message_lower.index(query)
-            return message[query_start_index : query_start_index + return_len]
-
-        query_start_index = message_lower.index(query)
-        query_end_index = query_start_index + len(query)
-
-        padding = (return_len - len(query)) // 2
-        start_index = max(0, query_start_index - padding)
-        end_index = min(len(message), query_end_index + padding)
-
-        while end_index - start_index < return_len:
-            if start_index > 0:
-                start_index -= 1
-            elif end_index < len(message):
-                end_index += 1
-            else:
-                break
+    snippet, _ = extract_snippet(
+        get_terms_pattern([query]), message, return_len, message if case_sensitive else None
+    )
+    return snippet
+
 
-        return message[start_index:end_index]
+def get_terms_pattern(terms: Iterable[str]) -> re.Pattern:
+    """A pattern matching any of `terms` (longest first), to find all of them in a single scan"""
+    return re.compile(
+        '|'.join(re.escape(x) for x in sorted(set(terms), key=len, reverse=True) if x)
+        or '(?!)'
+    )
+
+
+def extract_snippet(
+    pattern: re.Pattern,
+    message: str,
+    return_len: int,
+    message_lower: str | None = None,
+    offset: int = 0,
+    num_terms: int = 1,
+) -> tuple[str, list[tuple[int, int]]]:
+    """
+    The `return_len` long part of `message` that has the most different matches of `pattern`
+    in it, with the matches in the middle, and the `(start, end)` offsets of the matches in it.
+    ('', []) if `pattern` doesn't match.
+
+    `pattern` (of lowercase terms) is matched against `message_lower` (`message.lower()`
+    if not given) from `offset` on, which has to have `message` lowercased there, with the
+    same length. The scan stops as soon as a part has `num_terms` different matches,
+    as no part has more.
+    """
+    if message_lower is None:
+        message_lower, offset = message.lower(), 0
+        if len(message_lower) != len(message):
+            # lowercasing changed the length (e.g. of 'İ'), so the offsets wouldn't line up
+            message_lower, pattern = message, re.compile(pattern.pattern, re.IGNORECASE)
+    # the (start, end, text) of the matches in a `return_len` long window, and how many times
+    # each text is in it, slid over the matches
+    window: deque[tuple[int, int, str]] = deque()
+    counts: dict[str, int] = {}
+    best_matches: list[tuple[int, int, str]] = []
+    best_count = 0
+    for match in pattern.finditer(message_lower, offset, offset + len(message)):
+        start, end = match.span()
+        if start == end:
+            continue
+        # the same term in a different case, if matched ignoring it
+        x = match.group().lower()
+        window.append((start, end, x))
+        counts[x] = counts.get(x, 0) + 1
+        while len(window) > 1 and end - window[0][0] > return_len:
+            _, _, x = window.popleft()
+            counts[x] -= 1
+            if not counts[x]:
+                del counts[x]
+        if len(counts) > best_count:
+            best_matches, best_count = list(window), len(counts)
+            if best_count >= num_terms:
+                break
+    if not best_matches:
+        return '', []
+    matches_start, matches_end = best_matches[0][0] - offset, best_matches[-1][1] - offset
+    if matches_end - matches_start >= return_len:
+        start = matches_start
     else:
-        return ''
+        # center the matches, the odd character going to the left
+        padding = return_len - (matches_end - matches_start)
+        start = max(0, matches_start - (padding - padding // 2))
+    end = min(len(message), start + return_len)
+    start = max(0, end - return_len) if end - start < return_len else start
+    return message[start:end], [
+        (max(0, x - offset - start), min(end, y - offset) - start)
+        for x, y, _ in best_matches
+        if x - offset < end
+    ]
+
+
+def human_readable_size(num_bytes: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num_bytes) < 1024 or unit == 'GB':
+            break
+        num_bytes /= 1024
+    return f'{num_bytes:.1f} {unit}' if unit != 'B' else f'{int(num_bytes)} B'
+
+
+class RawJSON(str):
+    """Already encoded JSON, written verbatim by `write_json_array`"""
+
+
+_json_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_array(
+    fp: IO[bytes], chunk_size: int = 1 << 20, with_raw: bool = False
+) -> Iterator[Any]:
+    """
+    Yield the elements of the top-level JSON array in the binary file `fp` one at a time.
+
+    Only the element being decoded is buffered, so memory use depends on the largest element
+    instead of the whole file.
+    With `with_raw`, yield `(element, raw_json_text)` tuples instead.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buf, pos, eof = '', 0, False
+
+    def read_more(size: int):
+        nonlocal buf, pos, eof
+        chunk = fp.read(size)
+        eof = not chunk
+        buf = buf[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+    def next_char() -> str:
+        # skip whitespace and return the next char, '' at EOF
+        nonlocal pos
+        while True:
+            pos = _json_whitespace.match(buf, pos).end()  # type: ignore
+            if pos < len(buf) or eof:
+                return buf[pos : pos + 1]
+            read_more(chunk_size)
+
+    if next_char() != '[':
+        raise ValueError('Expected a JSON array')
+    pos += 1
+    if next_char() == ']':
+        return
+    while True:
+        size = chunk_size
+        while True:
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+                # a value (e.g. a number) cut off at the end of the buffer may continue in the next chunk,
+                # so only accept it once it's followed by a delimiter
+                delimiter_pos = _json_whitespace.match(buf, end).end()  # type: ignore
+                if eof or buf[delimiter_pos : delimiter_pos + 1] in (',', ']'):
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            read_more(size)
+            # grow geometrically so a huge element isn't re-decoded once per chunk
+            size = max(size, len(buf))
+        if with_raw:
+            yield element, RawJSON(buf[pos:end])
+        else:
+            yield element
+        pos = end
+        match next_char():
+            case ',':
+                pos += 1
+                next_char()
+            case ']':
+                return
+            case c:
+                raise ValueError(f'Expected "," or "]" in JSON array, got {c!r}')
+
+
+# where an object ends and the next one in the same array starts, which can't be in a string,
+# since the `"` after the `{` would have to be escaped there
+_json_object_boundary = re.compile(rb'\}([ \t\n\r]*,[ \t\n\r]*)(?=\{[ \t\n\r]*")')
+
+
+def split_json_array(fp: IO[bytes], chunk_size: int = 1 << 20) -> Iterator[tuple[bytes, bytes]]:
+    """
+    Cut the top-level JSON array in the binary file `fp` into pieces, without decoding it.
+
+    Yields `(piece, separator)`, where the separator is what's between the piece and the next one.
+    The array is cut wherever an object is followed by another one, so a piece is usually
+    an element of the array, and otherwise (when an element has an array of objects in it,
+    or isn't an object) joining it and the next ones with their separators makes whole elements.
+    Only what hasn't been yielded is buffered.
+    """
+    buf, eof = b'', False
+    # enough to see past the BOM and the whitespace before the array
+    while not eof and (
+        len(buf) < len(codecs.BOM_UTF8) or not buf.removeprefix(codecs.BOM_UTF8).lstrip()
+    ):
+        chunk = fp.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+    buf = buf.removeprefix(codecs.BOM_UTF8).lstrip()
+    if not buf.startswith(b'['):
+        raise ValueError('Expected a JSON array')
+    start, search_start = 1, 1
+    size = chunk_size
+    while True:
+        if (m := _json_object_boundary.search(buf, search_start)) is not None:
+            yield buf[start : m.start() + 1].lstrip(), m.group(1)
+            start = search_start = m.end()
+            size = chunk_size
+        elif not eof:
+            chunk = fp.read(size)
+            eof = not chunk
+            buf = buf[start:] + chunk
+            # a boundary cut off at the end of the buffer is found in the next search
+            search_start = max(0, len(buf) - len(chunk) - 64)
+            start = 0
+            # grow geometrically so a huge element isn't searched once per chunk
+            size = max(size, len(buf))
+        else:
+            rest = buf[start:].rstrip()
+            if not rest.endswith(b']'):
+                raise ValueError('Expected "]" at the end of the JSON array')
+            if piece := rest[:-1].strip():
+                yield piece, b''
+            return
+
+
+def json_array_element(element: Any, indent: int = 2) -> RawJSON:
+    """Encode `element` the way `json.dumps(..., indent=indent)` encodes it nested in an array"""
+    dumped = json.dumps(element, indent=indent, ensure_ascii=False)
+    return RawJSON(dumped.replace('\n', '\n' + ' ' * indent))
+
+
+def write_json_array(
+    elements: Iterable,
+    fp: IO[str],
+    indent: int = 2,
+    spans: list[tuple[int, int]] | None = None,
+) -> int:
+    """
+    Write `elements` to `fp` as a JSON array as they are produced.
+
+    The output is identical to `json.dumps(list(elements), indent=indent, ensure_ascii=False)`.
+    `RawJSON` elements must already be indented for nesting in the array,
+    like the ones from `json_array_element`, or the raw elements `iter_json_array` yields
+    from a file written by this function.
+    If `spans` is given, the byte offset and length of every element in the UTF-8 encoded
+    output are appended to it, so that they can be read from the file later.
+    Returns the number of elements written.
+    """
+    prefix = ' ' * indent
+    n = 0
+    position = 0
+    for element in elements:
+        fp.write(',\n' if n else '[\n')
+        if not isinstance(element, RawJSON):
+            element = json_array_element(element, indent)
+        fp.write(prefix + element)
+        if spans is not None:
+            position += len(',\n' if n else '[\n') + len(prefix)
+            length = len(element.encode())
+            spans.append((position, length))
+            position += length
+        n += 1
+    fp.write('\n]' if n else '[]')
+    return n
+
+
+def content_hash(text: str) -> str:
+    import hashlib
+
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+# what the messages of a conversation are joined with in `concatenated_messages`
+messages_separator = '\n---\n'
+
+
+def row_messages(row: Mapping[str, Any]) -> list[str]:
+    """The messages of a pre-computed row, split out of its `concatenated_messages`"""
+    messages, start = [], 0
+    for length in row['_message_lengths']:
+        messages.append(row['concatenated_messages'][start : start + length])
+        start += length + len(messages_separator)
+    return messages
+
+
+def write_text_if_changed(path: Path, text: str) -> bool:
+    """
+    Write `text` to `path` unless the file already has that content (by its size and hash),
+    so that unchanged files aren't rewritten. Returns whether it was written.
+    """
+    data = text.encode()
+    try:
+        if path.stat().st_size == len(data) and content_hash(
+            path.read_text(encoding='utf-8')
+        ) == content_hash(text):
+            return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    path.write_bytes(data)
+    return True
+
+
+def get_manifest_path(output_path: Path) -> Path:
+    """Path of the manifest saved next to `output_path`"""
+    return output_path.with_name(f'{output_path.stem}.manifest.json')
+
+
+def load_manifest(manifest_path: Path, meta: dict | None = None) -> dict[str, list]:
+    """
+    Load the `{conversation_id: [update_time, content_hash]}` manifest saved by `save_manifest`.
+
+    Returns an empty manifest if there isn't one, or if it was saved with a different `meta`
+    (the settings the saved outputs depend on), so that everything is processed again.
+    """
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get('meta') != (meta or {}):
+        return {}
+    return manifest['conversations']
+
+
+def save_manifest(
+    manifest_path: Path,
+    conversations: dict[str, list],
+    meta: dict | None = None,
+    spans: dict[str, tuple[int, int]] | None = None,
+):
+    """
+    `spans` are the byte offsets and lengths of the outputs of the conversations, if they're
+    in a JSON array written by `write_json_array`, see `load_manifest_spans`
+    """
+    manifest = {'meta': meta or {}, 'conversations': conversations}
+    if spans is not None:
+        manifest['spans'] = spans
+    manifest_path.write_text(json.dumps(manifest))
+
+
+def load_manifest_spans(manifest_path: Path) -> dict[str, list[int]]:
+    """The `{conversation_id: [offset, length]}` spans saved by `save_manifest`, empty if there aren't any"""
+    try:
+        return json.loads(manifest_path.read_text()).get('spans') or {}
+    except (FileNotFoundError, ValueError, AttributeError):
+        return {}
 
 
 def get_creation_time(file_path: os.PathLike) -> float | int:
+    import platform
+
     if platform.system() == "Windows":
         return os.path.getctime(file_path)
     else:
@@ -169,6 +479,111 @@ def find_files(
     return files
 
 
+def row_to_alfred_item(row: dict, subtitle: str | None = None) -> dict:
+    """
+    The Alfred Script Filter JSON item for a pre-computed row,
+    the same as the `Item3(...).obj` that `alfred.prepare_wf_items` builds for it.
+    """
+    item3_kwargs = row['_item3_kwargs']
+    icon = {}
+    if 'icon' in item3_kwargs:
+        icon['path'] = item3_kwargs['icon']
+    if 'icontype' in item3_kwargs:
+        icon['type'] = item3_kwargs['icontype']
+    item = {
+        'title': row['_title'],
+        'subtitle': row['_message_preview'] if subtitle is None else subtitle,
+        'valid': True,
+        'arg': row['_chatgpt_url'],
+        # Tab lists the related conversations
+        'autocomplete': f'{related_query_prefix}{row["id"]}',
+        'quicklookurl': row['_quicklookurl'],
+    }
+    cmd_modifier = {
+        'subtitle': 'Open on TypingMind',
+        'arg': row['_typingmind_url'],
+        'valid': True,
+    }
+    if icon:
+        item['icon'] = icon
+        cmd_modifier['icon'] = icon
+    item['mods'] = {'cmd': cmd_modifier}
+    return item
+
+
+# stands for the subtitle in the fragments of `row_to_alfred_item_fragment`,
+# JSON escapes it anywhere else
+alfred_item_subtitle_placeholder = '\0'
+
+
+def row_to_alfred_item_fragment(row: dict) -> str:
+    """
+    `row_to_alfred_item(row)` encoded as JSON, with `alfred_item_subtitle_placeholder`
+    in place of the (encoded) subtitle, to be filled in by `fill_alfred_item_fragment`.
+    """
+    item = row_to_alfred_item(row, '')
+    fragment = json.dumps(item)
+    # the subtitle comes right after the title
+    i = len(f'{{"title": {json.dumps(item["title"])}, "subtitle": ')
+    return fragment[:i] + alfred_item_subtitle_placeholder + fragment[i + len('""') :]
+
+
+def fill_alfred_item_fragment(fragment: str, subtitle: str) -> str:
+    """`json.dumps(row_to_alfred_item(row, subtitle))`, given the fragment of the row"""
+    return fragment.replace(alfred_item_subtitle_placeholder, json.dumps(subtitle), 1)
+
+
+def write_alfred_json(rows: Iterable[Mapping[str, Any]]) -> int:
+    """
+    Write the Alfred JSON that an empty query shows, the items of `rows`, most recently updated
+    first: to `pre_computed_alfred_json`, or if `alfred_json_page_size` isn't 0,
+    `alfred_json_page_size` items to a page in `pre_computed_alfred_pages_dir`, each
+    (but the last) ending with an item that Tab goes to the next page with.
+    Returns the number of pages, 0 if they aren't paged.
+    """
+    rows = sorted(rows, key=lambda row: row.get('update_time') or '', reverse=True)
+    fragments = [
+        fill_alfred_item_fragment(
+            row.get('_alfred_item') or row_to_alfred_item_fragment(row),
+            row['_message_preview'],
+        )
+        for row in rows
+    ]
+    old_pages = set(pre_computed_alfred_pages_dir.glob('*.json'))
+    if not alfred_json_page_size:
+        _write_alfred_items(pre_computed_alfred_json, fragments)
+        for path in old_pages:
+            path.unlink()
+        return 0
+
+    pre_computed_alfred_pages_dir.mkdir(parents=True, exist_ok=True)
+    num_pages = max(1, -(-len(fragments) // alfred_json_page_size))
+    for page in range(1, num_pages + 1):
+        start = (page - 1) * alfred_json_page_size
+        page_fragments = fragments[start : start + alfred_json_page_size]
+        if page < num_pages:
+            item = {
+                'title': f'Older conversations (page {page + 1} of {num_pages})',
+                'subtitle': 'Press Tab to show them',
+                'valid': False,
+                'autocomplete': f'{page_query_prefix}{page + 1}',
+            }
+            page_fragments.append(json.dumps(item))
+        path = pre_computed_alfred_pages_dir / f'{page}.json'
+        _write_alfred_items(path, page_fragments)
+        old_pages.discard(path)
+    for path in old_pages:
+        path.unlink()
+    pre_computed_alfred_json.unlink(missing_ok=True)
+    return num_pages
+
+
+def _write_alfred_items(path: Path, fragments: list[str]):
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    tmp_path.write_text('{"items": [' + ', '.join(fragments) + ']}')
+    tmp_path.replace(path)
+
+
 def get_model_short_subtitle_suffix_update_item3_kwargs(
     date_short: str, model: str, item3_kwargs: dict
 ) -> tuple[str, str]: